@@ -16,21 +16,31 @@ from typing import TYPE_CHECKING, Optional
 import pytz
 import requests
 import schedule
-from business.mqtt import mqtt_publish, publish_device_state, publish_site_state, register_subscribe_topic
+from business.discovery_store import DISCOVERY_STORE
+from business.media import insert_watermark
+from business.mqtt import (
+    SUBSCRIBE_TOPICS,
+    is_command_topic,
+    mqtt_publish,
+    publish_bridge_availability,
+    publish_device_state,
+    publish_site_state,
+    register_subscribe_topic,
+)
+from business.snapshot import STATE_SNAPSHOT
 from business.tempfiles import remove_temp_file, write_temp_bytes
-from business.watermark import insert_watermark
 from constants import REQUEST_TIMEOUT, RETRY_STATUS_CODES
 from exceptions import SomfyProtectInitError
+from homeassistant.discovery_compiler import DISCOVERY_COMPILER, DeviceDiscovery
 from homeassistant.ha_discovery import (
     ALARM_STATUS,
-    DEVICE_CAPABILITIES,
     ha_discovery_alarm,
     ha_discovery_alarm_actions,
-    ha_discovery_cameras,
-    ha_discovery_devices,
+    ha_discovery_device_bundle,
     ha_discovery_history,
 )
-from somfy_protect.api import SIREN_TEST_SOUNDS, SomfyProtectApi
+from jsoncodec import encode_constant
+from somfy_protect.api import SomfyProtectApi
 from somfy_protect.api.devices.category import Category
 from utils import build_retry_adapter
 
@@ -49,6 +59,7 @@ PROCESSED_MEDIA_LOCK = threading.RLock()
 PROCESSED_MEDIA: OrderedDict[str, str] = OrderedDict()
 PROCESSED_MEDIA_LOADED = threading.Event()
 MAX_MEDIA_FILENAME_COMPONENT_LENGTH = 80
+MIGRATE_DISCOVERY = encode_constant({"migrate_discovery": True})
 
 
 def _create_http_session() -> requests.Session:
@@ -163,10 +174,14 @@ def build_media_file_path(
 def _publish_config(mqtt_client: MQTTClient, config: Optional[dict], payload: Optional[dict] = None) -> None:
     if not config:
         return
+    payload = payload if payload is not None else config.get("config")
+    STATE_SNAPSHOT.record_discovery(config.get("topic"), payload)
+    if not DISCOVERY_STORE.should_publish(config.get("topic"), payload):
+        return
     mqtt_publish(
         mqtt_client=mqtt_client,
         topic=config.get("topic"),
-        payload=payload if payload is not None else config.get("config"),
+        payload=payload,
         retain=True,
     )
 
@@ -175,9 +190,16 @@ def _subscribe_command(mqtt_client: MQTTClient, config: Optional[dict]) -> None:
     if not config:
         return
     command_topic = config.get("config", {}).get("command_topic")
-    if command_topic:
-        mqtt_client.client.subscribe(command_topic)
-        register_subscribe_topic(command_topic)
+    _subscribe_topic(mqtt_client, command_topic)
+
+
+def _subscribe_topic(mqtt_client: MQTTClient, topic: Optional[str]) -> None:
+    # Command topics are covered by the wildcard subscriptions, known topics are already
+    # subscribed, and both are re-subscribed by on_connect after a reconnect
+    if not topic or topic in SUBSCRIBE_TOPICS or is_command_topic(topic):
+        return
+    mqtt_client.client.subscribe(topic)
+    register_subscribe_topic(topic)
 
 
 def _publish_and_subscribe(mqtt_client: MQTTClient, config: Optional[dict], payload: Optional[dict] = None) -> None:
@@ -185,16 +207,42 @@ def _publish_and_subscribe(mqtt_client: MQTTClient, config: Optional[dict], payl
     _subscribe_command(mqtt_client, config)
 
 
-def _publish_snapshot_command_topics(mqtt_config: dict, site_id: str, device_id: str) -> None:
-    topic_prefix = mqtt_config.get("topic_prefix", "somfyProtect2mqtt")
-    register_subscribe_topic(f"{topic_prefix}/{site_id}/{device_id}/video_backend")
+def warm_start(mqtt_client: MQTTClient, mqtt_config: dict, my_sites: list) -> list:
+    """Replay the persisted state snapshot, before the Somfy API is reached.
 
+    Discovery configs and last known states are republished and command topics
+    subscribed, so Home Assistant is usable while the live refresh runs.
 
-def _publish_stream_command_topics(mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device_id: str) -> None:
-    topic_prefix = mqtt_config.get("topic_prefix", "somfyProtect2mqtt")
-    stream_topic = f"{topic_prefix}/{site_id}/{device_id}/stream"
-    mqtt_client.client.subscribe(stream_topic)
-    register_subscribe_topic(stream_topic)
+    Args:
+        mqtt_client (MQTTClient): MQTT client.
+        mqtt_config (dict): MQTT configuration.
+        my_sites (list): Configured site labels.
+
+    Returns:
+        list: Site IDs known from the snapshot, empty without a usable snapshot.
+    """
+    site_ids = [site_id for site_id, label in list(STATE_SNAPSHOT.sites.items()) if label in my_sites]
+    if not site_ids or STATE_SNAPSHOT.replayed:
+        return site_ids
+    STATE_SNAPSHOT.replayed = True
+    LOGGER.info("Warm start from state snapshot for {} site(s)".format(len(site_ids)))
+    publish_bridge_availability(mqtt_client, mqtt_config)
+    for topic, config in list(STATE_SNAPSHOT.discovery.items()):
+        if DISCOVERY_STORE.should_publish(topic, config):
+            mqtt_publish(mqtt_client=mqtt_client, topic=topic, payload=config, retain=True)
+        _subscribe_command(mqtt_client, {"config": config})
+        for component in (config.get("components") or {}).values():
+            _subscribe_command(mqtt_client, {"config": component})
+    for topic, payload in list(STATE_SNAPSHOT.states.items()):
+        mqtt_publish(mqtt_client=mqtt_client, topic=topic, payload=payload, retain=True)
+    return site_ids
+
+
+def remove_discovery_configs(mqtt_client: MQTTClient, topics: list) -> None:
+    """Remove Home Assistant entities by clearing their retained discovery configs."""
+    for topic in topics:
+        LOGGER.info("Removing discovery config {}".format(topic))
+        mqtt_publish(mqtt_client=mqtt_client, topic=topic, payload="", retain=True, is_json=False)
 
 
 def ha_sites_config(
@@ -251,248 +299,33 @@ def convert_utc_to_paris(date: datetime) -> datetime:
     return paris_date
 
 
-def _configure_device_state_sensors(mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device) -> None:
-    settings = device.settings.get("global") or {}
-    status = device.status
-    status_settings = {**status, **settings}
-    for state in status_settings:
-        if not DEVICE_CAPABILITIES.get(state):
-            LOGGER.debug("No Config for {}".format(state))
-            continue
-        device_config = ha_discovery_devices(
-            site_id=site_id,
-            device=device,
-            mqtt_config=mqtt_config,
-            sensor_name=state,
-        )
-        if state in ["human_detect_enabled"]:
-            _publish_config(mqtt_client, device_config, payload={})
-        else:
-            _publish_config(mqtt_client, device_config)
-        _subscribe_command(mqtt_client, device_config)
-
-
-def _configure_box_device(mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device, device_type: str) -> None:
-    if "box" not in device_type:
-        return
-    LOGGER.info("Found Link {}".format(device.device_definition.get("label")))
-    for action in ["reboot", "halt"]:
-        config = ha_discovery_devices(
-            site_id=site_id,
-            device=device,
-            mqtt_config=mqtt_config,
-            sensor_name=action,
-        )
-        _publish_and_subscribe(mqtt_client, config)
-
-
-def _configure_camera_device(
-    mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device, device_type: str
-) -> None:
-    if "camera" not in device_type and "allinone" not in device_type:
-        return
-    LOGGER.info("Found Camera {}".format(device.device_definition.get("label")))
-    camera_config = ha_discovery_cameras(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-    )
-    _publish_config(mqtt_client, camera_config)
-    for action in ["reboot", "halt"]:
-        config = ha_discovery_devices(
-            site_id=site_id,
-            device=device,
-            mqtt_config=mqtt_config,
-            sensor_name=action,
-        )
-        _publish_and_subscribe(mqtt_client, config)
-    device_config = ha_discovery_devices(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-        sensor_name="snapshot",
-    )
-    _publish_and_subscribe(mqtt_client, device_config)
-    video_backend = ha_discovery_devices(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-        sensor_name="video_backend",
-    )
-    _publish_and_subscribe(mqtt_client, video_backend)
-    if video_backend and video_backend.get("config", {}).get("command_topic"):
-        _publish_snapshot_command_topics(mqtt_config, site_id, device.id)
-    stream = ha_discovery_devices(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-        sensor_name="stream",
-    )
-    _publish_and_subscribe(mqtt_client, stream)
-    if stream and stream.get("config", {}).get("command_topic"):
-        _publish_stream_command_topics(mqtt_client, mqtt_config, site_id, device.id)
-
-
-def _configure_remote_device(
-    mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device, device_type: str
+def _publish_device_discovery(
+    mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device, discovery: DeviceDiscovery
 ) -> None:
-    if "remote" not in device_type:
-        return
-    LOGGER.info("Found {}".format(device.device_definition.get("label")))
-    key_fob_config = ha_discovery_devices(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-        sensor_name="presence",
-    )
-    _publish_config(mqtt_client, key_fob_config)
-
-
-def _configure_outdoor_siren(mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device) -> None:
-    if "mss_outdoor_siren" not in (device.device_definition.get("device_definition_id") or ""):
-        return
-    config = ha_discovery_devices(
+    entity_configs = [config for config, payload in discovery.configs if payload is None]
+    device_config = ha_discovery_device_bundle(
         site_id=site_id,
         device=device,
         mqtt_config=mqtt_config,
-        sensor_name="test_siren1s",
+        entity_configs=entity_configs,
     )
-    _publish_and_subscribe(mqtt_client, config)
-
-
-def _configure_siren(mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device) -> None:
-    if "mss_siren" not in (device.device_definition.get("device_definition_id") or ""):
-        return
-    mss_siren = None
-    for sensor in SIREN_TEST_SOUNDS:
-        LOGGER.info("Found mss_siren, adding sound test: {}".format(sensor))
-        mss_siren = ha_discovery_devices(
-            site_id=site_id,
-            device=device,
-            mqtt_config=mqtt_config,
-            sensor_name=f"test_{sensor}",
-        )
-        _publish_config(mqtt_client, mss_siren)
-        _subscribe_command(mqtt_client, mss_siren)
-
-
-def _configure_motion_device(
-    mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device, device_type: str
-) -> None:
-    if "pir" not in device_type and "tag" not in device_type:
-        return
-    LOGGER.info("Found Motion Sensor (PIR & IntelliTag) {}".format(device.device_definition.get("label")))
-    pir_config = ha_discovery_devices(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-        sensor_name="motion_sensor",
-    )
-    _publish_config(mqtt_client, pir_config)
-    if pir_config:
-        mqtt_publish(
-            mqtt_client=mqtt_client,
-            topic=pir_config.get("config", {}).get("state_topic"),
-            payload={"motion_sensor": "False"},
-            retain=True,
-        )
-
-
-def _configure_smoke_device(mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device, device_type: str) -> None:
-    if "smoke" not in device_type:
-        return
-    LOGGER.info("Found {}".format(device.device_definition.get("label")))
-    smoke_config = ha_discovery_devices(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-        sensor_name="smoke",
-    )
-    _publish_config(mqtt_client, smoke_config)
-    if smoke_config:
-        mqtt_publish(
-            mqtt_client=mqtt_client,
-            topic=smoke_config.get("config", {}).get("state_topic"),
-            payload={"smoke": "False"},
-            retain=True,
-        )
-
-
-def _configure_doorlock_device(
-    mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device, device_type: str
-) -> None:
-    if device_type != "doorlock":
-        return
-    LOGGER.info("DoorLock {}".format(device.device_definition.get("label")))
-    for sensor_name in ["open_door", "door_force_lock"]:
-        config = ha_discovery_devices(
-            site_id=site_id,
-            device=device,
-            mqtt_config=mqtt_config,
-            sensor_name=sensor_name,
-        )
-        _publish_and_subscribe(mqtt_client, config)
-
-
-def _configure_videophone_device(
-    mqtt_client: MQTTClient, mqtt_config: dict, site_id: str, device, device_type: str
-) -> None:
-    if "videophone" not in device_type:
-        return
-    LOGGER.info("VideoPhone {}".format(device.device_definition.get("label")))
-    camera_config = ha_discovery_cameras(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-    )
-    _publish_config(mqtt_client, camera_config)
-    ringing_config = ha_discovery_devices(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-        sensor_name="ringing",
-    )
-    _publish_config(mqtt_client, ringing_config)
-    if ringing_config:
-        mqtt_publish(
-            mqtt_client=mqtt_client,
-            topic=ringing_config.get("config", {}).get("state_topic"),
-            payload={"ringing": "False"},
-            retain=True,
-        )
-    for action in ["reboot", "halt", "open_latch", "open_gate"]:
-        config = ha_discovery_devices(
-            site_id=site_id,
-            device=device,
-            mqtt_config=mqtt_config,
-            sensor_name=action,
-        )
-        _publish_and_subscribe(mqtt_client, config)
-    device_config = ha_discovery_devices(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-        sensor_name="snapshot",
-    )
-    _publish_and_subscribe(mqtt_client, device_config)
-    stream = ha_discovery_devices(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-        sensor_name="stream",
-    )
-    _publish_and_subscribe(mqtt_client, stream)
-    if stream and stream.get("config", {}).get("command_topic"):
-        _publish_stream_command_topics(mqtt_client, mqtt_config, site_id, device.id)
-    video_backend = ha_discovery_devices(
-        site_id=site_id,
-        device=device,
-        mqtt_config=mqtt_config,
-        sensor_name="video_backend",
-    )
-    _publish_and_subscribe(mqtt_client, video_backend)
-    if video_backend and video_backend.get("config", {}).get("command_topic"):
-        _publish_snapshot_command_topics(mqtt_config, site_id, device.id)
+    # Without a complete store (first run, file missing), any entity may have been published one by one
+    first_run = not DISCOVERY_STORE.complete
+    unknown_topics = []
+    for config, _ in discovery.configs:
+        # Entities published one by one before are handed over to the device config,
+        # their old topics are then cleared by the end of the discovery run
+        topic = config.get("topic")
+        known = DISCOVERY_STORE.is_known(topic)
+        if known or first_run:
+            mqtt_publish(mqtt_client=mqtt_client, topic=topic, payload=MIGRATE_DISCOVERY, retain=True)
+        if first_run and not known:
+            unknown_topics.append(topic)
+        _subscribe_command(mqtt_client, config)
+    if device_config["config"]["components"]:
+        _publish_config(mqtt_client, device_config)
+    # Not in the store, the end of the discovery run would not clear them
+    remove_discovery_configs(mqtt_client, unknown_topics)
 
 
 def ha_devices_config(
@@ -503,21 +336,24 @@ def ha_devices_config(
 ) -> None:
     """HA Devices Config"""
     LOGGER.info("Looking for Devices")
+    device_mode = mqtt_config.get("discovery_mode", "entity") == "device"
     for site_id in my_sites_id:
         my_devices = api.get_devices(site_id=site_id)
         for device in my_devices:
             LOGGER.info("Configuring Device: {}".format(device.label))
-            device_type = device.device_definition.get("type") or ""
-            _configure_device_state_sensors(mqtt_client, mqtt_config, site_id, device)
-            _configure_box_device(mqtt_client, mqtt_config, site_id, device, device_type)
-            _configure_camera_device(mqtt_client, mqtt_config, site_id, device, device_type)
-            _configure_remote_device(mqtt_client, mqtt_config, site_id, device, device_type)
-            _configure_outdoor_siren(mqtt_client, mqtt_config, site_id, device)
-            _configure_siren(mqtt_client, mqtt_config, site_id, device)
-            _configure_motion_device(mqtt_client, mqtt_config, site_id, device, device_type)
-            _configure_smoke_device(mqtt_client, mqtt_config, site_id, device, device_type)
-            _configure_doorlock_device(mqtt_client, mqtt_config, site_id, device, device_type)
-            _configure_videophone_device(mqtt_client, mqtt_config, site_id, device, device_type)
+            discovery = DISCOVERY_COMPILER.compile_device(site_id, device, mqtt_config)
+
+            if device_mode:
+                _publish_device_discovery(mqtt_client, mqtt_config, site_id, device, discovery)
+            else:
+                for config, payload in discovery.configs:
+                    _publish_and_subscribe(mqtt_client, config, payload=payload)
+            for topic in discovery.topics:
+                _subscribe_topic(mqtt_client, topic)
+            for topic in discovery.registrations:
+                register_subscribe_topic(topic)
+            for topic, payload in discovery.states:
+                mqtt_publish(mqtt_client=mqtt_client, topic=topic, payload=payload, retain=True)
 
 
 def update_sites_status(
@@ -556,8 +392,10 @@ def _publish_site_history(
     mqtt_client: MQTTClient,
     mqtt_config: dict,
     site_id: str,
+    events: Optional[list] = None,
 ) -> None:
-    events = api.get_history(site_id=site_id)
+    if events is None:
+        events = api.get_history(site_id=site_id)
     for event in events:
         if not event:
             continue
@@ -599,6 +437,48 @@ def _publish_site_history(
         )
 
 
+def catch_up_sites(
+    api: SomfyProtectApi,
+    mqtt_client: MQTTClient,
+    mqtt_config: dict,
+    my_sites_id: list,
+    since: datetime,
+) -> int:
+    """Publish what changed on the sites while the websocket was disconnected.
+
+    The site state, including an alarm still ongoing, the history and the
+    devices status are fetched from the REST API, so that the MQTT topics
+    reflect transitions whose websocket events were missed.
+
+    Args:
+        api (SomfyProtectApi): Somfy Protect API.
+        mqtt_client (MQTTClient): MQTT client.
+        mqtt_config (dict): MQTT configuration.
+        my_sites_id (list): Site IDs to catch up.
+        since (datetime): UTC time of the last websocket event handled.
+
+    Returns:
+        int: History events which occurred since then.
+    """
+    missed = 0
+    for site_id in my_sites_id:
+        try:
+            site = api.get_site(site_id=site_id)
+            if site.alarm:
+                LOGGER.info("Alarm ongoing on {}".format(site.label))
+            publish_site_state(mqtt_client, mqtt_config, site_id, "triggered" if site.alarm else site.security_level)
+            events = api.get_history(site_id=site_id)
+            for event in events:
+                occurred_at = (event or {}).get("occurred_at")
+                if occurred_at and datetime.strptime(occurred_at, "%Y-%m-%dT%H:%M:%S.%fZ") > since:
+                    missed += 1
+            _publish_site_history(api, mqtt_client, mqtt_config, site_id, events=events)
+        except (requests.exceptions.RequestException, KeyError, ValueError, OSError) as e:
+            LOGGER.warning("Error while catching up site {}: {}".format(site_id, e))
+    update_devices_status(api, mqtt_client, mqtt_config, my_sites_id)
+    return missed
+
+
 def update_devices_status(
     api: SomfyProtectApi,
     mqtt_client: MQTTClient,
@@ -0,0 +1,95 @@
+"""Hashes of the published Home Assistant discovery configs"""
+
+import hashlib
+import json
+import logging
+import threading
+
+from utils.persisted import PersistedJsonStore
+
+LOGGER = logging.getLogger(__name__)
+
+DISCOVERY_STORE_FILENAME = "discovery_hashes.json"
+DISCOVERY_STORE_VERSION = 1
+
+
+def config_hash(payload) -> str:
+    """Return a stable hash of a discovery payload."""
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf8")).hexdigest()[:32]
+
+
+class DiscoveryStore(PersistedJsonStore):
+    """Remember which discovery configs the broker already retains.
+
+    Each config is published only when it is new or its hash changed. A full
+    discovery run is bracketed by ``begin_refresh``/``commit_refresh``; configs
+    not generated again belong to removed entities and are returned so they can
+    be cleared from the broker.
+    """
+
+    VERSION = DISCOVERY_STORE_VERSION
+    DESCRIPTION = "discovery hashes"
+
+    def __init__(self, path: str | None = None):
+        super().__init__(path)
+        self.hashes: dict[str, str] = {}
+        self.refresh_requested = threading.Event()
+        # Whether hashes cover every config the broker may retain: loaded from the store file,
+        # or filled by a discovery run. Not on the first run, or when the file is missing.
+        self.complete = False
+        self._force = False
+
+    def _dump(self) -> dict:
+        return {"hashes": dict(self.hashes)}
+
+    def _restore(self, content: dict) -> None:
+        self.hashes = {str(k): str(v) for k, v in (content.get("hashes") or {}).items()}
+        self.complete = True
+
+    def _summary(self) -> str:
+        return "{} discovery hash(es)".format(len(self.hashes))
+
+    def should_publish(self, topic: str, payload) -> bool:
+        """Return True when a config is new or changed, and remember it as published.
+
+        Args:
+            topic (str): Discovery topic.
+            payload: Discovery payload.
+
+        Returns:
+            bool: Whether the config has to be published.
+        """
+        digest = config_hash(payload)
+        with self._lock:
+            self._touch(topic)
+            if self.hashes.get(topic) == digest and not self._force:
+                return False
+            self.hashes[topic] = digest
+            self._dirty = True
+            return True
+
+    def is_known(self, topic: str) -> bool:
+        """Return True when a config was published on this topic and not removed since."""
+        with self._lock:
+            return topic in self.hashes
+
+    def commit_refresh(self) -> list[str]:
+        """Forget the configs the discovery run did not generate again.
+
+        Returns:
+            list[str]: Topics of the removed entities.
+        """
+        with self._lock:
+            self._force = False
+            self.complete = True
+            return self._forget_untouched(self.hashes, self._end_refresh())
+
+    def invalidate(self) -> None:
+        """Ask for a discovery run publishing every config again (e.g. Home Assistant restarted)."""
+        with self._lock:
+            self._force = True
+        self.refresh_requested.set()
+
+
+DISCOVERY_STORE = DiscoveryStore()
@@ -0,0 +1,225 @@
+"""Blocking IO run off the websocket loop, in lanes
+
+Websocket events trigger blocking work: alarm side-effects, snapshot and clip
+downloads, MQTT frame streaming. Each kind of short task runs in its own lane,
+with its own workers and queue limit, so that a burst of clip downloads cannot
+hold back an alarm side-effect. When a media lane is full, its oldest task is
+dropped: a newer snapshot supersedes it. Other lanes refuse the new task.
+Streams last as long as the camera sends frames, so each one gets its own
+thread instead, up to a number of concurrent streams beyond which new ones are
+refused. Tasks run in the context they were submitted from, so that the
+websocket event behind them is traced up to their publishes.
+"""
+
+import collections
+import contextvars
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+from constants import MAX_CONCURRENT_STREAMS, SNAPSHOT_QUEUE_MAXSIZE
+from metrics import METRICS
+
+LOGGER = logging.getLogger(__name__)
+
+LANE_ALARM = "alarm"
+LANE_SNAPSHOT = "snapshot"
+LANE_CLIP = "clip"
+
+
+class Lane:
+    """Queue of one kind of task, with its workers.
+
+    Args:
+        name (str): Lane name, used in thread and metric names.
+        workers (int): Number of worker threads.
+        maxsize (int): Maximum tasks waiting.
+        drop_oldest (bool): When full, drop the oldest task instead of the new one.
+    """
+
+    def __init__(self, name: str, workers: int = 1, maxsize: int = 20, drop_oldest: bool = False):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.maxsize = max(1, int(maxsize))
+        self.drop_oldest = drop_oldest
+        self.tasks: collections.deque = collections.deque()
+        self.threads: list[threading.Thread] = []
+        self.cond: Optional[threading.Condition] = None
+
+
+def default_lanes() -> list[Lane]:
+    """Return the lanes of the websocket IO tasks."""
+    return [
+        Lane(LANE_ALARM, workers=2, maxsize=100),
+        Lane(LANE_SNAPSHOT, workers=2, maxsize=SNAPSHOT_QUEUE_MAXSIZE, drop_oldest=True),
+        Lane(LANE_CLIP, workers=1, maxsize=10),
+    ]
+
+
+class StreamThreads:
+    """Run long tasks on a thread each, up to a limit.
+
+    Args:
+        limit (int): Maximum tasks running at once.
+        name (str): Name used in thread and metric names.
+    """
+
+    def __init__(self, limit: int = MAX_CONCURRENT_STREAMS, name: str = "stream"):
+        self.limit = max(1, int(limit))
+        self.name = name
+        self._lock = threading.Lock()
+        self._running: dict[str, threading.Thread] = {}
+        self._stopped = False
+
+    @property
+    def active(self) -> int:
+        """Number of tasks running."""
+        with self._lock:
+            return len(self._running)
+
+    def is_running(self, key: str) -> bool:
+        """Return True while the task of key runs."""
+        with self._lock:
+            return key in self._running
+
+    def start(self, key: str, func: Callable, *args, **kwargs) -> bool:
+        """Start a task on its own thread, unless one with the same key runs or the limit is reached.
+
+        Args:
+            key (str): Task key, the device streamed for instance.
+            func (Callable): Task.
+
+        Returns:
+            bool: False when the task was refused.
+        """
+        with self._lock:
+            if self._stopped:
+                return False
+            if key in self._running:
+                LOGGER.info("{} {} already running".format(self.name.capitalize(), key))
+                return False
+            if len(self._running) >= self.limit:
+                METRICS.incr(f"io_{self.name}_refused")
+                LOGGER.warning(
+                    "{} {} refused: {} already running, the limit".format(
+                        self.name.capitalize(), key, len(self._running)
+                    )
+                )
+                return False
+            thread = threading.Thread(
+                target=self._run,
+                args=(key, contextvars.copy_context(), func, args, kwargs),
+                name=f"io-{self.name}-{key}",
+                daemon=True,
+            )
+            self._running[key] = thread
+            METRICS.set_gauge(f"io_{self.name}_active", len(self._running))
+        thread.start()
+        return True
+
+    def stop(self) -> None:
+        """Refuse new tasks, the running ones end on their own."""
+        with self._lock:
+            self._stopped = True
+
+    def _run(self, key: str, context: contextvars.Context, func: Callable, args: tuple, kwargs: dict) -> None:
+        started_at = time.monotonic()
+        try:
+            context.run(func, *args, **kwargs)
+        except Exception:  # pylint: disable=broad-exception-caught
+            LOGGER.exception("{} {} failed".format(self.name.capitalize(), key))
+        finally:
+            METRICS.observe(f"io_{self.name}_exec", time.monotonic() - started_at)
+            METRICS.incr(f"io_{self.name}_tasks")
+            with self._lock:
+                self._running.pop(key, None)
+                METRICS.set_gauge(f"io_{self.name}_active", len(self._running))
+
+
+class IoExecutor:
+    """Run blocking tasks on per-lane worker threads, started on first use, and streams on their own.
+
+    Args:
+        lanes (list[Lane] | None): Lanes, default_lanes() when None.
+        streams (StreamThreads | None): Streams, StreamThreads() when None.
+    """
+
+    def __init__(self, lanes: Optional[list[Lane]] = None, streams: Optional[StreamThreads] = None):
+        self.streams = streams if streams is not None else StreamThreads()
+        self._lanes = {lane.name: lane for lane in (lanes if lanes is not None else default_lanes())}
+        # One lock, one condition per lane: a task only wakes the workers of its lane
+        self._lock = threading.Lock()
+        for work_lane in self._lanes.values():
+            work_lane.cond = threading.Condition(self._lock)
+        self._running = True
+
+    def depth(self, lane: str) -> int:
+        """Number of tasks waiting in a lane."""
+        with self._lock:
+            return len(self._lanes[lane].tasks)
+
+    def submit(self, lane: str, func: Callable, *args, **kwargs) -> bool:
+        """Queue a task without blocking.
+
+        Args:
+            lane (str): LANE_* the task belongs to.
+            func (Callable): Task.
+
+        Returns:
+            bool: False when the task was refused (lane full or executor stopped).
+        """
+        work_lane = self._lanes[lane]
+        with self._lock:
+            if not self._running:
+                return False
+            self._ensure_started(work_lane)
+            if len(work_lane.tasks) >= work_lane.maxsize:
+                METRICS.incr(f"io_{lane}_dropped")
+                if not work_lane.drop_oldest:
+                    LOGGER.warning("IO task dropped: {} lane full".format(lane))
+                    return False
+                work_lane.tasks.popleft()
+                LOGGER.info("Oldest {} IO task dropped for a newer one".format(lane))
+            work_lane.tasks.append((time.monotonic(), contextvars.copy_context(), func, args, kwargs))
+            METRICS.set_gauge(f"io_{lane}_queue_depth", len(work_lane.tasks))
+            work_lane.cond.notify()
+        return True
+
+    def stop(self) -> None:
+        """Drop the waiting tasks and stop the workers once their current task is done."""
+        self.streams.stop()
+        with self._lock:
+            self._running = False
+            for work_lane in self._lanes.values():
+                work_lane.tasks.clear()
+                work_lane.cond.notify_all()
+
+    def _ensure_started(self, work_lane: Lane) -> None:
+        if work_lane.threads:
+            return
+        for index in range(work_lane.workers):
+            thread = threading.Thread(
+                target=self._run, args=(work_lane,), name=f"io-{work_lane.name}-{index}", daemon=True
+            )
+            thread.start()
+            work_lane.threads.append(thread)
+
+    def _run(self, work_lane: Lane) -> None:
+        while True:
+            with self._lock:
+                while self._running and not work_lane.tasks:
+                    work_lane.cond.wait()
+                if not self._running:
+                    return
+                queued_at, context, func, args, kwargs = work_lane.tasks.popleft()
+                METRICS.set_gauge(f"io_{work_lane.name}_queue_depth", len(work_lane.tasks))
+            started_at = time.monotonic()
+            METRICS.observe(f"io_{work_lane.name}_queue_wait", started_at - queued_at)
+            try:
+                context.run(func, *args, **kwargs)
+            except Exception:  # pylint: disable=broad-exception-caught
+                LOGGER.exception("{} IO task failed".format(work_lane.name))
+            finally:
+                METRICS.observe(f"io_{work_lane.name}_exec", time.monotonic() - started_at)
+                METRICS.incr(f"io_{work_lane.name}_tasks")
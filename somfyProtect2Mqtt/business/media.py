@@ -0,0 +1,59 @@
+"""Lazy access to the media stacks (PyAV, aiortc, OpenCV, ffmpeg, Pillow)
+
+Those libraries take most of the import time and resident memory of the bridge,
+while installs without streaming only need them for the odd snapshot. Anything
+that needs them goes through this module, which imports them on first use.
+"""
+
+import importlib
+import logging
+import sys
+
+LOGGER = logging.getLogger(__name__)
+
+MEDIA_MODULES = ("av", "aiortc", "cv2", "ffmpeg_streaming", "PIL")
+
+
+def _import(module_name: str):
+    if module_name not in sys.modules:
+        LOGGER.info("Loading media module {}".format(module_name))
+    return importlib.import_module(module_name)
+
+
+def create_webrtc_handler(**kwargs):
+    """Create a WebRTCHandler, importing PyAV and aiortc on first use.
+
+    Args:
+        **kwargs: WebRTCHandler arguments.
+
+    Returns:
+        WebRTCHandler: New handler.
+    """
+    return _import("somfy_protect.webrtc_handler").WebRTCHandler(**kwargs)
+
+
+def open_video_camera(url: str):
+    """Open an OpenCV capture on a stream URL, importing OpenCV on first use.
+
+    Args:
+        url (str): Video stream URL.
+
+    Returns:
+        VideoCamera: Opened camera.
+    """
+    return _import("business.streaming.camera").VideoCamera(url=url)
+
+
+def rtmps_to_hls(device_id: str, url: str, path: str) -> None:
+    """Convert an RTMPS stream to HLS, importing ffmpeg_streaming on first use."""
+    _import("business.streaming").rtmps_to_hls(device_id=device_id, url=url, path=path)
+
+
+def insert_watermark(file: str, watermark: str) -> None:
+    """Insert a text watermark into an image file, importing Pillow on first use."""
+    _import("business.watermark").insert_watermark(file=file, watermark=watermark)
+
+
+def loaded_media_modules() -> list[str]:
+    """Return the media modules already imported in this process."""
+    return [module_name for module_name in MEDIA_MODULES if module_name in sys.modules]
@@ -1,12 +1,19 @@
 """MQTT Business"""
 
-import json
 import logging
-import threading
 from dataclasses import dataclass
+from typing import Callable
 
+from business.router import TopicRouter
+from business.scheduler import REFRESH_SCHEDULER
+from business.settings_writer import SETTINGS_WRITER
+from business.snapshot import STATE_SNAPSHOT
+from business.state_filter import DeviceStateFilter
 from business.tempfiles import remove_temp_file, write_temp_bytes
+from constants import FRAME_EXPIRY, PUBLISH_PRIORITY_ALARM, PUBLISH_PRIORITY_FRAME, PUBLISH_PRIORITY_STATE
 from homeassistant.ha_discovery import ALARM_STATUS
+from jsoncodec import JSON_CODEC
+from metrics import METRICS
 from paho.mqtt import client
 from requests import RequestException
 from somfy_protect.api import ACCESS_LIST, ACTION_LIST, TEST_SIREN_ACTIONS, SomfyProtectApi
@@ -17,6 +24,9 @@ from utils import parse_boolean
 
 LOGGER = logging.getLogger(__name__)
 SUBSCRIBE_TOPICS: set[str] = set()
+DEVICE_STATE_FILTER = DeviceStateFilter()
+# Seconds between a command and the refresh of the site or device it changed
+REFRESH_DELAY = 1.0
 
 
 def register_subscribe_topic(topic: str) -> None:
@@ -51,29 +61,69 @@ def build_device_status_payload(device) -> dict:
     return {str(key): str(value) for key, value in keys_values}
 
 
+def bridge_availability_topic(mqtt_config) -> str:
+    """Return the bridge availability topic, also the MQTT last will topic."""
+    return f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/bridge/availability"
+
+
+def publish_bridge_availability(mqtt_client, mqtt_config, online: bool = True) -> None:
+    """Publish the bridge availability to MQTT."""
+    mqtt_publish(
+        mqtt_client=mqtt_client,
+        topic=bridge_availability_topic(mqtt_config),
+        payload="online" if online else "offline",
+        retain=True,
+        is_json=False,
+    )
+
+
+def publish_bridge_metrics(mqtt_client, mqtt_config) -> None:
+    """Publish the bridge metrics to MQTT."""
+    mqtt_publish(
+        mqtt_client=mqtt_client,
+        topic=f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/bridge/metrics",
+        payload=METRICS.snapshot(),
+    )
+
+
 def publish_site_state(mqtt_client, mqtt_config, site_id, security_level) -> None:
     """Publish site security level to MQTT."""
+    topic = f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/state"
+    payload = {"security_level": ALARM_STATUS.get(security_level, "disarmed")}
+    STATE_SNAPSHOT.record_state(topic, payload)
     mqtt_publish(
         mqtt_client=mqtt_client,
-        topic=f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/state",
-        payload={"security_level": ALARM_STATUS.get(security_level, "disarmed")},
+        topic=topic,
+        payload=payload,
         retain=True,
+        priority=PUBLISH_PRIORITY_ALARM,
     )
 
 
 def publish_device_state(mqtt_client, mqtt_config, site_id, device) -> None:
-    """Publish device status payload to MQTT."""
-    payload = build_device_status_payload(device)
+    """Publish device status payload to MQTT, through the configured state filters."""
+    SETTINGS_WRITER.remember(site_id, device)
+    topic = f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device.id}/state"
+    payload = DEVICE_STATE_FILTER.apply(topic, build_device_status_payload(device))
+    if payload is None:
+        LOGGER.debug(f"State of {device.id} unchanged, skipping publish")
+        STATE_SNAPSHOT.touch(topic)
+        return
+    STATE_SNAPSHOT.record_state(topic, payload)
     mqtt_publish(
         mqtt_client=mqtt_client,
-        topic=f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device.id}/state",
+        topic=topic,
         payload=payload,
         retain=True,
     )
 
 
-def publish_snapshot_bytes(mqtt_client, mqtt_config, site_id, device_id, byte_arr) -> None:
-    """Publish snapshot bytes to MQTT."""
+def publish_snapshot_bytes(mqtt_client, mqtt_config, site_id, device_id, byte_arr, live=False) -> None:
+    """Publish snapshot bytes to MQTT.
+
+    Live stream frames are sent with QoS 0 and expire after ``mqtt.frame_expiry`` seconds,
+    a newer frame soon replaces a lost one.
+    """
     topic = f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device_id}/snapshot"
     mqtt_publish(
         mqtt_client,
@@ -81,7 +131,8 @@ def publish_snapshot_bytes(mqtt_client, mqtt_config, site_id, device_id, byte_ar
         byte_arr,
         retain=True,
         is_json=False,
-        qos=2,
+        qos=0 if live else 2,
+        expiry=mqtt_config.get("frame_expiry", FRAME_EXPIRY) if live else None,
     )
 
 
@@ -104,7 +155,34 @@ def _schedule_device_refresh(api, mqtt_client, mqtt_config, site_id, device_id)
     )
 
 
+def _refresh_site_later(context: MqttContext, site_id: str) -> None:
+    REFRESH_SCHEDULER.schedule(
+        ("site", site_id),
+        REFRESH_DELAY,
+        _schedule_site_refresh,
+        context.api,
+        context.mqtt_client,
+        context.mqtt_config,
+        site_id,
+    )
+
+
+def _refresh_device_later(context: MqttContext, site_id: str, device_id: str) -> None:
+    REFRESH_SCHEDULER.schedule(
+        ("device", site_id, device_id),
+        REFRESH_DELAY,
+        _schedule_device_refresh,
+        context.api,
+        context.mqtt_client,
+        context.mqtt_config,
+        site_id,
+        device_id,
+    )
+
+
 ALARM_COMMANDS = {k for k in ALARM_STATUS if k != "triggered"}
+SIREN_TRIGGERS = {"panic", "trigger"}
+VIDEO_BACKENDS = {"evostream", "webrtc"}
 
 
 def _handle_alarm_status(text_payload, context: MqttContext) -> bool:
@@ -115,14 +193,12 @@ def _handle_alarm_status(text_payload, context: MqttContext) -> bool:
     LOGGER.debug(f"Site ID: {site_id}")
     security_level = AvailableStatus[text_payload.upper()]
     context.api.update_security_level(site_id=site_id, security_level=security_level)
-    threading.Timer(
-        1.0, _schedule_site_refresh, args=(context.api, context.mqtt_client, context.mqtt_config, site_id)
-    ).start()
+    _refresh_site_later(context, site_id)
     return True
 
 
 def _handle_siren(text_payload, context: MqttContext) -> bool:
-    if text_payload.lower() in ("panic", "trigger"):
+    if text_payload.lower() in SIREN_TRIGGERS:
         site_id = context.topic_parts[1]
         LOGGER.info(f"Start the Siren On Site ID {site_id}")
         context.api.trigger_alarm(site_id=site_id, mode="alarm")
@@ -136,7 +212,7 @@ def _handle_siren(text_payload, context: MqttContext) -> bool:
 
 
 def _handle_video_backend(text_payload, context: MqttContext) -> bool:
-    if text_payload not in ["evostream", "webrtc"]:
+    if text_payload not in VIDEO_BACKENDS:
         return False
     site_id = context.topic_parts[1]
     device_id = context.topic_parts[2]
@@ -174,17 +250,7 @@ def _handle_access(text_payload, context: MqttContext) -> bool:
             access=text_payload,
         )
         LOGGER.debug(trigger_access)
-        threading.Timer(
-            1.0,
-            _schedule_device_refresh,
-            args=(
-                context.api,
-                context.mqtt_client,
-                context.mqtt_config,
-                site_id,
-                device_id,
-            ),
-        ).start()
+        _refresh_device_later(context, site_id, device_id)
     return True
 
 
@@ -206,17 +272,7 @@ def _handle_action(text_payload, context: MqttContext) -> bool:
             action=text_payload,
         )
         LOGGER.debug(action_device)
-        threading.Timer(
-            1.0,
-            _schedule_device_refresh,
-            args=(
-                context.api,
-                context.mqtt_client,
-                context.mqtt_config,
-                site_id,
-                device_id,
-            ),
-        ).start()
+        _refresh_device_later(context, site_id, device_id)
     else:
         LOGGER.info(f"Message received for Site ID: {site_id}, Action: {text_payload}")
     return True
@@ -257,51 +313,33 @@ def _handle_setting(text_payload, context: MqttContext) -> None:
         return
     if text_payload.lower() in ("true", "false", "1", "0", "yes", "no", "on", "off"):
         text_payload = parse_boolean(text_payload)
-    device = context.api.get_device(site_id=site_id, device_id=device_id)
     LOGGER.info(f"Message received for Site ID: {site_id}, Device ID: {device_id}, Setting: {setting}")
-    settings = device.settings
-    settings.setdefault("global", {})[setting] = text_payload
-    settings = {k: v for k, v in settings.items() if v is not None}
-    if setting == "night_vision":
-        settings["global"] = {"night_vision": text_payload}
-    context.api.update_device(
-        site_id=site_id,
-        device_id=device_id,
-        device_label=device.label,
-        settings=settings,
+    SETTINGS_WRITER.set(
+        context.api,
+        site_id,
+        device_id,
+        setting,
+        text_payload,
+        on_written=lambda site_id, device_id: _refresh_device_later(context, site_id, device_id),
     )
-    threading.Timer(
-        1.0,
-        _schedule_device_refresh,
-        args=(
-            context.api,
-            context.mqtt_client,
-            context.mqtt_config,
-            site_id,
-            device_id,
-        ),
-    ).start()
-
-
-def _requires_device_topic(text_payload, topic_parts) -> bool:
-    if len(topic_parts) > 3 and topic_parts[3] == "snapshot":
-        return True
-    if text_payload in ["evostream", "webrtc"]:
-        return True
-    if text_payload in TEST_SIREN_ACTIONS:
-        return True
-    if text_payload in ACCESS_LIST:
-        return True
-    if text_payload in ACTION_LIST:
-        return True
-    return False
 
 
-def mqtt_publish(mqtt_client, topic, payload, qos=0, retain=False, is_json=True):
-    """MQTT publish"""
+def mqtt_publish(
+    mqtt_client, topic, payload, qos=0, retain=False, is_json=True, priority=None, expiry=None, event_time=None
+):
+    """MQTT publish
+
+    Messages are queued on the bounded publisher of the client. Without an explicit
+    priority, raw binary payloads (snapshots) are frames and anything else a state.
+    A message with an expiry (seconds) is dropped once stale, and event_time (the time
+    of the Somfy event) is sent along for latency tracing with MQTT v5.
+    """
+    if priority is None:
+        binary = not is_json and isinstance(payload, (bytes, bytearray))
+        priority = PUBLISH_PRIORITY_FRAME if binary else PUBLISH_PRIORITY_STATE
     if is_json:
-        payload = json.dumps(payload, ensure_ascii=False).encode("utf8")
-    mqtt_client.client.publish(topic, payload, qos=qos, retain=retain)
+        payload = JSON_CODEC.dumps(payload)
+    mqtt_client.publish(topic, payload, qos=qos, retain=retain, priority=priority, expiry=expiry, event_time=event_time)
 
 
 def update_device(api, mqtt_client, mqtt_config, site_id, device_id):
@@ -311,14 +349,8 @@ def update_device(api, mqtt_client, mqtt_config, site_id, device_id):
     try:
         device = api.get_device(site_id=site_id, device_id=device_id)
         device_label = device.label
-        payload = build_device_status_payload(device)
         # Push status to MQTT
-        mqtt_publish(
-            mqtt_client=mqtt_client,
-            topic=f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device.id}/state",
-            payload=payload,
-            retain=True,
-        )
+        publish_device_state(mqtt_client, mqtt_config, site_id, device)
     except (RequestException, AttributeError, KeyError, ValueError) as e:
         LOGGER.exception(f"Error while refreshing {device_label}: {e}")
 
@@ -333,43 +365,107 @@ def update_site(api, mqtt_client, mqtt_config, site_id):
         LOGGER.exception(f"Error while refreshing site {site_id}: {e}")
 
 
+def _route_site_command(text_payload: str, _lower_payload: str, context: MqttContext) -> None:
+    # <site_id>/command: alarm panel, arming or triggering the site
+    if not _handle_alarm_status(text_payload, context) and not _handle_siren(text_payload, context):
+        LOGGER.warning(f"Unknown site command {text_payload} on {'/'.join(context.topic_parts)}")
+
+
+def _route_siren_command(text_payload: str, _lower_payload: str, context: MqttContext) -> None:
+    # <site_id>/siren/command: siren switch
+    if not _handle_siren(text_payload, context):
+        LOGGER.warning(f"Unknown siren command {text_payload} on {'/'.join(context.topic_parts)}")
+
+
+def _handle_device_payload(text_payload: str, context: MqttContext) -> bool:
+    handler = DEVICE_PAYLOAD_HANDLERS.get(text_payload)
+    if handler is None:
+        return False
+    handler(text_payload, context)
+    return True
+
+
+def _route_device_command(text_payload: str, _lower_payload: str, context: MqttContext) -> None:
+    # <site_id>/<device_id>/command: device action
+    if not _handle_device_payload(text_payload, context):
+        LOGGER.warning(f"Unknown device command {text_payload} on {'/'.join(context.topic_parts)}")
+
+
+def _route_snapshot_command(_text_payload: str, lower_payload: str, context: MqttContext) -> None:
+    # <site_id>/<device_id>/snapshot/command: manual snapshot switch
+    _handle_snapshot(lower_payload, context)
+
+
+def _route_entity_command(text_payload: str, _lower_payload: str, context: MqttContext) -> None:
+    # <site_id>/<device_id>/<entity>/command: buttons and selects send an action, the others a setting
+    if not _handle_device_payload(text_payload, context):
+        _handle_setting(text_payload, context)
+
+
+def _device_payload_handlers() -> dict[str, Callable]:
+    # Device commands are handled by their payload, the first handler listed wins
+    handlers: dict[str, Callable] = {}
+    for payloads, handler in (
+        (VIDEO_BACKENDS, _handle_video_backend),
+        (TEST_SIREN_ACTIONS, _handle_test_siren),
+        (ACCESS_LIST, _handle_access),
+        (ACTION_LIST, _handle_action),
+    ):
+        for payload in payloads:
+            handlers.setdefault(payload, handler)
+    return handlers
+
+
+DEVICE_PAYLOAD_HANDLERS = _device_payload_handlers()
+
+# Command topics, relative to topic_prefix, and their handler. The most specific pattern wins:
+# <site_id>/siren/command goes to the siren, not to a device named "siren"
+COMMAND_ROUTES = {
+    "+/command": _route_site_command,
+    "+/siren/command": _route_siren_command,
+    "+/+/command": _route_device_command,
+    "+/+/snapshot/command": _route_snapshot_command,
+    "+/+/+/command": _route_entity_command,
+}
+# Subscriptions covering every command route
+COMMAND_SUBSCRIPTIONS = ("+/command", "+/+/command", "+/+/+/command")
+COMMAND_ROUTER = TopicRouter()
+COMMAND_SUBSCRIBE_TOPICS: list[str] = []
+
+
+def configure_command_routes(topic_prefix: str) -> None:
+    """Compile the command routes under topic_prefix."""
+    COMMAND_ROUTER.clear()
+    for route, handler in COMMAND_ROUTES.items():
+        COMMAND_ROUTER.add(f"{topic_prefix}/{route}", handler)
+    COMMAND_SUBSCRIBE_TOPICS[:] = [f"{topic_prefix}/{subscription}" for subscription in COMMAND_SUBSCRIPTIONS]
+
+
+def command_subscriptions() -> list[str]:
+    """Wildcard subscriptions covering every command topic."""
+    return list(COMMAND_SUBSCRIBE_TOPICS)
+
+
+def is_command_topic(topic: str) -> bool:
+    """Return True when topic is covered by the command subscriptions."""
+    return COMMAND_ROUTER.match(topic) is not None
+
+
+configure_command_routes("somfyProtect2mqtt")
+
+
 def consume_mqtt_message(msg, mqtt_config: dict, api: SomfyProtectApi, mqtt_client: client):
     """Compute MQTT received message"""
     try:
         text_payload = msg.payload.decode("UTF-8")
         lower_payload = text_payload.lower()
         LOGGER.info(f"Payload {text_payload}")
+        handler = COMMAND_ROUTER.match(msg.topic)
+        if handler is None:
+            LOGGER.warning(f"No command handler for topic {msg.topic}")
+            return
         topic_parts = msg.topic.split("/")
         context = MqttContext(api=api, mqtt_client=mqtt_client, mqtt_config=mqtt_config, topic_parts=topic_parts)
-
-        def require_parts(min_parts: int, context: str) -> bool:
-            if len(topic_parts) < min_parts:
-                LOGGER.warning(f"Invalid topic format for {context}: {msg.topic}")
-                return False
-            return True
-
-        if not require_parts(2, "site"):
-            return
-        if _handle_alarm_status(text_payload, context):
-            return
-        if _handle_siren(text_payload, context):
-            return
-        if _requires_device_topic(text_payload, topic_parts):
-            if not require_parts(3, "device"):
-                return
-        if _handle_video_backend(text_payload, context):
-            return
-        if _handle_test_siren(text_payload, context):
-            return
-        if _handle_access(text_payload, context):
-            return
-        if _handle_action(text_payload, context):
-            return
-        if _handle_snapshot(lower_payload, context):
-            return
-        if not require_parts(4, "setting"):
-            return
-        _handle_setting(text_payload, context)
-
+        handler(text_payload, lower_payload, context)
     except (RequestException, AttributeError, KeyError, ValueError) as e:
         LOGGER.exception(f"Error when processing message: {e}: {msg.topic} => {msg.payload}")
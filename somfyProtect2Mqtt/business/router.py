@@ -0,0 +1,74 @@
+"""MQTT topic router
+
+Inbound commands arrive on a few wildcard subscriptions. Their topic is
+matched against a trie of topic patterns, one level at a time, so routing a
+message costs the same whatever the number of devices.
+"""
+
+from typing import Any, Optional
+
+
+class _Node:
+    __slots__ = ("children", "target")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.target: Any = None
+
+
+class TopicRouter:
+    """Trie of MQTT topic patterns, with ``+`` and ``#`` wildcards.
+
+    An exact level is preferred over ``+``, and ``+`` over ``#``.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._patterns: list[str] = []
+
+    @property
+    def patterns(self) -> list[str]:
+        """Patterns in the order they were added, usable as MQTT subscriptions."""
+        return list(self._patterns)
+
+    def add(self, pattern: str, target: Any) -> None:
+        """Route the topics matching pattern to target.
+
+        Args:
+            pattern (str): MQTT topic filter, e.g. ``prefix/+/+/+/command``.
+            target (Any): Returned by match for these topics.
+        """
+        levels = pattern.split("/")
+        if "#" in levels[:-1]:
+            raise ValueError(f"'#' must be the last level of {pattern}")
+        node = self._root
+        for level in levels:
+            node = node.children.setdefault(level, _Node())
+        if node.target is None:
+            self._patterns.append(pattern)
+        node.target = target
+
+    def clear(self) -> None:
+        """Remove every route."""
+        self._root = _Node()
+        self._patterns = []
+
+    def match(self, topic: str) -> Optional[Any]:
+        """Return the target of the most specific pattern matching topic, None without one."""
+        return self._match(self._root, topic.split("/"), 0)
+
+    def _match(self, node: _Node, levels: list[str], index: int) -> Optional[Any]:
+        if index == len(levels):
+            if node.target is not None:
+                return node.target
+            # "a/#" also matches "a"
+            wildcard = node.children.get("#")
+            return wildcard.target if wildcard else None
+        for key in (levels[index], "+"):
+            child = node.children.get(key)
+            if child is not None:
+                target = self._match(child, levels, index + 1)
+                if target is not None:
+                    return target
+        wildcard = node.children.get("#")
+        return wildcard.target if wildcard else None
@@ -0,0 +1,124 @@
+"""Delayed tasks run by a single thread
+
+Commands refresh the site or device they changed a moment later. A burst of
+commands (e.g. dragging a Home Assistant slider) schedules one refresh per
+site/device: a task scheduled while another with the same key is pending is
+merged into it and runs once, at the time of the first one. Debounced tasks,
+scheduled with ``reschedule=True``, are pushed back by each merge instead and
+run once no new task with their key arrived for their delay.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Hashable, Optional
+
+from metrics import METRICS
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DelayedTaskScheduler:
+    """Run keyed tasks after a delay on one thread, coalescing pending tasks per key.
+
+    Args:
+        clock (callable): Monotonic clock.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._heap: list[tuple[float, int, Hashable]] = []
+        # Key => sequence number of its live heap entry, and task
+        self._pending: dict[Hashable, tuple[int, Callable, tuple, dict]] = {}
+        self._counter = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    @property
+    def pending(self) -> int:
+        """Number of tasks waiting to run."""
+        with self._cond:
+            return len(self._pending)
+
+    def schedule(self, key: Hashable, delay: float, func: Callable, *args, reschedule: bool = False, **kwargs) -> bool:
+        """Run func after delay seconds, unless a task with the same key is already pending.
+
+        The pending task then runs the latest func and arguments, at its own time, or delay
+        seconds from now with reschedule.
+
+        Args:
+            key (Hashable): Coalescing key, e.g. ("device", site_id, device_id).
+            delay (float): Seconds before running the task.
+            func (Callable): Task.
+            reschedule (bool): Push a pending task back to delay seconds from now (trailing-edge debounce).
+
+        Returns:
+            bool: False when the task was merged into a pending one.
+        """
+        with self._cond:
+            self._ensure_started()
+            pending = self._pending.get(key)
+            if pending is not None and not reschedule:
+                self._pending[key] = (pending[0], func, args, kwargs)
+                METRICS.incr("scheduler_tasks_coalesced")
+                return False
+            # The heap entry of a rescheduled task is left behind, skipped when popped
+            sequence = next(self._counter)
+            self._pending[key] = (sequence, func, args, kwargs)
+            heapq.heappush(self._heap, (self._clock() + delay, sequence, key))
+            self._cond.notify()
+            if pending is not None:
+                METRICS.incr("scheduler_tasks_coalesced")
+                return False
+            return True
+
+    def stop(self) -> None:
+        """Stop the scheduler thread, dropping pending tasks."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _ensure_started(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="delayed-tasks", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    if self._heap:
+                        wait = self._heap[0][0] - self._clock()
+                        if wait <= 0:
+                            _, sequence, key = heapq.heappop(self._heap)
+                            pending = self._pending.get(key)
+                            if pending is not None and pending[0] == sequence:
+                                del self._pending[key]
+                                task = pending[1:]
+                                break
+                            continue
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            self._run_task(*task)
+
+    @staticmethod
+    def _run_task(func: Callable, args: tuple, kwargs: dict) -> None:
+        try:
+            func(*args, **kwargs)
+        except Exception:  # pylint: disable=broad-exception-caught
+            LOGGER.exception("Delayed task {} failed".format(getattr(func, "__name__", func)))
+        METRICS.incr("scheduler_tasks_run")
+
+
+REFRESH_SCHEDULER = DelayedTaskScheduler()
@@ -0,0 +1,127 @@
+"""Debounced device settings writes
+
+The Somfy API only updates device settings as a whole: changing one setting
+is a read-modify-write of the device. Dragging a Home Assistant slider sends
+many changes back to back, which would each GET the device and PUT racing
+settings. Changes are buffered per device instead, and written with a single
+PUT once no new change arrived for the debounce window, on top of the last
+known settings of the device.
+"""
+
+import copy
+import logging
+import threading
+from typing import Callable, Optional
+
+from business.scheduler import REFRESH_SCHEDULER, DelayedTaskScheduler
+from metrics import METRICS
+from requests import RequestException
+
+LOGGER = logging.getLogger(__name__)
+
+SETTINGS_DEBOUNCE = 0.5
+
+
+class SettingsWriteBuffer:
+    """Merge the settings changes of a device into one write.
+
+    Args:
+        scheduler (DelayedTaskScheduler): Scheduler running the writes.
+        debounce (float): Seconds without a new change before writing.
+    """
+
+    def __init__(self, scheduler: DelayedTaskScheduler = REFRESH_SCHEDULER, debounce: float = SETTINGS_DEBOUNCE):
+        self.scheduler = scheduler
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._known: dict[tuple[str, str], tuple[str, dict]] = {}
+        self._changes: dict[tuple[str, str], dict] = {}
+
+    def configure(self, debounce: Optional[float]) -> None:
+        """Set the debounce window, in seconds."""
+        if debounce is not None:
+            self.debounce = max(float(debounce), 0.0)
+
+    def remember(self, site_id: str, device) -> None:
+        """Record the settings of a device as returned by the API."""
+        if not isinstance(getattr(device, "settings", None), dict):
+            return
+        with self._lock:
+            self._known[(site_id, device.id)] = (device.label, copy.deepcopy(device.settings))
+
+    def forget(self, site_id: str, device_id: str) -> None:
+        """Drop the known settings of a device, the next write reads them again."""
+        with self._lock:
+            self._known.pop((site_id, device_id), None)
+
+    def set(
+        self, api, site_id: str, device_id: str, setting: str, value, on_written: Optional[Callable] = None
+    ) -> None:
+        """Buffer a global setting change.
+
+        Args:
+            api (SomfyProtectApi): Somfy API, used by the write.
+            site_id (str): Site ID.
+            device_id (str): Device ID.
+            setting (str): Global setting name.
+            value: New value.
+            on_written (Callable | None): Called with site_id and device_id after the write.
+        """
+        with self._lock:
+            changes = self._changes.setdefault((site_id, device_id), {})
+            if changes:
+                METRICS.incr("settings_writes_coalesced")
+            changes[setting] = value
+        # Each change pushes the write back: it runs once no change arrived for the debounce window
+        self.scheduler.schedule(
+            ("settings", site_id, device_id),
+            self.debounce,
+            self._write_buffered,
+            api,
+            site_id,
+            device_id,
+            on_written,
+            reschedule=True,
+        )
+
+    def _write_buffered(self, api, site_id: str, device_id: str, on_written: Optional[Callable]) -> None:
+        self.flush(api, site_id, device_id)
+        if on_written:
+            on_written(site_id, device_id)
+
+    def flush(self, api, site_id: str, device_id: str) -> None:
+        """Write the buffered changes of a device now."""
+        key = (site_id, device_id)
+        with self._lock:
+            changes = self._changes.pop(key, None)
+            known = self._known.get(key)
+        if not changes:
+            return
+        try:
+            if known is None:
+                device = api.get_device(site_id=site_id, device_id=device_id)
+                known = (device.label, copy.deepcopy(device.settings))
+            label, settings = known
+            settings = copy.deepcopy(settings)
+            night_vision = changes.pop("night_vision", None)
+            if changes:
+                settings.setdefault("global", {}).update(changes)
+                self._write(api, site_id, device_id, label, settings)
+            if night_vision is not None:
+                # As before, night vision is written without the other global settings
+                self._write(api, site_id, device_id, label, {**settings, "global": {"night_vision": night_vision}})
+                settings.setdefault("global", {})["night_vision"] = night_vision
+            with self._lock:
+                self._known[key] = (label, settings)
+        except (RequestException, AttributeError, KeyError, ValueError) as e:
+            LOGGER.warning("Unable to update settings of device {}: {}".format(device_id, e))
+            self.forget(site_id, device_id)
+
+    @staticmethod
+    def _write(api, site_id: str, device_id: str, label: str, settings: dict) -> None:
+        settings = {k: v for k, v in settings.items() if v is not None}
+        api.update_device(site_id=site_id, device_id=device_id, device_label=label, settings=copy.deepcopy(settings))
+        METRICS.incr("settings_writes")
+
+
+SETTINGS_WRITER = SettingsWriteBuffer()
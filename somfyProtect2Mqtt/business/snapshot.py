@@ -0,0 +1,103 @@
+"""Persisted snapshot of the last known sites, discovery configs and states"""
+
+import logging
+from datetime import datetime, timezone
+
+from utils.persisted import PersistedJsonStore
+
+LOGGER = logging.getLogger(__name__)
+
+SNAPSHOT_FILENAME = "state_snapshot.json"
+SNAPSHOT_VERSION = 1
+
+
+class StateSnapshot(PersistedJsonStore):
+    """Last known bridge state, saved to disk to warm-start the next run.
+
+    Everything published as retained discovery config or state is recorded by
+    topic. A live refresh is bracketed by ``begin_refresh``/``commit_refresh`` so
+    that topics not seen again (removed devices, renamed sites) are dropped.
+    """
+
+    VERSION = SNAPSHOT_VERSION
+    DESCRIPTION = "state snapshot"
+
+    def __init__(self, path: str | None = None):
+        super().__init__(path)
+        self.sites: dict[str, str] = {}
+        self.discovery: dict[str, dict] = {}
+        self.states: dict[str, dict] = {}
+        self.replayed = False
+        self._saved_at = None
+
+    def load(self) -> bool:
+        """Load the snapshot file.
+
+        Returns:
+            bool: True when a usable snapshot was loaded.
+        """
+        return super().load() and bool(self.sites)
+
+    def _dump(self) -> dict:
+        return {
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+            "sites": dict(self.sites),
+            "discovery": dict(self.discovery),
+            "states": dict(self.states),
+        }
+
+    def _restore(self, content: dict) -> None:
+        self.sites = {str(k): str(v) for k, v in (content.get("sites") or {}).items()}
+        self.discovery = dict(content.get("discovery") or {})
+        self.states = dict(content.get("states") or {})
+        self._saved_at = content.get("saved_at")
+
+    def _summary(self) -> str:
+        return "saved at {}, {} site(s), {} discovery config(s), {} state(s)".format(
+            self._saved_at, len(self.sites), len(self.discovery), len(self.states)
+        )
+
+    def record_site(self, site_id: str, label: str) -> None:
+        """Remember a configured site."""
+        with self._lock:
+            if self.sites.get(site_id) != label:
+                self.sites[site_id] = label
+                self._dirty = True
+
+    def record_discovery(self, topic: str, config: dict | None) -> None:
+        """Remember a retained discovery config, an empty one removes it."""
+        self._record(self.discovery, topic, config)
+
+    def record_state(self, topic: str, payload: dict | None) -> None:
+        """Remember a retained state payload."""
+        self._record(self.states, topic, payload)
+
+    def _record(self, store: dict, topic: str, payload: dict | None) -> None:
+        if not topic:
+            return
+        with self._lock:
+            self._touch(topic)
+            if not payload:
+                if store.pop(topic, None) is not None:
+                    self._dirty = True
+                return
+            if store.get(topic) != payload:
+                store[topic] = payload
+                self._dirty = True
+
+    def commit_refresh(self, site_ids: list) -> None:
+        """Drop whatever the live refresh did not publish again.
+
+        Args:
+            site_ids (list): Sites resolved by the live refresh.
+        """
+        with self._lock:
+            touched = self._end_refresh()
+            self._forget_untouched(self.discovery, touched)
+            self._forget_untouched(self.states, touched)
+            for site_id in [site_id for site_id in self.sites if site_id not in site_ids]:
+                del self.sites[site_id]
+                self._dirty = True
+
+
+STATE_SNAPSHOT = StateSnapshot()
@@ -0,0 +1,121 @@
+"""Deadband and minimum-interval filtering for device state payloads"""
+
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _as_float(value) -> float | None:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DeviceStateFilter:
+    """Hold back jittery values from device state payloads.
+
+    Rules are keyed by capability name (see ``DEVICE_CAPABILITIES``) and accept:
+
+    - ``deadband``: changes no larger than this absolute amount are held back.
+    - ``deadband_percent``: same, relative to the last published value.
+    - ``min_interval``: seconds to wait before publishing a new value again.
+
+    A held back capability keeps its last published value in the payload, and a
+    payload identical to the last one published on the same key is dropped.
+    """
+
+    def __init__(self, rules: dict | None = None, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._published: dict[str, dict[str, tuple[str, float]]] = {}
+        self._payloads: dict[str, dict] = {}
+        self.rules: dict[str, dict] = {}
+        self.configure(rules)
+
+    def configure(self, rules: dict | None) -> None:
+        """Replace the filtering rules.
+
+        Args:
+            rules (dict | None): Rules keyed by capability name.
+        """
+        parsed = {}
+        for capability, rule in (rules or {}).items():
+            if not isinstance(rule, dict):
+                LOGGER.warning("Ignoring state filter for {}: expected a mapping".format(capability))
+                continue
+            parsed[str(capability)] = {
+                "deadband": _as_float(rule.get("deadband")),
+                "deadband_percent": _as_float(rule.get("deadband_percent")),
+                "min_interval": _as_float(rule.get("min_interval")),
+            }
+        with self._lock:
+            self.rules = parsed
+            self._published.clear()
+            self._payloads.clear()
+        if parsed:
+            LOGGER.info("State filters enabled for: {}".format(", ".join(sorted(parsed))))
+
+    def reset(self) -> None:
+        """Forget what was published, so the next payload of every key goes through."""
+        with self._lock:
+            self._published.clear()
+            self._payloads.clear()
+
+    def apply(self, key: str, payload: dict) -> dict | None:
+        """Filter a payload about to be published.
+
+        Args:
+            key (str): Identity of the payload, usually its topic.
+            payload (dict): Payload about to be published.
+
+        Returns:
+            dict | None: Payload to publish, or None when nothing changed.
+        """
+        if not self.rules:
+            return payload
+        now = self._clock()
+        with self._lock:
+            published = self._published.setdefault(key, {})
+            filtered = dict(payload)
+            for capability, rule in self.rules.items():
+                if capability not in payload:
+                    continue
+                value = payload[capability]
+                previous = published.get(capability)
+                if previous is None:
+                    published[capability] = (value, now)
+                    continue
+                last_value, last_at = previous
+                if value == last_value:
+                    continue
+                if self._hold(rule, value, last_value, now - last_at):
+                    filtered[capability] = last_value
+                else:
+                    published[capability] = (value, now)
+            if self._payloads.get(key) == filtered:
+                return None
+            self._payloads[key] = filtered
+            return filtered
+
+    @staticmethod
+    def _hold(rule: dict, value, last_value, elapsed: float) -> bool:
+        min_interval = rule.get("min_interval")
+        if min_interval and elapsed < min_interval:
+            return True
+        current = _as_float(value)
+        last = _as_float(last_value)
+        if current is None or last is None:
+            return False
+        delta = abs(current - last)
+        deadband = rule.get("deadband")
+        if deadband is not None and delta <= deadband:
+            return True
+        deadband_percent = rule.get("deadband_percent")
+        if deadband_percent is not None and delta <= abs(last) * deadband_percent / 100:
+            return True
+        return False
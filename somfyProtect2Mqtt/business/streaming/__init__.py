@@ -2,9 +2,6 @@
 
 import logging
 
-import ffmpeg_streaming
-from ffmpeg_streaming import Bitrate, Formats, Representation, Size
-
 LOGGER = logging.getLogger(__name__)
 
 
@@ -16,6 +13,10 @@ def rtmps_to_hls(device_id: str, url: str, path: str) -> None:
         url (str): RTMPS stream URL.
         path (str): Output directory path.
     """
+    # Imported here so that importing business.streaming.camera does not load ffmpeg_streaming
+    import ffmpeg_streaming  # pylint: disable=import-outside-toplevel
+    from ffmpeg_streaming import Bitrate, Formats, Representation, Size  # pylint: disable=import-outside-toplevel
+
     LOGGER.info("Path: {}".format(path))
     _1080p = Representation(Size(1920, 1080), Bitrate(4096 * 1024, 640 * 1024))
     video = ffmpeg_streaming.input(url)
@@ -10,3 +10,25 @@ WEBSOCKET_RECONNECT = 5
 WEBSOCKET_IDLE_CLOSE_SECONDS = 1800
 
 SNAPSHOT_QUEUE_MAXSIZE = 20
+# Camera streams published to MQTT at once, each holds a thread and the decoder
+MAX_CONCURRENT_STREAMS = 2
+
+# Where the HLS server listens. The defaults keep it reachable from another container,
+# as the Home Assistant add-on needs; an installation whose reader is on the same host
+# can narrow the address, and one whose port is already taken can move it.
+DEFAULT_HLS_HOST = "0.0.0.0"
+DEFAULT_HLS_PORT = 8090
+
+# MQTT publish classes, the lowest is dropped first when the publish queue is full
+PUBLISH_PRIORITY_FRAME = 0
+PUBLISH_PRIORITY_STATE = 1
+PUBLISH_PRIORITY_ALARM = 2
+PUBLISH_QUEUE_MAXSIZE = 1000
+PUBLISH_MAX_INFLIGHT = {0: 100, 1: 20, 2: 10}
+
+# Seconds after which a message is stale: queued ones are dropped, and MQTT v5 brokers
+# drop them (and their retained copy) too
+FRAME_EXPIRY = 10
+PULSE_EXPIRY = 30
+# Seconds a motion/ringing pulse stays on, extended by every new trigger
+PULSE_DURATION = 3
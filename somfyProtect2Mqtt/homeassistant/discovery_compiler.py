@@ -0,0 +1,348 @@
+"""Compiled HomeAssistant MQTT Auto Discover templates
+
+Discovery for a device only depends on its device definition and on the
+capabilities it reports. Entity templates (topic patterns, capability config,
+IntelliTag/presence/motion/ringing special cases) and the entity plan of each
+device definition are compiled once, generating the discovery of a device is
+then a fill-in of its site and device IDs.
+"""
+
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+from homeassistant.capabilities import DEVICE_CAPABILITIES
+from somfy_protect.api import SIREN_TEST_SOUNDS
+
+LOGGER = logging.getLogger(__name__)
+
+# State sensors published with an empty payload, hiding them from Home Assistant
+HIDDEN_STATE_SENSORS = frozenset(["human_detect_enabled"])
+
+
+@dataclass
+class DeviceDiscovery:
+    """Discovery configs, command topics and initial states generated for one device"""
+
+    configs: list = field(default_factory=list)
+    topics: list = field(default_factory=list)
+    registrations: list = field(default_factory=list)
+    states: list = field(default_factory=list)
+
+    def add(self, config: Optional[dict], payload: Optional[dict] = None) -> None:
+        """Add an entity config, payload overrides its config (e.g. {} to hide it)."""
+        if config:
+            self.configs.append((config, payload))
+
+    def subscribe(self, topic: str) -> None:
+        """Add a command topic not carried by an entity config."""
+        self.topics.append(topic)
+
+    def add_state(self, topic: Optional[str], payload: dict) -> None:
+        """Add an initial retained state."""
+        if topic:
+            self.states.append((topic, payload))
+
+
+def _escape(value: str) -> str:
+    return value.replace("{", "{{").replace("}", "}}")
+
+
+@dataclass(frozen=True)
+class EntityTemplate:
+    """Discovery config of one entity, with site and device IDs left to fill in"""
+
+    sensor_name: str
+    topic: str
+    config: dict
+    topic_fields: tuple
+    initial_state: Optional[dict] = None
+    camera: bool = False
+
+    def render(self, site_id: str, device_id: str, device_info: dict) -> dict:
+        """Fill the template in for a device.
+
+        Args:
+            site_id (str): Site ID.
+            device_id (str): Device ID.
+            device_info (dict): Home Assistant device description.
+
+        Returns:
+            dict: Discovery topic and config.
+        """
+        config = self.config.copy()
+        config["unique_id"] = f"{device_id}_{self.sensor_name}"
+        for config_entry, pattern in self.topic_fields:
+            config[config_entry] = pattern.format(site_id=site_id, device_id=device_id)
+        config["device"] = device_info
+        return {"topic": self.topic.format(site_id=site_id, device_id=device_id), "config": config}
+
+
+@dataclass(frozen=True)
+class DevicePlan:
+    """Entities of a device definition, besides the ones derived from its reported states"""
+
+    entities: tuple
+    stream: bool = False
+    video_backend: bool = False
+
+
+class DiscoveryCompiler:
+    """Compile and cache entity templates and device plans.
+
+    Templates are keyed by sensor name and device definition label, plans by
+    device definition, both for a given pair of topic prefixes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates: dict[tuple, Optional[EntityTemplate]] = {}
+        self._plans: dict[tuple, DevicePlan] = {}
+
+    def clear(self) -> None:
+        """Forget the compiled templates and plans (e.g. capabilities changed)."""
+        with self._lock:
+            self._templates.clear()
+            self._plans.clear()
+
+    @staticmethod
+    def _prefixes(mqtt_config: dict) -> tuple:
+        return (
+            mqtt_config.get("topic_prefix", "somfyProtect2mqtt"),
+            mqtt_config.get("ha_discover_prefix", "homeassistant"),
+        )
+
+    def entity_template(self, mqtt_config: dict, sensor_name: str, definition_label: str) -> Optional[EntityTemplate]:
+        """Return the compiled template of an entity, None for unknown capabilities.
+
+        Args:
+            mqtt_config (dict): MQTT configuration.
+            sensor_name (str): Capability name.
+            definition_label (str): Device definition label.
+
+        Returns:
+            Optional[EntityTemplate]: Compiled template.
+        """
+        key = (*self._prefixes(mqtt_config), sensor_name, definition_label)
+        try:
+            return self._templates[key]
+        except KeyError:
+            pass
+        template = _compile_entity(*key)
+        with self._lock:
+            self._templates[key] = template
+        return template
+
+    def device_plan(self, mqtt_config: dict, device_definition: dict) -> DevicePlan:
+        """Return the compiled entity plan of a device definition.
+
+        Args:
+            mqtt_config (dict): MQTT configuration.
+            device_definition (dict): Device definition.
+
+        Returns:
+            DevicePlan: Compiled plan.
+        """
+        key = (
+            *self._prefixes(mqtt_config),
+            device_definition.get("device_definition_id") or "",
+            device_definition.get("type") or "",
+            device_definition.get("label") or "",
+        )
+        try:
+            return self._plans[key]
+        except KeyError:
+            pass
+        plan = self._compile_plan(mqtt_config, *key[2:])
+        with self._lock:
+            self._plans[key] = plan
+        return plan
+
+    def _compile_plan(self, mqtt_config: dict, definition_id: str, device_type: str, label: str) -> DevicePlan:
+        LOGGER.debug("Compiling discovery plan for {} ({})".format(definition_id, label))
+        sensors = []
+        stream = False
+        video_backend = False
+        if "box" in device_type:
+            sensors += ["reboot", "halt"]
+        if "camera" in device_type or "allinone" in device_type:
+            sensors += ["camera", "reboot", "halt", "snapshot", "video_backend", "stream"]
+            stream = video_backend = True
+        if "remote" in device_type:
+            sensors.append("presence")
+        if "mss_outdoor_siren" in definition_id:
+            sensors.append("test_siren1s")
+        if "mss_siren" in definition_id:
+            sensors += [f"test_{sound}" for sound in SIREN_TEST_SOUNDS]
+        if "pir" in device_type or "tag" in device_type:
+            sensors.append("motion_sensor")
+        if "smoke" in device_type:
+            sensors.append("smoke")
+        if device_type == "doorlock":
+            sensors += ["open_door", "door_force_lock"]
+        if "videophone" in device_type:
+            sensors += ["camera", "ringing", "reboot", "halt", "open_latch", "open_gate"]
+            sensors += ["snapshot", "stream", "video_backend"]
+            stream = video_backend = True
+
+        entities = []
+        for sensor_name in sensors:
+            template = self.entity_template(mqtt_config, sensor_name, "" if sensor_name == "camera" else label)
+            if template is None:
+                LOGGER.warning(f"Unknown capability {sensor_name} for device definition {label}, skipping discovery")
+                continue
+            entities.append(template)
+        stream = stream and any(t.sensor_name == "stream" and "command_topic" in t.config for t in entities)
+        video_backend = video_backend and any(
+            t.sensor_name == "video_backend" and "command_topic" in t.config for t in entities
+        )
+        return DevicePlan(entities=tuple(entities), stream=stream, video_backend=video_backend)
+
+    def compile_device(self, site_id: str, device, mqtt_config: dict) -> DeviceDiscovery:
+        """Generate the discovery of a device.
+
+        Args:
+            site_id (str): Site ID.
+            device (Device): Device.
+            mqtt_config (dict): MQTT configuration.
+
+        Returns:
+            DeviceDiscovery: Entity configs, command topics and initial states.
+        """
+        topic_prefix = mqtt_config.get("topic_prefix", "somfyProtect2mqtt")
+        definition_label = device.device_definition.get("label")
+        device_info = ha_device_info(device)
+        discovery = DeviceDiscovery()
+
+        status_settings = {**device.status, **(device.settings.get("global") or {})}
+        for state in status_settings:
+            if state not in DEVICE_CAPABILITIES:
+                continue
+            template = self.entity_template(mqtt_config, state, definition_label)
+            payload = {} if state in HIDDEN_STATE_SENSORS else None
+            discovery.add(template.render(site_id, device.id, device_info), payload=payload)
+
+        plan = self.device_plan(mqtt_config, device.device_definition)
+        camera_info = None
+        for template in plan.entities:
+            if template.camera:
+                camera_info = camera_info or ha_camera_info(device)
+                discovery.add(template.render(site_id, device.id, camera_info))
+                continue
+            config = template.render(site_id, device.id, device_info)
+            discovery.add(config)
+            if template.initial_state is not None:
+                discovery.add_state(config["config"].get("state_topic"), template.initial_state)
+        if plan.video_backend:
+            discovery.registrations.append(f"{topic_prefix}/{site_id}/{device.id}/video_backend")
+        if plan.stream:
+            discovery.subscribe(f"{topic_prefix}/{site_id}/{device.id}/stream")
+        return discovery
+
+
+def ha_device_info(device) -> dict:
+    """Home Assistant device description of a device, shared by its entities."""
+    update_available = device.update_available
+    if update_available is False:
+        update_available = "(Up to Date)"
+    else:
+        update_available = f"(New Version Available: {update_available})"
+    return {
+        "identifiers": [device.id],
+        "manufacturer": "Somfy",
+        "model": device.device_definition.get("label"),
+        "name": device.label,
+        "sw_version": f"{device.version} {update_available}",
+    }
+
+
+def ha_camera_info(device) -> dict:
+    """Home Assistant device description of a camera entity."""
+    return {
+        "identifiers": [device.id],
+        "manufacturer": "Somfy",
+        "model": device.device_definition.get("label"),
+        "name": device.label,
+        "sw_version": device.version,
+    }
+
+
+def _compile_camera(topic_prefix: str, ha_discover_prefix: str) -> EntityTemplate:
+    return EntityTemplate(
+        sensor_name="snapshot",
+        topic=f"{_escape(ha_discover_prefix)}/camera/{{site_id}}_{{device_id}}/snapshot/config",
+        config={
+            "name": "snapshot",
+            "unique_id": None,
+            "topic": None,
+            "availability_topic": f"{topic_prefix}/bridge/availability",
+            "device": None,
+        },
+        topic_fields=(("topic", f"{_escape(topic_prefix)}/{{site_id}}/{{device_id}}/snapshot"),),
+        camera=True,
+    )
+
+
+def _compile_entity(
+    topic_prefix: str, ha_discover_prefix: str, sensor_name: str, definition_label: str
+) -> Optional[EntityTemplate]:
+    # pylint: disable=too-many-branches
+    if sensor_name == "camera":
+        return _compile_camera(topic_prefix, ha_discover_prefix)
+    capability = DEVICE_CAPABILITIES.get(sensor_name)
+    if capability is None:
+        return None
+
+    device_type = capability.get("type")
+    capability_config = capability.get("config", {})
+    device_topic = f"{_escape(topic_prefix)}/{{site_id}}/{{device_id}}"
+    topic_fields = {"state_topic": f"{device_topic}/state"}
+
+    config = {
+        "name": sensor_name,
+        "unique_id": None,
+        "state_topic": None,
+        "value_template": "{{ value_json." + sensor_name + " }}",
+        "availability_topic": f"{topic_prefix}/bridge/availability",
+        "device": None,
+    }
+    for config_entry, config_value in capability_config.items():
+        config[config_entry] = config_value
+        # Specifiy for Intellitag Sensivity
+        if definition_label == "IntelliTag" and sensor_name == "sensitivity":
+            intellitag_capability = DEVICE_CAPABILITIES.get(f"{sensor_name}_{definition_label}")
+            if intellitag_capability:
+                config[config_entry] = intellitag_capability.get("config", {}).get(config_entry)
+    if device_type in ("switch", "number", "select", "button"):
+        config["command_topic"] = None
+        topic_fields["command_topic"] = f"{device_topic}/{_escape(sensor_name)}/command"
+    if device_type == "button":
+        config.pop("state_topic", None)
+        config.pop("value_template", None)
+        topic_fields.pop("state_topic")
+    if sensor_name in ("snapshot", "stream"):
+        config.pop("value_template")
+    if sensor_name in ("presence", "ringing", "video_backend"):
+        topic_fields["state_topic"] = f"{device_topic}/{sensor_name}"
+    if sensor_name == "motion_sensor":
+        topic_fields["state_topic"] = f"{device_topic}/pir"
+        if definition_label == "IntelliTag":
+            config["device_class"] = "safety"
+        if definition_label == "Myfox Security Infrared Sensor":
+            config["device_class"] = "motion"
+
+    initial_state = None
+    if sensor_name in ("motion_sensor", "smoke", "ringing"):
+        initial_state = {sensor_name: "False"}
+
+    return EntityTemplate(
+        sensor_name=sensor_name,
+        topic=(f"{_escape(ha_discover_prefix)}/{device_type}/{{site_id}}_{{device_id}}/{_escape(sensor_name)}/config"),
+        config=config,
+        topic_fields=tuple(topic_fields.items()),
+        initial_state=initial_state,
+    )
+
+
+DISCOVERY_COMPILER = DiscoveryCompiler()
@@ -3,11 +3,12 @@
 import logging
 
 from homeassistant.capabilities import ALARM_STATUS as CAPABILITIES_ALARM_STATUS
-from homeassistant.capabilities import DEVICE_CAPABILITIES
+from homeassistant.discovery_compiler import DISCOVERY_COMPILER, ha_camera_info, ha_device_info
 from somfy_protect.api.model import Device, Site
 
 LOGGER = logging.getLogger(__name__)
 ALARM_STATUS = CAPABILITIES_ALARM_STATUS
+DISCOVERY_ORIGIN = {"name": "SomfyProtect2MQTT", "support_url": "https://github.com/Minims/SomfyProtect2MQTT"}
 
 
 def ha_discovery_alarm(site: Site, mqtt_config: dict, homeassistant_config: dict):
@@ -45,6 +46,7 @@ def ha_discovery_alarm(site: Site, mqtt_config: dict, homeassistant_config: dict
         "payload_disarm": "disarmed",
         "value_template": "{{ value_json.security_level }}",
         "supported_features": ["arm_night", "arm_away", "trigger"],
+        "availability_topic": f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/bridge/availability",
         "device": site_info,
     }
     if isinstance(code, (int, str)) and not isinstance(code, bool):
@@ -75,6 +77,7 @@ def ha_discovery_history(site: Site, mqtt_config: dict):
         "name": f"{site.label}_history",
         "unique_id": f"{site.id}_{site.label}_history",
         "state_topic": f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site.id}/history",
+        "availability_topic": f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/bridge/availability",
         "device": site_info,
         "mode": "text",
         "command_topic": f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site.id}/history",
@@ -102,6 +105,7 @@ def ha_discovery_alarm_actions(site: Site, mqtt_config: dict):
         "name": "Siren",
         "unique_id": f"{site.id}_{site.label}",
         "command_topic": command_topic,
+        "availability_topic": f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/bridge/availability",
         "device": site_info,
         "pl_on": "panic",
         "pl_off": "stop",
@@ -117,82 +121,11 @@ def ha_discovery_devices(
     sensor_name: str,
 ):
     """Auto Discover Devices"""
-    device_config = {}
-    capability = DEVICE_CAPABILITIES.get(sensor_name)
-    if capability is None:
+    template = DISCOVERY_COMPILER.entity_template(mqtt_config, sensor_name, device.device_definition.get("label"))
+    if template is None:
         LOGGER.warning(f"Unknown capability {sensor_name} for device {device.label} ({device.id}), skipping discovery")
         return None
-
-    device_type = capability.get("type")
-    capability_config = capability.get("config", {})
-
-    update_available = device.update_available
-    if update_available is False:
-        update_available = "(Up to Date)"
-    else:
-        update_available = f"(New Version Available: {update_available})"
-
-    device_info = {
-        "identifiers": [device.id],
-        "manufacturer": "Somfy",
-        "model": device.device_definition.get("label"),
-        "name": device.label,
-        "sw_version": f"{device.version} {update_available}",
-    }
-
-    command_topic = (
-        f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device.id}/{sensor_name}/command"
-    )
-    device_config["topic"] = (
-        f"{mqtt_config.get('ha_discover_prefix', 'homeassistant')}/"
-        f"{device_type}/{site_id}_{device.id}/{sensor_name}/config"
-    )
-    device_config["config"] = {
-        "name": sensor_name,
-        "unique_id": f"{device.id}_{sensor_name}",
-        "state_topic": (f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device.id}/state"),
-        "value_template": "{{ value_json." + sensor_name + " }}",
-        "device": device_info,
-    }
-
-    for config_entry, config_value in capability_config.items():
-        device_config["config"][config_entry] = config_value
-        # Specifiy for Intellitag Sensivity
-        if device.device_definition.get("label") == "IntelliTag" and sensor_name == "sensitivity":
-            intellitag_capability = DEVICE_CAPABILITIES.get(f"{sensor_name}_{device.device_definition.get('label')}")
-            if intellitag_capability:
-                device_config["config"][config_entry] = intellitag_capability.get("config", {}).get(config_entry)
-    if device_type in ("switch", "number", "select", "button"):
-        device_config["config"]["command_topic"] = command_topic
-    if device_type == "button":
-        device_config["config"].pop("state_topic", None)
-        device_config["config"].pop("value_template", None)
-    if sensor_name == "snapshot":
-        device_config["config"].pop("value_template")
-    if sensor_name == "stream":
-        device_config["config"].pop("value_template")
-    if sensor_name == "presence":
-        device_config["config"][
-            "state_topic"
-        ] = f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device.id}/presence"
-    if sensor_name == "motion_sensor":
-        device_config["config"][
-            "state_topic"
-        ] = f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device.id}/pir"
-        if device.device_definition.get("label") == "IntelliTag":
-            device_config["config"]["device_class"] = "safety"
-        if device.device_definition.get("label") == "Myfox Security Infrared Sensor":
-            device_config["config"]["device_class"] = "motion"
-    if sensor_name == "ringing":
-        device_config["config"][
-            "state_topic"
-        ] = f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device.id}/ringing"
-    if sensor_name == "video_backend":
-        device_config["config"][
-            "state_topic"
-        ] = f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device.id}/video_backend"
-
-    return device_config
+    return template.render(site_id, device.id, ha_device_info(device))
 
 
 def ha_discovery_cameras(
@@ -201,24 +134,34 @@ def ha_discovery_cameras(
     mqtt_config: dict,
 ):
     """Auto Discover Cameras"""
-    camera_config = {}
+    template = DISCOVERY_COMPILER.entity_template(mqtt_config, "camera", "")
+    return template.render(site_id, device.id, ha_camera_info(device))
 
-    device_info = {
-        "identifiers": [device.id],
-        "manufacturer": "Somfy",
-        "model": device.device_definition.get("label"),
-        "name": device.label,
-        "sw_version": device.version,
-    }
 
-    camera_config["topic"] = (
-        f"{mqtt_config.get('ha_discover_prefix', 'homeassistant')}/camera/{site_id}_{device.id}/snapshot/config"
+def ha_discovery_device_bundle(
+    site_id: str,
+    device: Device,
+    mqtt_config: dict,
+    entity_configs: list,
+):
+    """Auto Discover a Device with all its entities as components of a single config"""
+    device_info = None
+    components = {}
+    for entity_config in entity_configs:
+        # <ha_discover_prefix>/<platform>/<node_id>/<object_id>/config
+        platform = entity_config["topic"].split("/")[-4]
+        component = dict(entity_config["config"])
+        device_info = device_info or component.get("device")
+        component.pop("device", None)
+        components[component["unique_id"]] = {"platform": platform, **component}
+
+    device_config = {}
+    device_config["topic"] = (
+        f"{mqtt_config.get('ha_discover_prefix', 'homeassistant')}/device/{site_id}_{device.id}/config"
     )
-    camera_config["config"] = {
-        "name": "snapshot",
-        "unique_id": f"{device.id}_snapshot",
-        "topic": f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device.id}/snapshot",
-        "device": device_info,
+    device_config["config"] = {
+        "device": device_info or {"identifiers": [device.id], "manufacturer": "Somfy", "name": device.label},
+        "origin": DISCOVERY_ORIGIN,
+        "components": components,
     }
-
-    return camera_config
+    return device_config
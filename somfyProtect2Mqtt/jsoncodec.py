@@ -0,0 +1,133 @@
+"""JSON encoding and decoding
+
+JSON is on every hot path of the bridge: MQTT payloads, websocket events and
+acks, Somfy API responses. orjson or msgspec are used when installed, the
+standard library otherwise; the ``json_backend`` option picks one explicitly.
+Every backend writes the same compact UTF-8 JSON.
+"""
+
+import importlib
+import json
+import logging
+from typing import Any, Callable, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+# Tried in this order by the "auto" backend
+BACKENDS = ("orjson", "msgspec", "json")
+
+
+class EncodedJSON(bytes):
+    """JSON document encoded once, published as is"""
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf8")
+
+
+def _orjson():
+    orjson = importlib.import_module("orjson")
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            # e.g. integers beyond 64 bits
+            return _stdlib_dumps(obj)
+
+    return dumps, orjson.loads
+
+
+def _msgspec():
+    msgspec = importlib.import_module("msgspec")
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+
+    def dumps(obj: Any) -> bytes:
+        try:
+            return encoder.encode(obj)
+        except TypeError:
+            return _stdlib_dumps(obj)
+
+    def loads(data):
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    return dumps, loads
+
+
+_LOADERS = {"orjson": _orjson, "msgspec": _msgspec}
+
+
+class JsonCodec:
+    """JSON backend shared by the bridge.
+
+    Args:
+        backend (str | None): orjson, msgspec, json, or auto (None) for the fastest installed.
+    """
+
+    def __init__(self, backend: Optional[str] = None):
+        self.backend = "json"
+        self._dumps: Callable[[Any], bytes] = _stdlib_dumps
+        self._loads: Callable[[Any], Any] = json.loads
+        self.configure(backend)
+
+    def configure(self, backend: Optional[str] = None) -> None:
+        """Switch to another backend, the standard library when it is not installed."""
+        wanted = str(backend or "auto").lower()
+        candidates = BACKENDS if wanted == "auto" else (wanted,)
+        for name in candidates:
+            if name == "json":
+                break
+            loader = _LOADERS.get(name)
+            if loader is None:
+                LOGGER.warning("Unknown JSON backend {}, using the standard library".format(name))
+                break
+            try:
+                self._dumps, self._loads = loader()
+            except ImportError:
+                if wanted != "auto":
+                    LOGGER.warning("JSON backend {} is not installed, using the standard library".format(name))
+                continue
+            self.backend = name
+            LOGGER.debug("JSON backend: {}".format(name))
+            return
+        self.backend = "json"
+        self._dumps = _stdlib_dumps
+        self._loads = json.loads
+
+    def dumps(self, obj: Any) -> bytes:
+        """Encode obj to compact UTF-8 JSON."""
+        if isinstance(obj, EncodedJSON):
+            return obj
+        return self._dumps(obj)
+
+    def dumps_str(self, obj: Any) -> str:
+        """Encode obj to a compact JSON string."""
+        return self.dumps(obj).decode("utf8")
+
+    def loads(self, data) -> Any:
+        """Decode a JSON document (bytes or str).
+
+        Raises:
+            ValueError: Invalid JSON.
+        """
+        return self._loads(data)
+
+
+JSON_CODEC = JsonCodec()
+
+
+def encode_constant(obj: Any) -> EncodedJSON:
+    """Encode a constant payload once, to be published many times.
+
+    Args:
+        obj (Any): JSON serializable value.
+
+    Returns:
+        EncodedJSON: Encoded payload.
+    """
+    return EncodedJSON(_stdlib_dumps(obj))
@@ -10,6 +10,7 @@ import time
 
 from constants import WEBSOCKET_RECONNECT
 from exceptions import SomfyProtectInitError
+from jsoncodec import JSON_CODEC
 from mqtt import init_mqtt
 from somfy_protect.api import SomfyProtectApi
 from somfy_protect.sso import init_sso
@@ -30,11 +31,11 @@ def signal_handler(sig, _frame):
     shutdown_event.set()
 
 
-def somfy_protect_loop(config, mqtt_client, api):
+def somfy_protect_loop(config, mqtt_client, api, my_sites_id):
     """SomfyProtect 2 MQTT Loop"""
     somfy_protect_api = None
     try:
-        somfy_protect_api = SomfyProtect2Mqtt(api=api, mqtt_client=mqtt_client, config=config)
+        somfy_protect_api = SomfyProtect2Mqtt(api=api, mqtt_client=mqtt_client, config=config, my_sites_id=my_sites_id)
         time.sleep(1)
         somfy_protect_api.loop(shutdown_event=shutdown_event)
     except SomfyProtectInitError as e:
@@ -44,23 +45,26 @@ def somfy_protect_loop(config, mqtt_client, api):
         LOGGER.exception(f"API loop stopped unexpectedly: {e}")
 
 
-def _start_api_thread(config, mqtt_client, api):
+def _start_api_thread(config, mqtt_client, api, my_sites_id):
     return threading.Thread(
         target=somfy_protect_loop,
         args=(
             config,
             mqtt_client,
             api,
+            my_sites_id,
         ),
         name="somfy-api-loop",
     )
 
 
-def somfy_protect_wss_loop(sso, debug, config, mqtt_client, api, ws_state):
+def somfy_protect_wss_loop(sso, debug, config, mqtt_client, api, ws_state, my_sites_id):
     """SomfyProtect WSS Loop"""
     websocket_client = None
     try:
-        websocket_client = SomfyProtectWebsocket(sso=sso, debug=debug, config=config, mqtt_client=mqtt_client, api=api)
+        websocket_client = SomfyProtectWebsocket(
+            sso=sso, debug=debug, config=config, mqtt_client=mqtt_client, api=api, site_ids=my_sites_id
+        )
         ws_state["instance"] = websocket_client
         websocket_client.run_forever()
     except (OSError, RuntimeError) as e:
@@ -72,7 +76,7 @@ def somfy_protect_wss_loop(sso, debug, config, mqtt_client, api, ws_state):
         ws_state["instance"] = None
 
 
-def _start_wss_thread(sso, debug, config, mqtt_client, api, ws_state):
+def _start_wss_thread(sso, debug, config, mqtt_client, api, ws_state, my_sites_id):
     return threading.Thread(
         target=somfy_protect_wss_loop,
         args=(
@@ -82,6 +86,7 @@ def _start_wss_thread(sso, debug, config, mqtt_client, api, ws_state):
             mqtt_client,
             api,
             ws_state,
+            my_sites_id,
         ),
         name="somfy-websocket-loop",
     )
@@ -112,11 +117,16 @@ if __name__ == "__main__":
     setup_logger(debug=DEBUG, filename=_log_path)
 
     CONFIG = read_config_file(CONFIG_FILE)
+    # Persisted state lives next to the config file, like the token cache
+    if CONFIG_FILE:
+        CONFIG.setdefault("data_dir", _log_dir)
 
     # set Debug level from config or with -v
     DEBUG = CONFIG.get("debug", DEBUG)
     setup_logger(debug=DEBUG, filename=_log_path)
     LOGGER.info(f"Starting SomfyProtect2Mqtt {VERSION}")
+    JSON_CODEC.configure(CONFIG.get("json_backend"))
+    LOGGER.info(f"JSON backend: {JSON_CODEC.backend}")
 
     SSO = init_sso(config=CONFIG, config_file=CONFIG_FILE)
     if SSO is None:
@@ -127,6 +137,8 @@ if __name__ == "__main__":
     p1 = None
     p2 = None
     websocket_state = {"instance": None}
+    # Site IDs resolved by the API loop, for the websocket catch-up
+    MY_SITES_ID: list = []
     API_RESTART_BACKOFF = 5.0
 
     try:
@@ -134,6 +146,7 @@ if __name__ == "__main__":
             CONFIG,
             MQTT_CLIENT,
             API,
+            MY_SITES_ID,
         )
         p2 = _start_wss_thread(
             SSO,
@@ -142,6 +155,7 @@ if __name__ == "__main__":
             MQTT_CLIENT,
             API,
             websocket_state,
+            MY_SITES_ID,
         )
         p1.start()
         p2.start()
@@ -164,6 +178,7 @@ if __name__ == "__main__":
                     MQTT_CLIENT,
                     API,
                     websocket_state,
+                    MY_SITES_ID,
                 )
                 p2.start()
                 last_wss_restart = time.monotonic()
@@ -181,6 +196,7 @@ if __name__ == "__main__":
                     CONFIG,
                     MQTT_CLIENT,
                     API,
+                    MY_SITES_ID,
                 )
                 p1.start()
                 last_api_restart = time.monotonic()
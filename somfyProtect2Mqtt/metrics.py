@@ -0,0 +1,118 @@
+"""Bridge metrics
+
+Counters, gauges, latency summaries and labelled latency histograms shared by
+the bridge components, and published as one JSON document on
+``<topic_prefix>/bridge/metrics``.
+"""
+
+import bisect
+import threading
+
+# Upper bounds of the histogram buckets, in seconds
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """Thread-safe registry of counters, gauges, latency summaries and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = {}
+        self._gauges: dict[str, float] = {}
+        self._summaries: dict[str, list] = {}
+        self._histograms: dict[str, dict[str, list]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        """Increment a counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """Set a gauge to its current value."""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record a latency sample."""
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                self._summaries[name] = [1, seconds, seconds]
+                return
+            summary[0] += 1
+            summary[1] += seconds
+            summary[2] = max(summary[2], seconds)
+
+    def histogram(self, name: str, label: str, seconds: float) -> None:
+        """Record a latency sample in the histogram of a label.
+
+        Args:
+            name (str): Histogram name.
+            label (str): Label, e.g. an event key.
+            seconds (float): Latency.
+        """
+        index = bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            histogram = histograms.get(label)
+            if histogram is None:
+                histogram = histograms[label] = [0, 0.0, [0] * (len(HISTOGRAM_BUCKETS) + 1)]
+            histogram[0] += 1
+            histogram[1] += seconds
+            histogram[2][index] += 1
+
+    def counter(self, name: str) -> int:
+        """Return the value of a counter."""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def gauge(self, name: str) -> float | None:
+        """Return the value of a gauge."""
+        with self._lock:
+            return self._gauges.get(name)
+
+    def snapshot(self) -> dict:
+        """Return all metrics, latencies in milliseconds.
+
+        Histogram buckets are cumulative, keyed by their upper bound.
+
+        Returns:
+            dict: Counters, gauges, latency summaries and histograms.
+        """
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "latency_ms": {
+                    name: {
+                        "count": count,
+                        "avg": round(total * 1000 / count, 3),
+                        "max": round(maximum * 1000, 3),
+                    }
+                    for name, (count, total, maximum) in self._summaries.items()
+                },
+                "histograms_ms": {
+                    name: {label: _histogram_snapshot(*histogram) for label, histogram in histograms.items()}
+                    for name, histograms in self._histograms.items()
+                },
+            }
+
+    def reset(self) -> None:
+        """Forget every metric."""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+            self._histograms.clear()
+
+
+def _histogram_snapshot(count: int, total: float, buckets: list) -> dict:
+    cumulative = 0
+    snapshot = {}
+    for bound, bucket in zip(HISTOGRAM_BUCKETS + (None,), buckets):
+        cumulative += bucket
+        snapshot["+Inf" if bound is None else f"{bound * 1000:g}"] = cumulative
+    return {"count": count, "avg": round(total * 1000 / count, 3), "buckets": snapshot}
+
+
+METRICS = Metrics()
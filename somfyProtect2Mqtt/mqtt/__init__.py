@@ -3,61 +3,182 @@
 import json
 import logging
 import ssl
-from time import sleep
+import time
 
 import paho.mqtt.client as mqtt
-from business.mqtt import SUBSCRIBE_TOPICS, consume_mqtt_message
+from business.discovery_store import DISCOVERY_STORE
+from business.mqtt import (
+    DEVICE_STATE_FILTER,
+    SUBSCRIBE_TOPICS,
+    bridge_availability_topic,
+    command_subscriptions,
+    configure_command_routes,
+    consume_mqtt_message,
+    is_command_topic,
+)
+from business.settings_writer import SETTINGS_WRITER
+from constants import PUBLISH_PRIORITY_STATE, PUBLISH_QUEUE_MAXSIZE
 from exceptions import SomfyProtectInitError
+from metrics import METRICS
+from mqtt.commands import COMMAND_WORKERS, CommandPool, command_key
+from mqtt.properties import PublishProperties, mqtt_protocol_version
+from mqtt.publisher import MqttPublisher
+from mqtt.spool import DRAIN_RATE, SEGMENT_MAX_BYTES, SPOOL_DIRECTORY, MqttSpool
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from somfy_protect.api import SomfyProtectApi
+from utils import resolve_data_path
 
 LOGGER = logging.getLogger(__name__)
+# CONNACK codes of a broker refusing the protocol version: MQTT 3.1.1 and MQTT v5 ones
+UNSUPPORTED_PROTOCOL = (1, 132)
+# Seconds the broker keeps the session of the bridge (MQTT v5) with persistent_session, its
+# presence on reconnection tells whether the broker kept its state (retained discovery configs)
+SESSION_EXPIRY_INTERVAL = 24 * 3600
 
 
 class MQTTClient:
     """MQTT Client Class"""
 
-    def __init__(self, config, api, publish_delay=1):
-        self.publish_delay = publish_delay
-
-        self.client = mqtt.Client(client_id=config.get("client-id", "somfy-protect"))
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
-        self.client.on_publish = self.on_publish
-        self.client.on_disconnect = self.on_disconnect
-        self.client.username_pw_set(config.get("username"), config.get("password"))
-        if config.get("ssl", False) is True:
-            self.client.tls_set(cert_reqs=ssl.CERT_NONE)
-            self.client.tls_insecure_set(True)
+    def __init__(self, config, api, spool=None):
+        # Home Assistant birth message, sent when it (re)starts and needs discovery again
+        self.ha_status_topic = f"{config.get('ha_discover_prefix', 'homeassistant')}/status"
+        self.availability_topic = bridge_availability_topic(config)
+        self._disconnected_at = None
+
+        self.config = config
+        # Opt-in: the broker then also queues the QoS>0 commands sent while the bridge is offline
+        self.persistent_session = config.get("persistent_session", False) is True
+        self.properties = None
+        protocol = mqtt.MQTTv311
+        if mqtt_protocol_version(config) == 5:
+            self.properties = PublishProperties(
+                topic_aliases=config.get("topic_aliases", True),
+                event_properties=config.get("event_properties", True),
+            )
+            protocol = mqtt.MQTTv5
+        self.client = self._create_client(protocol)
+        publish_queue = config.get("publish_queue") or {}
+        self.publisher = MqttPublisher(
+            self.client,
+            max_size=publish_queue.get("max_size", PUBLISH_QUEUE_MAXSIZE),
+            max_inflight=publish_queue.get("max_inflight"),
+            inflight_timeout=publish_queue.get("inflight_timeout", 30),
+            spool=spool,
+            properties=self.properties,
+        )
         host = config.get("host", "127.0.0.1")
         port = config.get("port", 1883)
         ssl_enabled = config.get("ssl", False) is True
         try:
-            self.client.connect(host, port, 60)
+            self.client.connect(host, port, 60, **self._session_options())
         except (ConnectionRefusedError, OSError) as e:
             LOGGER.error("Unable to connect to MQTT broker {}:{} (ssl={}): {}".format(host, port, ssl_enabled, e))
             raise SomfyProtectInitError("Unable to initialize MQTT client") from e
+        self.commands = CommandPool(workers=config.get("command_workers", COMMAND_WORKERS))
+        self.commands.start()
         self.client.loop_start()
+        self.publisher.start()
 
-        self.config = config
         self.running = True
         self.api = api
 
         LOGGER.debug("MQTT client initialized")
 
-    def on_connect(self, _mqttc, _obj, _flags, rc):
+    def _create_client(self, protocol: int) -> mqtt.Client:
+        client_id = self.config.get("client-id", "somfy-protect")
+        if protocol == mqtt.MQTTv5:
+            client = mqtt.Client(client_id=client_id, protocol=protocol)
+        else:
+            client = mqtt.Client(client_id=client_id, protocol=protocol, clean_session=not self.persistent_session)
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+        client.on_publish = self.on_publish
+        client.on_disconnect = self.on_disconnect
+        client.on_connect_fail = self.on_connect_fail
+        # paho's network thread reconnects by itself, backing off between attempts
+        client.reconnect_delay_set(
+            min_delay=self.config.get("reconnect_min_delay", 1),
+            max_delay=self.config.get("reconnect_max_delay", 60),
+        )
+        client.will_set(self.availability_topic, "offline", qos=1, retain=True)
+        client.username_pw_set(self.config.get("username"), self.config.get("password"))
+        if self.config.get("ssl", False) is True:
+            client.tls_set(cert_reqs=ssl.CERT_NONE)
+            client.tls_insecure_set(True)
+        return client
+
+    def _session_options(self) -> dict:
+        if not self.persistent_session or self.properties is None:
+            return {}
+        properties = Properties(PacketTypes.CONNECT)
+        properties.SessionExpiryInterval = SESSION_EXPIRY_INTERVAL
+        return {"clean_start": False, "properties": properties}
+
+    def _fall_back_to_mqtt_311(self) -> None:
+        # Runs on the network thread of the refused client, which ends once the callback returned
+        LOGGER.warning("MQTT broker does not support MQTT v5, falling back to MQTT 3.1.1")
+        self.client.loop_stop()
+        self.publisher.properties = self.properties = None
+        self.client = self._create_client(mqtt.MQTTv311)
+        self.publisher.client = self.client
+        self.client.connect_async(
+            self.config.get("host", "127.0.0.1"), self.config.get("port", 1883), 60, **self._session_options()
+        )
+        self.client.loop_start()
+
+    def on_connect(self, _mqttc, _obj, flags, rc, properties=None):
         """MQTT on_connect"""
+        rc = getattr(rc, "value", rc)
         if rc == 0:
             LOGGER.info("Connected: {}".format(rc))
-            for topic in sorted(SUBSCRIBE_TOPICS):
-                LOGGER.info("Subscribing to: {}".format(topic))
-                self.client.subscribe(topic)
+            if self.properties is not None:
+                self.properties.reset(getattr(properties, "TopicAliasMaximum", 0))
+            METRICS.incr("mqtt_connects")
+            METRICS.set_gauge("mqtt_connected", 1)
+            if self._disconnected_at is not None:
+                METRICS.observe("mqtt_reconnect_duration", time.monotonic() - self._disconnected_at)
+                self._disconnected_at = None
+            # Straight to paho, ahead of anything queued or spooled while offline
+            self.client.publish(self.availability_topic, "online", qos=1, retain=True)
+            self.publisher.set_connected(True)
+            # The broker may have lost its retained states, let the next poll republish them all
+            DEVICE_STATE_FILTER.reset()
+            # Otherwise Home Assistant's birth message asks for discovery again when it needs it
+            if self.persistent_session and not (flags or {}).get("session present"):
+                # New session: the broker restarted, or was never connected to, and may not retain the
+                # discovery configs the persisted hashes say it has
+                LOGGER.info("New MQTT session, discovery will be republished")
+                DISCOVERY_STORE.invalidate()
+            # A few wildcards cover every command topic, all sent in a single SUBSCRIBE
+            topics = [self.ha_status_topic, *command_subscriptions()]
+            topics += sorted(topic for topic in SUBSCRIBE_TOPICS if not is_command_topic(topic))
+            LOGGER.info("Subscribing to: {}".format(", ".join(topics)))
+            self.client.subscribe([(topic, 0) for topic in topics])
+        elif self.properties is not None and rc in UNSUPPORTED_PROTOCOL:
+            METRICS.incr("mqtt_connect_failures")
+            self._fall_back_to_mqtt_311()
         else:
             LOGGER.info("Not Connected: {}".format(rc))
+            METRICS.incr("mqtt_connect_failures")
+
+    def on_connect_fail(self, _mqttc, _obj):
+        """MQTT on_connect_fail"""
+        LOGGER.warning("Unable to reach MQTT broker, paho will retry")
+        METRICS.incr("mqtt_connect_failures")
 
     def on_message(self, _mqttc, _obj, msg):
         """MQTT on_message"""
         LOGGER.debug("Message received on {}: {}".format(msg.topic, msg.payload))
-        consume_mqtt_message(
+        if msg.topic == self.ha_status_topic:
+            if msg.payload.decode("UTF-8", errors="replace").strip() == "online":
+                LOGGER.info("Home Assistant is online, discovery will be republished")
+                DISCOVERY_STORE.invalidate()
+            return
+        # Somfy API calls run on the command workers, in order per site/device
+        self.commands.submit(
+            command_key(msg.topic, self.config.get("topic_prefix", "somfyProtect2mqtt")),
+            consume_mqtt_message,
             msg=msg,
             mqtt_config=self.config,
             api=self.api,
@@ -67,32 +188,41 @@ class MQTTClient:
     def on_publish(self, _mqttc, _obj, result):
         """MQTT on_publish"""
         LOGGER.debug("Message published: {}".format(result))
+        self.publisher.on_publish(result)
 
-    def on_disconnect(self, client, _userdata, *args):
-        """MQTT on_disconnect"""
-        if len(args) == 1:
-            rc = args[0]
-        elif len(args) >= 2:
-            rc = args[1]
-        else:
-            rc = 0
+    def publish(
+        self, topic, payload, qos=0, retain=False, priority=PUBLISH_PRIORITY_STATE, expiry=None, event_time=None
+    ) -> bool:
+        """Queue a message on the bounded publisher.
+
+        Args:
+            topic (str): Topic.
+            payload: Encoded payload.
+            qos (int): QoS.
+            retain (bool): Retain flag.
+            priority (int): PUBLISH_PRIORITY_* class, the lowest is dropped first on overload.
+            expiry (float | None): Seconds after which the message is stale.
+            event_time (str | None): Time of the Somfy event behind the message, for tracing.
+
+        Returns:
+            bool: False when the message was dropped.
+        """
+        return self.publisher.publish(
+            topic, payload, qos=qos, retain=retain, priority=priority, expiry=expiry, event_time=event_time
+        )
 
-        if hasattr(rc, "value"):
-            rc = rc.value
+    def on_disconnect(self, _client, _userdata, rc=0, _properties=None):
+        """MQTT on_disconnect, with paho's version 1 callback signature: properties follow rc with MQTT v5"""
+        rc = getattr(rc, "value", rc)
 
+        self.publisher.set_connected(False)
+        METRICS.set_gauge("mqtt_connected", 0)
+        if self._disconnected_at is None:
+            self._disconnected_at = time.monotonic()
         if rc != 0:
+            # Never block here, this runs on paho's network thread which also reconnects
             LOGGER.warning("Unexpected MQTT disconnection (rc={}). Will auto-reconnect".format(rc))
-            backoff = 5
-            while self.running:
-                try:
-                    LOGGER.info("Reconnecting to MQTT")
-                    client.reconnect()
-                    LOGGER.info("Reconnecting to MQTT: Success")
-                    break
-                except (ConnectionRefusedError, OSError):
-                    LOGGER.warning("Reconnecting to MQTT fails")
-                    sleep(backoff)
-                    backoff = min(backoff * 2, 60)
+            METRICS.incr("mqtt_disconnects")
 
     def run(self):
         """MQTT run"""
@@ -101,8 +231,13 @@ class MQTTClient:
     def shutdown(self):
         """MQTT shutdown"""
         self.running = False
-        self.client.loop_stop()
+        self.commands.stop()
+        self.publisher.stop()
+        # A clean disconnection does not trigger the last will
+        if self.client.is_connected():
+            self.client.publish(self.availability_topic, "offline", qos=1, retain=True).wait_for_publish(timeout=2)
         self.client.disconnect()
+        self.client.loop_stop()
 
 
 def init_mqtt(config: dict, api: SomfyProtectApi) -> MQTTClient:
@@ -118,5 +253,21 @@ def init_mqtt(config: dict, api: SomfyProtectApi) -> MQTTClient:
     mqtt_config = config.get("mqtt")
     if mqtt_config is None:
         raise SomfyProtectInitError("MQTT config is missing")
-    mqtt_client = MQTTClient(config=mqtt_config, api=api)
+    DEVICE_STATE_FILTER.configure(mqtt_config.get("state_filters"))
+    configure_command_routes(mqtt_config.get("topic_prefix", "somfyProtect2mqtt"))
+    SETTINGS_WRITER.configure(mqtt_config.get("settings_debounce"))
+    spool = None
+    spool_config = mqtt_config.get("spool") or {}
+    if spool_config.get("enabled", False):
+        spool = MqttSpool(
+            resolve_data_path(config, SPOOL_DIRECTORY),
+            max_segment_bytes=spool_config.get("max_segment_bytes", SEGMENT_MAX_BYTES),
+            drain_rate=spool_config.get("drain_rate", DRAIN_RATE),
+        )
+        try:
+            spool.open()
+        except OSError as e:
+            LOGGER.warning("MQTT spool disabled, unable to open {}: {}".format(spool.directory, e))
+            spool = None
+    mqtt_client = MQTTClient(config=mqtt_config, api=api, spool=spool)
     return mqtt_client
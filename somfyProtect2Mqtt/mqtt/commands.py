@@ -0,0 +1,108 @@
+"""Inbound MQTT command workers
+
+Commands call the Somfy API (and may download a snapshot), which must not run
+on paho's network thread. Each command is handed to one of a few workers,
+picked from its site/device key: commands to one device run in order, while
+commands to different devices run in parallel.
+"""
+
+import logging
+import queue
+import threading
+import time
+import zlib
+from typing import Callable, Optional
+
+from metrics import METRICS
+
+LOGGER = logging.getLogger(__name__)
+
+COMMAND_WORKERS = 4
+COMMAND_QUEUE_MAXSIZE = 100
+
+
+def command_key(topic: str, topic_prefix: str = "somfyProtect2mqtt") -> str:
+    """Return the ordering key of a command topic: its site and device (or site command) parts.
+
+    Args:
+        topic (str): Command topic.
+        topic_prefix (str): Configured topic prefix, which may hold several levels.
+
+    Returns:
+        str: Site and device parts of the topic.
+    """
+    prefix = f"{topic_prefix.rstrip('/')}/"
+    if topic.startswith(prefix):
+        topic = topic[len(prefix) :]
+    else:
+        topic = topic.split("/", 1)[-1]
+    return "/".join(topic.split("/")[:2])
+
+
+class CommandPool:
+    """Workers running commands, in order per key.
+
+    Args:
+        workers (int): Number of worker threads.
+        maxsize (int): Maximum commands waiting per worker.
+    """
+
+    def __init__(self, workers: int = COMMAND_WORKERS, maxsize: int = COMMAND_QUEUE_MAXSIZE):
+        self._queues = [queue.Queue(maxsize=maxsize) for _ in range(max(1, int(workers)))]
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        """Start the worker threads."""
+        if self._threads:
+            return
+        for index, work_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(work_queue,), name=f"mqtt-command-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Let the workers finish the queued commands, then stop them."""
+        for work_queue in self._queues:
+            try:
+                work_queue.put(None, timeout=timeout)
+            except queue.Full:
+                LOGGER.warning("Command queue still full on shutdown")
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def submit(self, key: str, func: Callable, *args, **kwargs) -> bool:
+        """Queue a command without blocking.
+
+        Args:
+            key (str): Ordering key, commands sharing it run one after the other.
+            func (Callable): Command.
+
+        Returns:
+            bool: False when the command was dropped because its worker is overloaded.
+        """
+        work_queue = self._queues[zlib.crc32(key.encode("utf8")) % len(self._queues)]
+        try:
+            work_queue.put_nowait((time.monotonic(), key, func, args, kwargs))
+        except queue.Full:
+            LOGGER.warning("Too many pending commands, dropping command for {}".format(key))
+            METRICS.incr("mqtt_commands_dropped")
+            return False
+        return True
+
+    @staticmethod
+    def _run(work_queue: queue.Queue) -> None:
+        while True:
+            item: Optional[tuple] = work_queue.get()
+            if item is None:
+                return
+            queued_at, key, func, args, kwargs = item
+            started_at = time.monotonic()
+            METRICS.observe("mqtt_command_queue_wait", started_at - queued_at)
+            try:
+                func(*args, **kwargs)
+            except Exception:  # pylint: disable=broad-exception-caught
+                LOGGER.exception("Command for {} failed".format(key))
+            finally:
+                METRICS.observe("mqtt_command_exec", time.monotonic() - started_at)
+                METRICS.incr("mqtt_commands")
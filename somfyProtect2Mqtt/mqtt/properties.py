@@ -0,0 +1,95 @@
+"""MQTT v5 publish properties
+
+With ``mqtt.protocol: 5``, publishes carry:
+
+- a topic alias instead of the long topic of live frames, within the number
+  of aliases the broker announced on connection,
+- a message expiry on live frames and motion/ringing pulses, so that the broker
+  drops stale ones, retained copies included,
+- user properties with the time of the Somfy event and the time the bridge
+  sent it, for latency tracing, unless disabled.
+"""
+
+import math
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from constants import PUBLISH_PRIORITY_FRAME
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+
+def mqtt_protocol_version(config: dict) -> int:
+    """Return 5 when MQTT v5 is enabled in the MQTT configuration, 4 (MQTT 3.1.1) otherwise."""
+    return 5 if str(config.get("protocol", "3.1.1")).lower() in ("5", "5.0", "mqttv5") else 4
+
+
+class PublishProperties:
+    """Build the MQTT v5 properties of outgoing messages.
+
+    Args:
+        topic_aliases (bool): Replace frame topics with topic aliases.
+        event_properties (bool): Add the event_time/sent_at user properties.
+    """
+
+    def __init__(self, topic_aliases: bool = True, event_properties: bool = True):
+        self.topic_aliases = topic_aliases
+        self.event_properties = event_properties
+        self._lock = threading.Lock()
+        self._aliases: dict[str, int] = {}
+        self._announced: set[int] = set()
+        self._maximum = 0
+
+    def reset(self, alias_maximum: int) -> None:
+        """Forget the aliases of the previous connection, the broker allows alias_maximum of them."""
+        with self._lock:
+            self._aliases.clear()
+            self._announced.clear()
+            self._maximum = alias_maximum if self.topic_aliases else 0
+
+    def build(
+        self,
+        topic: str,
+        qos: int,
+        priority: int,
+        expiry: Optional[float] = None,
+        event_time: Optional[str] = None,
+    ) -> tuple[str, Optional[Properties]]:
+        """Return the topic to send and the properties of a message.
+
+        Args:
+            topic (str): Topic.
+            qos (int): QoS.
+            priority (int): PUBLISH_PRIORITY_* class.
+            expiry (float | None): Seconds before the message is stale.
+            event_time (str | None): Time of the Somfy event behind the message.
+
+        Returns:
+            tuple: Topic, empty when the alias is enough, and properties (None without any).
+        """
+        properties = Properties(PacketTypes.PUBLISH)
+        if expiry is not None:
+            properties.MessageExpiryInterval = max(1, math.ceil(expiry))
+        if event_time and self.event_properties:
+            sent_at = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+            properties.UserProperty = [("event_time", str(event_time)), ("sent_at", sent_at)]
+        if priority == PUBLISH_PRIORITY_FRAME:
+            topic = self._alias(topic, qos, properties)
+        return topic, None if properties.isEmpty() else properties
+
+    def _alias(self, topic: str, qos: int, properties: Properties) -> str:
+        with self._lock:
+            alias = self._aliases.get(topic)
+            if alias is None:
+                if len(self._aliases) >= self._maximum:
+                    return topic
+                alias = len(self._aliases) + 1
+                self._aliases[topic] = alias
+            properties.TopicAlias = alias
+            # paho re-sends QoS 1/2 messages after a reconnection, when the alias is unknown
+            # to the broker again, so only QoS 0 messages are sent with the alias alone
+            if qos == 0 and alias in self._announced:
+                return ""
+            self._announced.add(alias)
+            return topic
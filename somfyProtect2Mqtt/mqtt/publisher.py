@@ -0,0 +1,363 @@
+"""Bounded MQTT publisher
+
+paho queues every outgoing message without limit, so a snapshot storm or a
+broker hiccup can grow the bridge memory without bound. Publishes go through a
+bounded queue instead, drained by one thread with a maximum number of
+unacknowledged messages per QoS:
+
+- a retained message still queued is replaced by a newer one on the same topic,
+  queued last at the higher of both priorities, except for alarms whose every
+  transition goes out,
+- when the queue is full, frames are dropped before states, and states before
+  alarms, oldest first,
+- messages wait in the queue while the broker is unreachable, or in the disk
+  spool when one is configured (see ``mqtt.spool``),
+- a message with an expiry is dropped once stale instead of being sent.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+from constants import (
+    PUBLISH_MAX_INFLIGHT,
+    PUBLISH_PRIORITY_ALARM,
+    PUBLISH_PRIORITY_FRAME,
+    PUBLISH_PRIORITY_STATE,
+    PUBLISH_QUEUE_MAXSIZE,
+)
+from metrics import METRICS
+from mqtt.properties import PublishProperties
+from mqtt.spool import MqttSpool
+from tracing import EVENT_TRACE, EventTrace
+
+LOGGER = logging.getLogger(__name__)
+
+PRIORITY_NAMES = {
+    PUBLISH_PRIORITY_FRAME: "frame",
+    PUBLISH_PRIORITY_STATE: "state",
+    PUBLISH_PRIORITY_ALARM: "alarm",
+}
+# Highest priority first
+DRAIN_ORDER = sorted(PRIORITY_NAMES, reverse=True)
+EARLY_ACKS_MAXSIZE = 1024
+
+
+class _Message:
+    __slots__ = ("topic", "payload", "qos", "retain", "priority", "enqueued_at", "expires_at", "event_time", "trace")
+
+    def __init__(self, topic: str, payload, qos: int, retain: bool, priority: int, enqueued_at: float):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.priority = priority
+        self.enqueued_at = enqueued_at
+        self.expires_at: Optional[float] = None
+        self.event_time: Optional[str] = None
+        self.trace: Optional[EventTrace] = None
+
+
+class MqttPublisher:
+    """Publish through a bounded, prioritized queue with a per-QoS in-flight limit.
+
+    Args:
+        client (mqtt.Client): Connected paho client.
+        max_size (int): Maximum number of queued messages.
+        max_inflight (dict | None): Maximum unacknowledged messages per QoS.
+        inflight_timeout (float): Seconds after which an unacknowledged message frees its slot.
+        spool (MqttSpool | None): Disk spool for non-ephemeral messages during outages.
+        properties (PublishProperties | None): MQTT v5 properties builder, None for MQTT 3.1.1.
+        clock (callable): Monotonic clock, for tests.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        client,
+        max_size: int = PUBLISH_QUEUE_MAXSIZE,
+        max_inflight: Optional[dict] = None,
+        inflight_timeout: float = 30.0,
+        spool: Optional[MqttSpool] = None,
+        properties: Optional[PublishProperties] = None,
+        clock=time.monotonic,
+    ):
+        self.client = client
+        self.spool = spool
+        self.properties = properties
+        self.max_size = max(1, int(max_size))
+        self.max_inflight = dict(PUBLISH_MAX_INFLIGHT)
+        self.max_inflight.update({int(qos): max(1, int(value)) for qos, value in (max_inflight or {}).items()})
+        self.inflight_timeout = inflight_timeout
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._queues: dict[int, deque] = {priority: deque() for priority in PRIORITY_NAMES}
+        self._retained: dict[str, _Message] = {}
+        self._size = 0
+        self._inflight: dict[int, tuple[int, float, float, Optional[EventTrace]]] = {}
+        self._inflight_count = {qos: 0 for qos in self.max_inflight}
+        self._early_acks: set[int] = set()
+        self._connected = False
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def depth(self) -> int:
+        """Number of queued messages."""
+        with self._cond:
+            return self._size
+
+    @property
+    def backlog(self) -> int:
+        """Number of messages queued, or sent and not acknowledged yet."""
+        with self._cond:
+            return self._size + sum(self._inflight_count.values())
+
+    def start(self) -> None:
+        """Start the drain thread."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="mqtt-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """Give queued messages up to timeout seconds to go out, then stop the drain thread."""
+        deadline = self._clock() + timeout
+        with self._cond:
+            while self._size and self._connected and self._clock() < deadline:
+                self._cond.wait(0.1)
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        if self.spool:
+            self.spool.close()
+
+    def set_connected(self, connected: bool) -> None:
+        """Resume draining on connection, forget in-flight messages on disconnection."""
+        with self._cond:
+            self._connected = connected
+            if not connected:
+                # paho re-sends QoS 1/2 messages itself once reconnected
+                self._inflight.clear()
+                self._early_acks.clear()
+                for qos in self._inflight_count:
+                    self._inflight_count[qos] = 0
+                self._update_gauges()
+            self._cond.notify_all()
+
+    def publish(
+        self,
+        topic: str,
+        payload,
+        qos: int = 0,
+        retain: bool = False,
+        priority: int = PUBLISH_PRIORITY_STATE,
+        expiry: Optional[float] = None,
+        event_time: Optional[str] = None,
+    ) -> bool:
+        """Queue a message.
+
+        Args:
+            topic (str): Topic.
+            payload: Encoded payload.
+            qos (int): QoS.
+            retain (bool): Retain flag.
+            priority (int): PUBLISH_PRIORITY_* class, the lowest is dropped first.
+            expiry (float | None): Seconds after which the message is stale.
+            event_time (str | None): Time of the Somfy event behind the message, for tracing.
+                Defaults to the one of the websocket event being handled.
+
+        Returns:
+            bool: False when the message was dropped.
+        """
+        trace = EVENT_TRACE.get()
+        if event_time is None and trace is not None:
+            event_time = trace.event_time
+        with self._cond:
+            # Once spooling, keep spooling until drained so that messages stay in order
+            if self.spool and self.spool.spooled(retain, priority) and (not self._connected or self.spool.pending):
+                self.spool.append(topic, payload, qos, retain, priority, expiry=expiry, event_time=event_time)
+                METRICS.incr("mqtt_publish_spooled")
+                METRICS.set_gauge("mqtt_spool_pending", self.spool.pending)
+                return True
+            return self._enqueue(topic, payload, qos, retain, priority, expiry, event_time, trace)
+
+    def _enqueue(
+        self,
+        topic: str,
+        payload,
+        qos: int,
+        retain: bool,
+        priority: int,
+        expiry: Optional[float] = None,
+        event_time: Optional[str] = None,
+        trace: Optional[EventTrace] = None,
+    ) -> bool:
+        now = self._clock()
+        expires_at = now + expiry if expiry is not None else None
+        if retain and priority != PUBLISH_PRIORITY_ALARM:
+            queued = self._retained.pop(topic, None)
+            if queued is not None:
+                # Queued again, not updated in place: it must not overtake the messages queued since
+                self._queues[queued.priority].remove(queued)
+                self._size -= 1
+                priority = max(priority, queued.priority)
+                qos = max(qos, queued.qos)
+                METRICS.incr("mqtt_publish_coalesced")
+        if self._size >= self.max_size and not self._drop_below(priority):
+            METRICS.incr(f"mqtt_publish_dropped_{PRIORITY_NAMES[priority]}")
+            return False
+        message = _Message(topic, payload, qos, retain, priority, now)
+        message.expires_at = expires_at
+        message.event_time = event_time
+        message.trace = trace
+        self._queues[priority].append(message)
+        if retain and priority != PUBLISH_PRIORITY_ALARM:
+            self._retained[topic] = message
+        self._size += 1
+        self._update_gauges()
+        self._cond.notify_all()
+        return True
+
+    def on_publish(self, mid: int) -> None:
+        """Release the in-flight slot of an acknowledged message."""
+        with self._cond:
+            if not self._complete(mid):
+                if len(self._early_acks) >= EARLY_ACKS_MAXSIZE:
+                    self._early_acks.clear()
+                self._early_acks.add(mid)
+
+    def _complete(self, mid: int) -> bool:
+        inflight = self._inflight.pop(mid, None)
+        if inflight is None:
+            return False
+        qos, enqueued_at, _, trace = inflight
+        self._inflight_count[qos] -= 1
+        METRICS.observe("mqtt_publish_latency", self._clock() - enqueued_at)
+        if trace is not None:
+            trace.observe("publish")
+        self._update_gauges()
+        self._cond.notify_all()
+        return True
+
+    def _drop_below(self, priority: int) -> bool:
+        for lower in sorted(PRIORITY_NAMES):
+            if lower > priority:
+                break
+            queue = self._queues[lower]
+            if queue:
+                dropped = queue.popleft()
+                self._unindex(dropped)
+                self._size -= 1
+                METRICS.incr(f"mqtt_publish_dropped_{PRIORITY_NAMES[lower]}")
+                LOGGER.debug("Publish queue full, dropping message on {}".format(dropped.topic))
+                return True
+        return False
+
+    def _unindex(self, message: _Message) -> None:
+        if message.retain and self._retained.get(message.topic) is message:
+            del self._retained[message.topic]
+
+    def _next_message(self) -> Optional[_Message]:
+        if not self._connected:
+            return None
+        now = self._clock()
+        for priority in DRAIN_ORDER:
+            queue = self._queues[priority]
+            while queue and queue[0].expires_at is not None and queue[0].expires_at <= now:
+                self._unindex(queue.popleft())
+                self._size -= 1
+                METRICS.incr("mqtt_publish_expired")
+            if queue and self._inflight_count[queue[0].qos] < self.max_inflight[queue[0].qos]:
+                message = queue.popleft()
+                self._unindex(message)
+                self._size -= 1
+                self._inflight_count[message.qos] += 1
+                return message
+        return None
+
+    def _expire_inflight(self) -> None:
+        now = self._clock()
+        for mid, (qos, _, sent_at, _) in list(self._inflight.items()):
+            if now - sent_at > self.inflight_timeout:
+                del self._inflight[mid]
+                self._inflight_count[qos] -= 1
+                METRICS.incr("mqtt_publish_inflight_expired")
+
+    def _update_gauges(self) -> None:
+        METRICS.set_gauge("mqtt_publish_queue_depth", self._size)
+        for qos, count in self._inflight_count.items():
+            METRICS.set_gauge(f"mqtt_publish_inflight_qos{qos}", count)
+
+    def _refill(self) -> float:
+        """Move the next spooled message to the queue, return how long to wait before trying again."""
+        if not self.spool or not self._connected or self._size >= max(1, self.max_size // 2):
+            return 1.0
+        spooled, retry_after = self.spool.next_message()
+        METRICS.set_gauge("mqtt_spool_pending", self.spool.pending)
+        if spooled is None:
+            return min(retry_after, 1.0)
+        self._enqueue(
+            spooled.topic,
+            spooled.payload,
+            spooled.qos,
+            spooled.retain,
+            spooled.priority,
+            spooled.expiry,
+            spooled.event_time,
+        )
+        return 0.0
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                message = self._next_message()
+                while message is None:
+                    if not self._running:
+                        return
+                    timeout = self._refill()
+                    if timeout:
+                        self._cond.wait(timeout)
+                        self._expire_inflight()
+                    message = self._next_message()
+            self._send(message)
+
+    def _send(self, message: _Message) -> None:
+        METRICS.observe("mqtt_publish_queue_wait", self._clock() - message.enqueued_at)
+        # Not called under the queue lock, paho may run on_publish from this very call
+        if self.properties is None:
+            info = self.client.publish(message.topic, message.payload, qos=message.qos, retain=message.retain)
+        else:
+            expiry = None if message.expires_at is None else message.expires_at - self._clock()
+            topic, properties = self.properties.build(
+                message.topic, message.qos, message.priority, expiry=expiry, event_time=message.event_time
+            )
+            info = self.client.publish(
+                topic, message.payload, qos=message.qos, retain=message.retain, properties=properties
+            )
+        with self._cond:
+            if info.rc == mqtt.MQTT_ERR_NO_CONN and message.qos == 0:
+                # Lost while disconnecting, keep it for the next connection
+                self._inflight_count[0] -= 1
+                self._connected = False
+                if not (message.retain and message.topic in self._retained):
+                    self._queues[message.priority].appendleft(message)
+                    if message.retain:
+                        self._retained[message.topic] = message
+                    self._size += 1
+                self._update_gauges()
+                return
+            METRICS.incr("mqtt_publish_sent")
+            self._inflight[info.mid] = (message.qos, message.enqueued_at, self._clock(), message.trace)
+            if info.mid in self._early_acks:
+                self._early_acks.discard(info.mid)
+                self._complete(info.mid)
+            self._update_gauges()
@@ -0,0 +1,299 @@
+"""Disk spool of outbound MQTT messages
+
+While the broker is unreachable, non-ephemeral messages (retained states,
+history, alarm transitions) are appended to segment files instead of memory,
+so memory stays flat during long outages and a restart does not lose them.
+Once connected again, the publisher drains the spool at a controlled rate,
+in order. A retained state superseded by a newer one on the same topic is
+skipped, alarm transitions are all kept, and messages past their expiry are
+dropped. The sequence number of the last message handed back is kept next to
+the segments, so that a restart resumes a partly drained segment where it
+stopped instead of publishing its first messages again.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, NamedTuple, Optional
+
+from constants import PUBLISH_PRIORITY_ALARM, PUBLISH_PRIORITY_FRAME
+
+LOGGER = logging.getLogger(__name__)
+
+SPOOL_DIRECTORY = "mqtt_spool"
+SEGMENT_SUFFIX = ".spool"
+DRAINED_FILENAME = "drained"
+SEGMENT_MAX_BYTES = 1024 * 1024
+DRAIN_RATE = 50
+
+
+class SpooledMessage(NamedTuple):
+    """Message read back from the spool"""
+
+    topic: str
+    payload: Any
+    qos: int
+    retain: bool
+    priority: int
+    expiry: Optional[float] = None
+    event_time: Optional[str] = None
+
+
+class MqttSpool:
+    """Append-only segment files holding messages until the broker is back.
+
+    Args:
+        directory (str): Segment directory.
+        max_segment_bytes (int): Size after which a new segment is started.
+        drain_rate (float): Maximum messages per second handed back to the publisher.
+        clock (callable): Monotonic clock, for tests.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        directory: str,
+        max_segment_bytes: int = SEGMENT_MAX_BYTES,
+        drain_rate: float = DRAIN_RATE,
+        clock=time.monotonic,
+    ):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.drain_rate = max(float(drain_rate), 1.0)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._segments: list[str] = []
+        self._writer = None
+        self._reader = None
+        self._seq = 0
+        # Sequence number of the last record handed back, or skipped, by next_message
+        self._drained = 0
+        self._pending = 0
+        self._latest: dict[str, int] = {}
+        self._next_drain = 0.0
+
+    @staticmethod
+    def spooled(retain: bool, priority: int) -> bool:
+        """Return True for messages worth keeping across an outage, frames are not."""
+        if priority == PUBLISH_PRIORITY_FRAME:
+            return False
+        return retain or priority == PUBLISH_PRIORITY_ALARM
+
+    @property
+    def pending(self) -> int:
+        """Number of spooled messages not handed back yet."""
+        with self._lock:
+            return self._pending
+
+    def open(self) -> None:
+        """Create the spool directory and index the segments left by a previous run."""
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        with self._lock:
+            self._segments = [os.path.join(self.directory, name) for name in names]
+            self._drained = self._read_drained() if self._segments else 0
+            self._seq = max(self._seq, self._drained)
+            for path in self._segments:
+                for record in self._read_records(path):
+                    if record["s"] > self._drained:
+                        self._index(record)
+        if self._pending:
+            LOGGER.info("{} message(s) left in MQTT spool {}".format(self._pending, self.directory))
+
+    def close(self) -> None:
+        """Close the open segment files."""
+        with self._lock:
+            for handle in (self._writer, self._reader):
+                if handle:
+                    handle.close()
+            self._writer = None
+            self._reader = None
+
+    def append(
+        self,
+        topic: str,
+        payload,
+        qos: int,
+        retain: bool,
+        priority: int,
+        expiry: Optional[float] = None,
+        event_time: Optional[str] = None,
+    ) -> None:
+        """Append a message to the current segment.
+
+        Args:
+            topic (str): Topic.
+            payload: Encoded payload (bytes or str).
+            qos (int): QoS.
+            retain (bool): Retain flag.
+            priority (int): PUBLISH_PRIORITY_* class.
+            expiry (float | None): Seconds after which the message is stale.
+            event_time (str | None): Time of the Somfy event behind the message.
+        """
+        is_bytes = isinstance(payload, (bytes, bytearray))
+        with self._lock:
+            self._seq += 1
+            record = {
+                "s": self._seq,
+                "t": topic,
+                "p": bytes(payload).decode("utf8") if is_bytes else payload,
+                "b": is_bytes,
+                "q": qos,
+                "r": retain,
+                "c": priority,
+            }
+            if expiry is not None:
+                # Wall clock, the spool outlives the process
+                record["x"] = time.time() + expiry
+            if event_time:
+                record["e"] = event_time
+            writer = self._current_writer()
+            writer.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            writer.flush()
+            self._index(record)
+
+    def next_message(self) -> tuple[Optional[SpooledMessage], float]:
+        """Return the next message to publish, at most drain_rate per second.
+
+        Returns:
+            tuple: Message (None when empty or rate limited), seconds before asking again.
+        """
+        with self._lock:
+            if not self._pending:
+                return None, 1.0
+            now = self._clock()
+            if now < self._next_drain:
+                return None, self._next_drain - now
+            while self._pending:
+                record = self._read_next()
+                if record is None:
+                    break
+                self._pending -= 1
+                self._drained = record["s"]
+                if self._superseded(record):
+                    continue
+                expiry = record["x"] - time.time() if record.get("x") is not None else None
+                if expiry is not None and expiry <= 0:
+                    continue
+                self._next_drain = max(now, self._next_drain) + 1.0 / self.drain_rate
+                if self._pending:
+                    self._write_drained()
+                else:
+                    self._reset()
+                payload = record["p"].encode("utf8") if record.get("b") else record["p"]
+                message = SpooledMessage(
+                    record["t"], payload, record["q"], record["r"], record["c"], expiry, record.get("e")
+                )
+                return message, 0.0
+            self._reset()
+            return None, 1.0
+
+    def _index(self, record: dict) -> None:
+        self._seq = max(self._seq, record["s"])
+        self._pending += 1
+        if record["r"] and record["c"] != PUBLISH_PRIORITY_ALARM:
+            self._latest[record["t"]] = record["s"]
+
+    def _superseded(self, record: dict) -> bool:
+        topic = record["t"]
+        if topic not in self._latest or not record["r"] or record["c"] == PUBLISH_PRIORITY_ALARM:
+            return False
+        if self._latest[topic] != record["s"]:
+            return True
+        del self._latest[topic]
+        return False
+
+    def _current_writer(self):
+        if self._writer and self._writer.tell() < self.max_segment_bytes:
+            return self._writer
+        if self._writer:
+            self._writer.close()
+        path = os.path.join(self.directory, f"{self._seq:012d}{SEGMENT_SUFFIX}")
+        self._segments.append(path)
+        self._writer = open(path, "a", encoding="utf8")  # pylint: disable=consider-using-with
+        return self._writer
+
+    def _read_next(self) -> Optional[dict]:
+        while self._segments:
+            if self._reader is None:
+                self._reader = open(self._segments[0], "r", encoding="utf8")  # pylint: disable=consider-using-with
+            line = self._reader.readline()
+            if line.endswith("\n"):
+                record = self._parse(line)
+                # Handed back before a restart
+                if record is not None and record["s"] > self._drained:
+                    return record
+                continue
+            if self._writer and self._writer.name == self._segments[0]:
+                # Caught up with the segment being written
+                return None
+            self._reader.close()
+            self._reader = None
+            self._remove(self._segments.pop(0))
+        return None
+
+    def _reset(self) -> None:
+        """Remove the drained segments, the next message starts a new one."""
+        for handle in (self._writer, self._reader):
+            if handle:
+                handle.close()
+        self._writer = None
+        self._reader = None
+        for path in self._segments:
+            self._remove(path)
+        self._segments = []
+        drained_path = os.path.join(self.directory, DRAINED_FILENAME)
+        if os.path.exists(drained_path):
+            self._remove(drained_path)
+        self._latest.clear()
+        self._pending = 0
+
+    def _read_drained(self) -> int:
+        try:
+            with open(os.path.join(self.directory, DRAINED_FILENAME), "r", encoding="utf8") as drained:
+                return int(drained.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            LOGGER.warning("Unable to read MQTT spool position, replaying from the start: {}".format(e))
+            return 0
+
+    def _write_drained(self) -> None:
+        path = os.path.join(self.directory, DRAINED_FILENAME)
+        try:
+            with open(path + ".tmp", "w", encoding="utf8") as drained:
+                drained.write(str(self._drained))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            LOGGER.warning("Unable to save MQTT spool position: {}".format(e))
+
+    def _read_records(self, path: str):
+        try:
+            with open(path, "r", encoding="utf8") as segment:
+                for line in segment:
+                    record = self._parse(line)
+                    if record is not None:
+                        yield record
+        except OSError as e:
+            LOGGER.warning("Unable to read MQTT spool segment {}: {}".format(path, e))
+
+    @staticmethod
+    def _parse(line: str) -> Optional[dict]:
+        try:
+            record = json.loads(line)
+            if isinstance(record, dict) and {"s", "t", "p", "q", "r", "c"} <= record.keys():
+                return record
+        except ValueError:
+            pass
+        LOGGER.warning("Skipping unreadable MQTT spool record")
+        return None
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError as e:
+            LOGGER.warning("Unable to remove MQTT spool segment {}: {}".format(path, e))
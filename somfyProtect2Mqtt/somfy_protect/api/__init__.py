@@ -1,14 +1,13 @@
 """Somfy Protect Api"""
 
 import base64
-import json
 import logging
 import time
-from json import JSONDecodeError
 from typing import Any, Callable, Dict, List, Optional, Union
 from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
 
 from constants import REQUEST_TIMEOUT
+from jsoncodec import JSON_CODEC
 from requests import RequestException, Response
 from requests_oauthlib import OAuth2Session
 from somfy_protect.api.devices.category import Category
@@ -178,7 +177,7 @@ class SomfyProtectApi:
         """
         response = self.get("/v3/site")
         response.raise_for_status()
-        return [Site(**s) for s in response.json().get("items")]
+        return [Site(**s) for s in _decode(response).get("items")]
 
     def get_site(self, site_id: str) -> Site:
         """Get a site.
@@ -192,7 +191,7 @@ class SomfyProtectApi:
         """
         response = self.get(f"/v3/site/{site_id}")
         response.raise_for_status()
-        return Site(**response.json())
+        return Site(**_decode(response))
 
     def get_site_scenario(self, site_id: str) -> Dict[str, Any]:
         """Get site scenarios.
@@ -206,7 +205,7 @@ class SomfyProtectApi:
         """
         response = self.get(f"/v4/api/site/{site_id}/device/all/scenario")
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def update_security_level(self, site_id: str, security_level: Union[AvailableStatus, str]) -> Dict:
         """Set alarm security level.
@@ -236,7 +235,7 @@ class SomfyProtectApi:
         payload = {"status": status}
         response = self.put(f"/v3/site/{site_id}/security", payload=payload)
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def stop_alarm(self, site_id: str) -> Dict:
         """Stop the current alarm.
@@ -249,7 +248,7 @@ class SomfyProtectApi:
         """
         response = self.put(f"/v3/site/{site_id}/alarm/stop", payload={})
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def trigger_alarm(self, site_id: str, mode: str) -> Dict:
         """Trigger an alarm.
@@ -266,7 +265,7 @@ class SomfyProtectApi:
         payload = {"type": mode}
         response = self.post(f"/v3/site/{site_id}/panic", payload=payload)
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def action_device(
         self,
@@ -300,7 +299,7 @@ class SomfyProtectApi:
                 payload={"action": action},
             )
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def update_device(
         self,
@@ -329,7 +328,7 @@ class SomfyProtectApi:
         payload = {"settings": settings, "label": device_label}
         response = self.put(f"/v3/site/{site_id}/device/{device_id}", payload=payload)
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def camera_snapshot(self, site_id: str, device_id: str) -> Optional[Response]:
         """Get a camera snapshot.
@@ -365,7 +364,7 @@ class SomfyProtectApi:
             payload={},
         )
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def get_devices(self, site_id: str, category: Optional[Category] = None) -> List[Device]:
         """List devices for a site.
@@ -380,8 +379,8 @@ class SomfyProtectApi:
         devices = []  # type: List[Device]
         response = self.get(f"/v3/site/{site_id}/device")
         try:
-            content = response.json()
-        except JSONDecodeError as exc:
+            content = _decode(response)
+        except ValueError as exc:
             response.raise_for_status()
             LOGGER.error("Unable to decode devices response: {}".format(response.text))
             raise exc
@@ -409,7 +408,7 @@ class SomfyProtectApi:
         """
         response = self.get(f"/v3/site/{site_id}/device/{device_id}")
         response.raise_for_status()
-        return Device(**response.json())
+        return Device(**_decode(response))
 
     def get_users(self, site_id: str) -> List[User]:
         """List users for a site.
@@ -423,7 +422,7 @@ class SomfyProtectApi:
         response = self.get(f"/v3/site/{site_id}/user")
         LOGGER.debug("Users response status: {}".format(response.status_code))
         response.raise_for_status()
-        return [User(**s) for s in response.json().get("items")]
+        return [User(**s) for s in _decode(response).get("items")]
 
     def get_user(self, site_id: str, user_id: str) -> Dict[str, Any]:
         """Get user details.
@@ -438,7 +437,7 @@ class SomfyProtectApi:
         response = self.get(f"/v3/site/{site_id}/user/{user_id}")
         LOGGER.debug("User response status: {}".format(response.status_code))
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def action_user(
         self,
@@ -464,7 +463,7 @@ class SomfyProtectApi:
             payload={"action": action},
         )
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def get_scenarios_core(
         self,
@@ -480,7 +479,7 @@ class SomfyProtectApi:
         """
         response = self.get(f"/v3/site/{site_id}/scenario-core")
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def get_scenarios(
         self,
@@ -496,7 +495,7 @@ class SomfyProtectApi:
         """
         response = self.get(f"/v3/site/{site_id}/scenario")
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def test_siren(self, site_id: str, device_id: str, sound: str) -> Dict:
         """Test a siren.
@@ -513,7 +512,7 @@ class SomfyProtectApi:
             raise ValueError("Sound value is not valid")
         response = self.post(f"/v3/site/{site_id}/device/{device_id}/sound/{sound}", payload={})
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def get_history(
         self,
@@ -530,7 +529,7 @@ class SomfyProtectApi:
         # response = self.get(f"/v3/site/{site_id}/history?order=-1&limit=100")
         response = self.get(f"/v3/site/{site_id}/history")
         response.raise_for_status()
-        return response.json().get("items")
+        return _decode(response).get("items")
 
     def get_device_events(
         self,
@@ -556,7 +555,7 @@ class SomfyProtectApi:
         )
         LOGGER.debug("Device events response status: {}".format(response.status_code))
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
 
     def trigger_access(
         self,
@@ -582,7 +581,12 @@ class SomfyProtectApi:
             payload={"type": access},
         )
         response.raise_for_status()
-        return response.json()
+        return _decode(response)
+
+
+def _decode(response: Response) -> Any:
+    """Decode a JSON response body with the shared JSON backend."""
+    return JSON_CODEC.loads(response.content)
 
 
 def _redact_url(url: str) -> str:
@@ -22,6 +22,7 @@ import av
 from aiortc import AudioStreamTrack, RTCConfiguration, RTCIceServer, RTCPeerConnection, RTCSessionDescription
 from aiortc.mediastreams import MediaStreamError
 from business.mqtt import publish_snapshot_bytes
+from constants import DEFAULT_HLS_HOST, DEFAULT_HLS_PORT
 from PIL import ImageDraw, ImageFont
 
 # Set PyAV logging level to ERROR to suppress FFmpeg warnings
@@ -37,12 +38,6 @@ logging.getLogger("aiortc.codecs.h264").setLevel(logging.ERROR)
 # has to outlast that negotiation rather than the frame interval.
 HLS_TRACK_WAIT_SECONDS = 30
 
-# Where the HLS server listens. The defaults keep it reachable from another container,
-# as the Home Assistant add-on needs; an installation whose reader is on the same host
-# can narrow the address, and one whose port is already taken can move it.
-DEFAULT_HLS_HOST = "0.0.0.0"
-DEFAULT_HLS_PORT = 8090
-
 # The shape of `expires_at` in a video.webrtc.turn.config message.
 TURN_EXPIRY_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 
@@ -401,7 +396,7 @@ class WebRTCHandler:
                                         device_id,
                                         byte_arr,
                                     )
-                                    publish_snapshot_bytes(*snapshot_args)
+                                    publish_snapshot_bytes(*snapshot_args, live=True)
                                     LOGGER.debug("Published frame to MQTT topic: {}".format(topic))
                                     frame_skip_counter = 0
                                 except (OSError, ValueError, RuntimeError) as e:
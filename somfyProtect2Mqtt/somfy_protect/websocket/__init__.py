@@ -1,33 +1,44 @@
 """Somfy Protect Websocket"""
 
 import asyncio
-import json
+import contextvars
 import logging
-import queue
 import ssl
 import threading
 import time
 import uuid
 
-import websocket
+from business.executor import LANE_ALARM, IoExecutor, StreamThreads
+from business.media import create_webrtc_handler
 from business.mqtt import mqtt_publish, publish_snapshot_bytes
 from constants import (
-    SNAPSHOT_QUEUE_MAXSIZE,
+    DEFAULT_HLS_HOST,
+    DEFAULT_HLS_PORT,
+    MAX_CONCURRENT_STREAMS,
+    PULSE_DURATION,
     WEBSOCKET_IDLE_CLOSE_SECONDS,
     WEBSOCKET_PING_INTERVAL,
     WEBSOCKET_PING_TIMEOUT,
     WEBSOCKET_RECONNECT,
     WEBSOCKET_TIMEOUT,
 )
+from jsoncodec import JSON_CODEC, encode_constant
+from metrics import METRICS
 from mqtt import MQTTClient
 from oauthlib.oauth2 import MissingTokenError
 from somfy_protect.api import SomfyProtectApi
 from somfy_protect.sso import SomfyProtectSso, read_token_from_file
-from somfy_protect.webrtc_handler import DEFAULT_HLS_HOST, DEFAULT_HLS_PORT, WebRTCHandler
+from somfy_protect.websocket.catchup import WEBSOCKET_CATCHUP
+from somfy_protect.websocket.dedupe import DEDUPE_FILENAME, MESSAGE_DEDUPE
+from somfy_protect.websocket.forwarding import EVENT_FORWARDER
 from somfy_protect.websocket.handlers import alarm as alarm_handlers
 from somfy_protect.websocket.handlers import device as device_handlers
 from somfy_protect.websocket.handlers import video as video_handlers
-from websocket import WebSocketApp
+from somfy_protect.websocket.recording import RECORDING_MAX_EVENTS, WebsocketRecorder
+from somfy_protect.websocket.rotation import WebsocketConnections
+from somfy_protect.websocket.transport import AsyncWebsocketTransport
+from tracing import EVENT_TRACE, EventTrace
+from utils import resolve_data_path
 
 WEBSOCKET = "wss://websocket.myfox.io/events/websocket?token="
 WEBSOCKET_SENSITIVE_KEYS = {
@@ -41,6 +52,44 @@ WEBSOCKET_SENSITIVE_KEYS = {
     "video.webrtc.start",
 }
 
+# Acks only differ by their message_id, the rest is encoded once
+ACK_PREFIX = '{"ack":true,"message_id":'
+ACK_SUFFIX = ',"client":"Android"}'
+# Websocket control messages, handled before events
+CONNECTION_READY = "websocket.connection.ready"
+TOKEN_ERROR = "websocket.error.token"
+CONTROL_KEYS = (CONNECTION_READY, TOKEN_ERROR)
+# Event key => SomfyProtectWebsocket method, bound once per connection
+MESSAGE_HANDLERS = {
+    "security.level.change": "_security_level_change",
+    "alarm.trespass": "_alarm_trespass",
+    "alarm.panic": "_alarm_panic",
+    "alarm.domestic.fire": "_alarm_domestic_fire",
+    "alarm.domestic.fire.end": "_alarm_domestic_fire_end",
+    "alarm.end": "_alarm_end",
+    "presence_out": "_update_keyfob_presence",
+    "presence_in": "_update_keyfob_presence",
+    "device.status": "_device_status",
+    "video.stream.ready": "_video_stream_ready",
+    "device.ring_door_bell": "_device_ring_door_bell",
+    "device.missed_call": "_device_missed_call",
+    "video.webrtc.offer": "_video_webrtc_offer",
+    "video.webrtc.start": "_video_webrtc_start",
+    "video.webrtc.session": "_video_webrtc_session",
+    "video.webrtc.answer": "_video_webrtc_answer",
+    "video.webrtc.candidate": "_video_webrtc_candidate",
+    "video.webrtc.turn.config": "_video_webrtc_turn_config",
+    "video.webrtc.keep_alive": "_video_webrtc_keep_alive",
+    "video.webrtc.hang_up": "_video_webrtc_hang_up",
+    "device.gate_triggered_from_mobile": "_device_gate_triggered_from_mobile",
+    "device.gate_triggered_from_monitor": "_device_gate_triggered_from_monitor",
+    "answered_call_from_monitor": "_device_answered_call_from_monitor",
+    "answered_call_from_mobile": "_device_answered_call_from_mobile",
+    "device.doorlock_triggered": "_device_doorlock_triggered",
+}
+
+PULSE_RESETS = {key: encode_constant({key: "False"}) for key in ("motion_sensor", "ringing")}
+
 LOGGER = logging.getLogger(__name__)
 
 
@@ -54,6 +103,7 @@ class SomfyProtectWebsocket:
         mqtt_client: MQTTClient,
         api: SomfyProtectApi,
         debug: bool = False,
+        site_ids: list | None = None,
     ):
         self.mqtt_client = mqtt_client
         self.mqtt_config = config.get("mqtt")
@@ -62,21 +112,27 @@ class SomfyProtectWebsocket:
         self.hls_port = config.get("hls_port", DEFAULT_HLS_PORT)
         self.api = api
         self.sso = sso
+        # IDs of the configured sites, resolved and kept up to date by the main loop
+        self.site_ids = site_ids if site_ids is not None else []
         self.last_message_at = time.time()
-        self._io_queue = queue.Queue(maxsize=SNAPSHOT_QUEUE_MAXSIZE)
-        self._io_worker_stop = threading.Event()
-        self._io_worker = threading.Thread(target=self._io_worker_loop, daemon=True)
-        self._io_worker.start()
-
-        # Initialize WebRTC handler
-        self.webrtc_handler = WebRTCHandler(
-            mqtt_client=mqtt_client,
-            mqtt_config=self.mqtt_config,
-            send_websocket_callback=self.send_websocket_message,
-            streaming_config=self.streaming_config,
-            hls_host=self.hls_host,
-            hls_port=self.hls_port,
+        self._io = IoExecutor(streams=StreamThreads(config.get("max_streams", MAX_CONCURRENT_STREAMS)))
+        dedupe_config = config.get("websocket_dedupe") or {}
+        MESSAGE_DEDUPE.configure(
+            resolve_data_path(config, DEDUPE_FILENAME) if dedupe_config.get("persist", True) else None,
+            window=dedupe_config.get("window"),
+            max_size=dedupe_config.get("max_size"),
         )
+        EVENT_FORWARDER.configure((self.mqtt_config or {}).get("event_forwarding"))
+        record_config = config.get("websocket_record") or {}
+        self._recorder = None
+        if record_config.get("path"):
+            self._recorder = WebsocketRecorder(
+                resolve_data_path(config, record_config["path"]),
+                max_events=record_config.get("max_events", RECORDING_MAX_EVENTS),
+            )
+
+        # WebRTC handler (PyAV, aiortc) is created on the first WebRTC message
+        self._webrtc_handler = None
 
         # Create a dedicated event loop for async operations in a separate thread
         self.loop = asyncio.new_event_loop()
@@ -85,18 +141,46 @@ class SomfyProtectWebsocket:
         self.loop_thread.start()
 
         if debug:
-            websocket.enableTrace(True)
             LOGGER.debug("Opening websocket connection to {}".format(WEBSOCKET))
         self.token = self._load_token()
-        websocket.setdefaulttimeout(WEBSOCKET_TIMEOUT)
-        self._websocket = WebSocketApp(
-            f"{WEBSOCKET}{self.token.get('access_token')}",
+        # Certificates are not verified, as with websocket-client before
+        self._ssl_context = ssl.create_default_context()
+        self._ssl_context.check_hostname = False
+        self._ssl_context.verify_mode = ssl.CERT_NONE
+        self._connections = WebsocketConnections(self._new_transport)
+        self._message_tasks = set()
+        self._handlers = self._build_handlers()
+        self._pulse_resets = {}
+
+    @property
+    def webrtc_handler(self):
+        """WebRTC handler, created on first use"""
+        if self._webrtc_handler is None:
+            self._webrtc_handler = create_webrtc_handler(
+                mqtt_client=self.mqtt_client,
+                mqtt_config=self.mqtt_config,
+                send_websocket_callback=self.send_websocket_message,
+                streaming_config=self.streaming_config,
+                hls_host=self.hls_host,
+                hls_port=self.hls_port,
+            )
+        return self._webrtc_handler
+
+    def _new_transport(self) -> AsyncWebsocketTransport:
+        """Transport whose messages are read and dispatched on the loop of the WebRTC handler"""
+        return AsyncWebsocketTransport(
+            self._websocket_url,
             on_open=self._on_open,
-            on_message=self._on_message_wrapper,
+            on_message=self.on_message,
             on_error=self._on_error,
             on_close=self._on_close,
             on_ping=self._on_ping,
             on_pong=self._on_pong,
+            ping_interval=WEBSOCKET_PING_INTERVAL,
+            ping_timeout=WEBSOCKET_PING_TIMEOUT,
+            reconnect=WEBSOCKET_RECONNECT,
+            open_timeout=WEBSOCKET_TIMEOUT,
+            ssl_context=self._ssl_context,
         )
 
     def _run_event_loop(self):
@@ -104,6 +188,13 @@ class SomfyProtectWebsocket:
         asyncio.set_event_loop(self.loop)
         self.loop.run_forever()
 
+    def _websocket_url(self) -> str:
+        """Websocket URL with the current token, refreshed when it expired"""
+        if self._is_token_expired(self.token):
+            LOGGER.info("Websocket token expired, refreshing")
+            self.token = self._load_token()
+        return f"{WEBSOCKET}{self.token.get('access_token')}"
+
     def _load_token(self) -> dict:
         token = self.sso.get_token() or read_token_from_file(self.sso.token_cache_path)
         if token and token.get("access_token"):
@@ -132,76 +223,71 @@ class SomfyProtectWebsocket:
             return False
         return expires_at <= (time.time() + leeway_seconds)
 
-    def _io_worker_loop(self) -> None:
-        while not self._io_worker_stop.is_set():
-            try:
-                job = self._io_queue.get(timeout=0.5)
-            except queue.Empty:
-                continue
-            if job is None:
-                self._io_queue.task_done()
-                break
-            func, args, kwargs = job
-            try:
-                func(*args, **kwargs)
-            except (OSError, RuntimeError, ValueError) as e:
-                LOGGER.warning("IO task failed: {}".format(e))
-            finally:
-                self._io_queue.task_done()
+    def _run_io_task(self, lane: str, func, *args, **kwargs) -> None:
+        """Run blocking func off the event loop, in one of the LANE_* lanes"""
+        self._io.submit(lane, func, *args, **kwargs)
 
-    def _run_io_task(self, func, *args, **kwargs) -> None:
-        try:
-            self._io_queue.put_nowait((func, args, kwargs))
-        except queue.Full:
-            LOGGER.warning("IO task dropped: queue full")
+    def _run_stream_task(self, device_id: str, func, *args, **kwargs) -> bool:
+        """Run a blocking stream of device on its own thread, unless too many already run
 
-    def _on_message_wrapper(self, _ws_app, message):
-        """Wrapper to handle async on_message in sync context"""
-        try:
-            # Schedule coroutine on the persistent event loop
-            future = asyncio.run_coroutine_threadsafe(self.on_message(_ws_app, message), self.loop)
-            future.add_done_callback(self._log_message_processing_error)
-        except (RuntimeError, ValueError) as e:
-            LOGGER.error("Error in message wrapper: {}".format(e))
+        Returns:
+            bool: False when the stream was refused.
+        """
+        return self._io.streams.start(device_id, func, *args, **kwargs)
 
-    @staticmethod
-    def _log_message_processing_error(future):
+    def _log_message_processing_error(self, task):
+        self._message_tasks.discard(task)
+        if task.cancelled():
+            return
         try:
-            future.result()
+            task.result()
         except (RuntimeError, ValueError) as e:
             LOGGER.error("Error while processing websocket message: {}".format(e))
 
     def run_forever(self):
-        """Run Forever Loop"""
+        """Run Forever Loop, until the websocket is closed"""
         LOGGER.info("Running Forever")
-        self._websocket.run_forever(
-            # dispatcher=rel,
-            ping_timeout=WEBSOCKET_PING_TIMEOUT,
-            ping_interval=WEBSOCKET_PING_INTERVAL,
-            reconnect=WEBSOCKET_RECONNECT,
-            sslopt={"cert_reqs": ssl.CERT_NONE},
-        )
+        self._connections.run_forever(self.loop)
+
+    def _rotate(self, reason: str) -> None:
+        """Open a new connection, the current one is closed once the new one is open"""
+        if self._connections.rotate():
+            LOGGER.info("Opening a new websocket connection: {}".format(reason))
+
+    def _switch_over(self) -> bool:
+        """Make the standby connection the active one and close the previous one.
+
+        Returns:
+            bool: Whether the previous connection was already down, events may have been missed.
+        """
+        previous = self._connections.switch_over()
+        self.last_message_at = time.time()
+        METRICS.incr("websocket_rotations")
+        LOGGER.info("Switched over to the new websocket connection")
+        # Events received on both connections meanwhile are handled once, by message_id
+        was_down = not previous.connected
+        previous.close()
+        return was_down
 
     def close(self):
         """Close Websocket Connection"""
         LOGGER.info("WebSocket Close")
 
-        self._io_worker_stop.set()
-        try:
-            self._io_queue.put_nowait(None)
-        except queue.Full:
-            pass
+        self._io.stop()
+        self._call_on_loop(self._flush_pulse_resets)
+        MESSAGE_DEDUPE.save()
+        if self._recorder is not None:
+            self._recorder.close()
 
-        # Close websocket connection
-        if self._websocket:
-            self._websocket.close()
+        # Close websocket connections, run_forever returns once they are closed
+        self._connections.close()
 
         # Cleanup WebRTC resources
-        if hasattr(self, "webrtc_handler") and self.webrtc_handler:
+        if getattr(self, "_webrtc_handler", None):
             try:
                 # Schedule cleanup on the event loop
                 if hasattr(self, "loop") and self.loop and self.loop.is_running():
-                    cleanup_future = asyncio.run_coroutine_threadsafe(self.webrtc_handler.cleanup(), self.loop)
+                    cleanup_future = asyncio.run_coroutine_threadsafe(self._webrtc_handler.cleanup(), self.loop)
                     cleanup_future.result(timeout=2)
             except (RuntimeError, ValueError) as e:
                 LOGGER.error("Error cleaning up WebRTC handler: {}".format(e))
@@ -248,94 +334,133 @@ class SomfyProtectWebsocket:
         LOGGER.debug("Pong Message: {}".format(message))
         idle_for = time.time() - self.last_message_at
         if idle_for > WEBSOCKET_IDLE_CLOSE_SECONDS:
-            LOGGER.info("Closing websocket after {:.1f}s without messages".format(idle_for))
-            self.close()
-
-    async def on_message(self, _ws_app, message):
-        """Handle New message received on WebSocket"""
-        self.last_message_at = time.time()
-        if "websocket.connection.ready" in message:
+            self._rotate("no message for {:.1f}s".format(idle_for))
+
+    def _build_handlers(self) -> dict:
+        """Bind MESSAGE_HANDLERS to this instance, noting the coroutines"""
+        handlers = {}
+        for key, name in MESSAGE_HANDLERS.items():
+            handler = getattr(self, name)
+            handlers[key] = (handler, asyncio.iscoroutinefunction(handler))
+        return handlers
+
+    def _control_message(self, key: str | None, message: str) -> bool:
+        """Handle websocket control messages, return True when message was one"""
+        if key is None:
+            # Not a JSON event with a key: fall back to looking into the raw text
+            key = next((control for control in CONTROL_KEYS if control in message), None)
+        if key == CONNECTION_READY:
             LOGGER.info("Websocket Connection is READY")
-            return
-
-        if "websocket.error.token" in message:
+            return True
+        if key == TOKEN_ERROR:
             LOGGER.warning("Websocket token error, refreshing and reconnecting")
-            try:
-                self.token = self.sso.refresh_tokens()
-            except (MissingTokenError, OSError, RuntimeError, ValueError) as e:
-                LOGGER.error("Unable to refresh websocket token: {}".format(e))
-            self._websocket.close()
-            return
+            # An HTTP call to the SSO, kept off the event loop
+            self.loop.run_in_executor(None, self._refresh_token_and_rotate)
+            return True
+        return False
 
-        logging.debug("Message: {}".format(message))
+    def _refresh_token_and_rotate(self) -> None:
+        try:
+            self.token = self.sso.refresh_tokens()
+        except (MissingTokenError, OSError, RuntimeError, ValueError) as e:
+            LOGGER.error("Unable to refresh websocket token: {}".format(e))
+        # Connect with the new token before dropping the current connection
+        self._call_on_loop(self._rotate, "token refreshed")
+
+    async def on_message(self, ws_app, message):
+        """Handle New message received on WebSocket"""
+        received_at = time.monotonic()
+        self.last_message_at = time.time()
+        if self._recorder is not None:
+            self._recorder.record(message)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("Message: {}".format(message))
 
         try:
-            message_json = json.loads(message)
-        except json.JSONDecodeError:
-            LOGGER.warning("Received non-JSON websocket message")
-            return
+            message_json = JSON_CODEC.loads(message)
+        except ValueError:
+            message_json = None
         if not isinstance(message_json, dict):
-            LOGGER.warning("Unexpected websocket payload type")
+            if not self._control_message(None, message):
+                LOGGER.warning("Received non-JSON websocket message")
+            return
+        message_key = message_json.get("key")
+        if message_key in CONTROL_KEYS:
+            self._control_message(message_key, message)
             return
         message_id = message_json.get("message_id")
         if not message_id:
-            LOGGER.warning("Websocket message missing message_id")
+            # Control messages are not events, and may not follow their format
+            if not self._control_message(None, message):
+                LOGGER.warning("Websocket message missing message_id")
             return
-        callbacks = {
-            "security.level.change": self._security_level_change,
-            "alarm.trespass": self._alarm_trespass,
-            "alarm.panic": self._alarm_panic,
-            "alarm.domestic.fire": self._alarm_domestic_fire,
-            "alarm.domestic.fire.end": self._alarm_domestic_fire_end,
-            "alarm.end": self._alarm_end,
-            "presence_out": self._update_keyfob_presence,
-            "presence_in": self._update_keyfob_presence,
-            "device.status": self._device_status,
-            "video.stream.ready": self._video_stream_ready,
-            "device.ring_door_bell": self._device_ring_door_bell,
-            "device.missed_call": self._device_missed_call,
-            "video.webrtc.offer": self._video_webrtc_offer,
-            "video.webrtc.start": self._video_webrtc_start,
-            "video.webrtc.session": self._video_webrtc_session,
-            "video.webrtc.answer": self._video_webrtc_answer,
-            "video.webrtc.candidate": self._video_webrtc_candidate,
-            "video.webrtc.turn.config": self._video_webrtc_turn_config,
-            "video.webrtc.keep_alive": self._video_webrtc_keep_alive,
-            "video.webrtc.hang_up": self._video_webrtc_hang_up,
-            "device.gate_triggered_from_mobile": self._device_gate_triggered_from_mobile,
-            "device.gate_triggered_from_monitor": self._device_gate_triggered_from_monitor,
-            "answered_call_from_monitor": self._device_answered_call_from_monitor,
-            "answered_call_from_mobile": self._device_answered_call_from_mobile,
-            "device.doorlock_triggered": self._device_doorlock_triggered,
-        }
 
-        ack = {
-            "ack": True,
-            "message_id": message_id,
-            "client": "Android",
-        }
-        self.send_websocket_message(ack)
-        self._default_message(message_json)
-        message_key = message_json.get("key")
+        # Acked on the connection it came from, both are open during a switch-over
+        self.send_websocket_message(ACK_PREFIX + JSON_CODEC.dumps_str(message_id) + ACK_SUFFIX, websocket=ws_app)
+        # Redelivered after a reconnection: acked again, handled once
+        if MESSAGE_DEDUPE.seen(message_id):
+            LOGGER.info("Ignoring duplicate websocket message {} ({})".format(message_id, message_key))
+            return
+        WEBSOCKET_CATCHUP.record_event(self.last_message_at)
         if not message_key:
+            self._default_message(message_json)
             LOGGER.debug("Websocket message missing key")
             return
-        if message_key in callbacks:
-            callback = callbacks[message_key]
-            if asyncio.iscoroutinefunction(callback):
-                await callback(message_json)
+        # Publishes of the event, here or in the tasks it starts, are traced up to the broker ack
+        trace = EventTrace(message_key, received_at, message_json.get("occurred_at"))
+        trace_token = EVENT_TRACE.set(trace)
+        try:
+            self._default_message(message_json)
+            handler = self._handlers.get(message_key)
+            if handler is None:
+                if LOGGER.isEnabledFor(logging.DEBUG):
+                    LOGGER.debug("Unknown message: {}".format(message))
+                return
+            callback, is_coroutine = handler
+            started_at = time.monotonic()
+            trace.observe("dispatch", started_at)
+            if is_coroutine:
+                # WebRTC negotiation waits for ICE, events keep flowing meanwhile
+                task = self.loop.create_task(self._run_handler(callback, message_json, started_at))
+                self._message_tasks.add(task)
+                task.add_done_callback(self._log_message_processing_error)
             else:
                 callback(message_json)
-        else:
-            LOGGER.debug("Unknown message: {}".format(message))
+                METRICS.histogram("event_handler", message_key, time.monotonic() - started_at)
+        finally:
+            EVENT_TRACE.reset(trace_token)
+
+    @staticmethod
+    async def _run_handler(callback, message_json: dict, started_at: float) -> None:
+        """Await a coroutine handler, recording its run time"""
+        try:
+            await callback(message_json)
+        finally:
+            METRICS.histogram("event_handler", message_json["key"], time.monotonic() - started_at)
 
     def _on_error(self, _ws_app, error):
         """Handle Websocket Errors"""
         LOGGER.error("Error in the websocket connection: {}".format(error))
 
-    def _on_open(self, _ws_app):
+    def _on_open(self, ws_app):
         """Handle Websocket Open Connection"""
         LOGGER.info("Opened connection")
+        if ws_app is not None and ws_app is self._connections.standby and not self._switch_over():
+            # The previous connection delivered events until now
+            return
+        since = WEBSOCKET_CATCHUP.connected()
+        if since is not None:
+            # Events sent while disconnected are not delivered again
+            self._run_io_task(
+                LANE_ALARM,
+                WEBSOCKET_CATCHUP.run,
+                self.api,
+                self.mqtt_client,
+                self.mqtt_config,
+                self.site_ids,
+                since,
+                time.monotonic(),
+            )
 
     def _on_close(self, _ws_app, close_status_code, close_msg):
         """Handle Websocket Close Connection"""
@@ -421,27 +546,60 @@ class SomfyProtectWebsocket:
         """Someone is ringing at the door."""
         device_handlers.device_ring_door_bell(self, message)
 
-    def _publish_false_after_delay(self, topic: str, key: str, delay_seconds: int = 3) -> None:
-        """Publish a false payload after a delay without blocking websocket handling."""
-        time.sleep(delay_seconds)
+    def _pulse_reset(self, topic: str, key: str, delay: float = PULSE_DURATION) -> None:
+        """Publish the false payload of a pulse after delay, from any thread.
+
+        A new pulse on the same topic re-arms the timer: repeated triggers extend the pulse.
+        """
+        self._call_on_loop(self._arm_pulse_reset, topic, key, delay)
+
+    def _arm_pulse_reset(self, topic: str, key: str, delay: float) -> None:
+        pending = self._pulse_resets.pop(topic, None)
+        if pending is not None:
+            pending[0].cancel()
+            METRICS.incr("pulse_resets_rearmed")
+        # Out of the event context: the reset is not part of the event latency
+        handle = self.loop.call_later(delay, self._publish_pulse_reset, topic, key, context=contextvars.Context())
+        self._pulse_resets[topic] = (handle, key)
+
+    def _publish_pulse_reset(self, topic: str, key: str) -> None:
+        self._pulse_resets.pop(topic, None)
         mqtt_publish(
             mqtt_client=self.mqtt_client,
             topic=topic,
-            payload={key: "False"},
+            payload=PULSE_RESETS.get(key) or {key: "False"},
             retain=True,
         )
 
+    def _flush_pulse_resets(self) -> None:
+        """Publish the pending pulse resets now, so that no pulse stays on after closing"""
+        for topic, (handle, key) in list(self._pulse_resets.items()):
+            handle.cancel()
+            self._publish_pulse_reset(topic, key)
+
+    def _call_on_loop(self, func, *args) -> None:
+        """Call func on the event loop thread, right away when already there"""
+        if threading.current_thread() is self.loop_thread or not self.loop.is_running():
+            if not self.loop.is_closed():
+                func(*args)
+            return
+        try:
+            self.loop.call_soon_threadsafe(func, *args)
+        except RuntimeError as e:
+            LOGGER.warning("Event loop closed, {} skipped: {}".format(func.__name__, e))
+
     def _device_missed_call(self, message):
         """Call missed."""
         device_handlers.device_missed_call(self, message)
 
-    def _publish_snapshot_bytes(self, site_id: str, device_id: str, byte_arr: bytearray) -> None:
+    def _publish_snapshot_bytes(self, site_id: str, device_id: str, byte_arr: bytearray, live: bool = False) -> None:
         payload = {
             "mqtt_client": self.mqtt_client,
             "mqtt_config": self.mqtt_config,
             "site_id": site_id,
             "device_id": device_id,
             "byte_arr": byte_arr,
+            "live": live,
         }
         publish_snapshot_bytes(**payload)
 
@@ -686,7 +844,8 @@ class SomfyProtectWebsocket:
 
     def _default_message(self, message):
         """Default Message"""
-        LOGGER.info("[default] Read Message {}".format(message))
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("[default] Read Message {}".format(message))
         mqtt_config = self.mqtt_config or {}
         topic_suffix = message.get("key")
         if not topic_suffix:
@@ -703,11 +862,15 @@ class SomfyProtectWebsocket:
             topic = f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{topic_suffix}"
         else:
             topic = f"{mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device_id}/{topic_suffix}"
+        forwarded = EVENT_FORWARDER.apply(topic_suffix, topic, message)
+        if forwarded is None:
+            return
+        payload, retain = forwarded
         mqtt_publish(
             mqtt_client=self.mqtt_client,
             topic=topic,
-            payload=message,
-            retain=True,
+            payload=payload,
+            retain=retain,
         )
 
     def remote_unassigned(self, message):
@@ -874,10 +1037,11 @@ class SomfyProtectWebsocket:
         # "message_id":"XX"
         # }
 
-    def send_websocket_message(self, message: dict):
-        """Send a message via the WebSocket connection"""
-        if self._websocket and self._websocket.sock and self._websocket.sock.connected:
-            self._websocket.send(json.dumps(message))
-            LOGGER.debug("Sent on Websocket: {}".format(message))
+    def send_websocket_message(self, message: dict | str, websocket: AsyncWebsocketTransport | None = None):
+        """Send a message (or an already encoded one) via the WebSocket connection"""
+        websocket = websocket or self._connections.active
+        if websocket and websocket.send(message if isinstance(message, str) else JSON_CODEC.dumps_str(message)):
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                LOGGER.debug("Sent on Websocket: {}".format(message))
         else:
             LOGGER.warning("WebSocket is not connected. Unable to send message: {}".format(message))
@@ -0,0 +1,97 @@
+"""Catch-up of the events missed while the websocket was disconnected
+
+Events sent while the websocket is down are not delivered once it is back. The
+time of the last event handled is kept across reconnections, and across the
+websocket restarts done by the main loop, so that each new connection fetches
+the site state, history and devices status from the REST API and publishes
+the transitions which were missed meanwhile.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from business import catch_up_sites
+from metrics import METRICS
+from mqtt import MQTTClient
+from somfy_protect.api import SomfyProtectApi
+
+LOGGER = logging.getLogger(__name__)
+
+
+class WebsocketCatchUp:
+    """Time of the last websocket event, and catch-up after a reconnection.
+
+    Args:
+        clock (callable): Wall clock, compared with the history occurred_at.
+    """
+
+    def __init__(self, clock=time.time):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.last_event_at: Optional[float] = None
+
+    def record_event(self, at: Optional[float] = None) -> None:
+        """Remember that an event was handled.
+
+        Args:
+            at (float | None): Time the event was received, now when None.
+        """
+        self.last_event_at = self._clock() if at is None else at
+
+    def connected(self) -> Optional[float]:
+        """Note a new connection.
+
+        Returns:
+            float | None: Time since when events may have been missed, None on
+                the first connection, which the startup refresh covers.
+        """
+        with self._lock:
+            since = self.last_event_at
+            if since is None:
+                self.last_event_at = self._clock()
+            return since
+
+    def run(
+        self,
+        api: SomfyProtectApi,
+        mqtt_client: MQTTClient,
+        mqtt_config: dict,
+        site_ids: list,
+        since: float,
+        opened_at: float,
+    ) -> int:
+        """Publish what was missed on the configured sites since a time.
+
+        Args:
+            api (SomfyProtectApi): Somfy Protect API.
+            mqtt_client (MQTTClient): MQTT client.
+            mqtt_config (dict): MQTT configuration.
+            site_ids (list): IDs of the configured sites, as resolved by the main loop.
+            since (float): Time of the last event handled.
+            opened_at (float): time.monotonic() of the connection, for the latency.
+
+        Returns:
+            int: History events which occurred since then.
+        """
+        site_ids = list(site_ids)
+        if not site_ids:
+            LOGGER.info("No known site to catch up")
+            return 0
+        since_date = datetime.fromtimestamp(since, timezone.utc).replace(tzinfo=None)
+        missed = catch_up_sites(api, mqtt_client, mqtt_config, site_ids, since_date)
+        latency = time.monotonic() - opened_at
+        METRICS.observe("websocket_catchup", latency)
+        METRICS.incr("websocket_catchup_events", missed)
+        METRICS.set_gauge("websocket_catchup_gap_seconds", round(self._clock() - since, 3))
+        LOGGER.info(
+            "Caught up {} site(s) in {:.0f} ms, {} event(s) since {}".format(
+                len(site_ids), latency * 1000, missed, since_date.isoformat()
+            )
+        )
+        return missed
+
+
+WEBSOCKET_CATCHUP = WebsocketCatchUp()
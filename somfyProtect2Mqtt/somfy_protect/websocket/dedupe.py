@@ -0,0 +1,111 @@
+"""Websocket message_ids already handled
+
+Somfy may deliver an event again after a reconnection, when its ack was lost.
+The message_ids handled recently are remembered, within a time window and a
+maximum count, so that a redelivered event does not trigger the alarm
+publishes, snapshot downloads or pulses a second time. They can be kept on
+disk across restarts.
+"""
+
+import collections
+import logging
+import time
+from typing import Optional
+
+from metrics import METRICS
+from utils.persisted import PersistedJsonStore
+
+LOGGER = logging.getLogger(__name__)
+
+DEDUPE_FILENAME = "websocket_message_ids.json"
+DEDUPE_VERSION = 1
+DEDUPE_WINDOW = 3600
+DEDUPE_MAX_SIZE = 2048
+
+
+class MessageDedupe(PersistedJsonStore):
+    """Bounded set of recent message_ids, oldest forgotten first.
+
+    Args:
+        window (float): Seconds a message_id is remembered.
+        max_size (int): Maximum message_ids remembered.
+        clock (callable): Wall clock, persisted times must survive a restart.
+    """
+
+    VERSION = DEDUPE_VERSION
+    DESCRIPTION = "websocket message_ids"
+
+    def __init__(self, window: float = DEDUPE_WINDOW, max_size: int = DEDUPE_MAX_SIZE, clock=time.time):
+        super().__init__()
+        self._clock = clock
+        self._seen: collections.OrderedDict[str, float] = collections.OrderedDict()
+        self.window = window
+        self.max_size = max_size
+
+    def configure(
+        self, path: Optional[str] = None, window: Optional[float] = None, max_size: Optional[int] = None
+    ) -> None:
+        """Set the limits and the store file, loading it.
+
+        Args:
+            path (str | None): Store file, None keeps message_ids in memory only.
+            window (float | None): Seconds a message_id is remembered, unchanged when None.
+            max_size (int | None): Maximum message_ids remembered, unchanged when None.
+        """
+        with self._lock:
+            if window is not None:
+                self.window = float(window)
+            if max_size is not None:
+                self.max_size = max(1, int(max_size))
+            self._evict()
+        super().configure(path)
+
+    def seen(self, message_id: str) -> bool:
+        """Return True when message_id was already handled, remember it otherwise.
+
+        Args:
+            message_id (str): Websocket message_id.
+
+        Returns:
+            bool: Whether the message is a duplicate.
+        """
+        with self._lock:
+            self._evict()
+            if message_id in self._seen:
+                METRICS.incr("websocket_messages_duplicate")
+                return True
+            self._seen[message_id] = self._clock()
+            self._dirty = True
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._seen)
+
+    def _dump(self) -> dict:
+        return {"ids": dict(self._seen)}
+
+    def _restore(self, content: dict) -> None:
+        ids = content.get("ids") or {}
+        loaded = sorted((float(seen_at), str(message_id)) for message_id, seen_at in ids.items())
+        # Kept with the message_ids handled before the file was loaded
+        for seen_at, message_id in loaded:
+            self._seen.setdefault(message_id, seen_at)
+        self._evict()
+
+    def _summary(self) -> str:
+        return "{} websocket message_id(s)".format(len(self._seen))
+
+    def _evict(self) -> None:
+        expired_before = self._clock() - self.window
+        while self._seen:
+            message_id, seen_at = next(iter(self._seen.items()))
+            if seen_at >= expired_before and len(self._seen) <= self.max_size:
+                break
+            del self._seen[message_id]
+            self._dirty = True
+
+
+MESSAGE_DEDUPE = MessageDedupe()
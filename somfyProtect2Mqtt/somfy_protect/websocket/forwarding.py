@@ -0,0 +1,153 @@
+"""Rules for the raw websocket events republished to MQTT
+
+Besides the publishes of its handler, every websocket event is republished
+as is, retained, on ``<topic_prefix>/<site_id>/<device_id>/<key>``. Rules,
+matched on the event key with shell-style patterns (``alarm.*``), the first
+matching one winning, change that:
+
+- ``forward``: false to not republish the event,
+- ``fields``: only republish these fields, ``exclude``: republish all but these,
+  nested fields being named with dots (``diagnosis.is_everything_ok``),
+- ``retain``: false to republish the event as a transient message,
+- ``min_interval``: seconds before an event is republished again on the same topic.
+
+Events matching no rule are republished as before.
+"""
+
+import fnmatch
+import logging
+import threading
+import time
+from typing import Optional
+
+from metrics import METRICS
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _as_fields(value) -> Optional[tuple]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = [value]
+    return tuple(str(field).split(".") for field in value)
+
+
+def _project(message: dict, fields: tuple) -> dict:
+    projected: dict = {}
+    for path in fields:
+        source, target = message, projected
+        for name in path[:-1]:
+            source = source.get(name)
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(name, {})
+        else:
+            if path[-1] in source:
+                target[path[-1]] = source[path[-1]]
+    return projected
+
+
+def _exclude(message: dict, fields: tuple) -> dict:
+    excluded = dict(message)
+    for path in fields:
+        target = excluded
+        for name in path[:-1]:
+            if not isinstance(target.get(name), dict):
+                break
+            target[name] = dict(target[name])
+            target = target[name]
+        else:
+            target.pop(path[-1], None)
+    return excluded
+
+
+class EventForwarder:
+    """Decide how each raw websocket event is republished.
+
+    Args:
+        rules (list | None): Rules, in matching order.
+        clock (callable): Monotonic clock, for the minimum intervals.
+    """
+
+    def __init__(self, rules: Optional[list] = None, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._rules: list[dict] = []
+        # Event key => matching rule, patterns are only matched once per key
+        self._matches: dict[str, Optional[dict]] = {}
+        self._published_at: dict[str, float] = {}
+        self.configure(rules)
+
+    def configure(self, rules: Optional[list]) -> None:
+        """Replace the rules.
+
+        Args:
+            rules (list | None): Rules, in matching order.
+        """
+        parsed = []
+        for rule in rules or []:
+            if not isinstance(rule, dict) or not rule.get("match"):
+                LOGGER.warning("Ignoring event forwarding rule {}: expected a mapping with a match".format(rule))
+                continue
+            try:
+                min_interval = float(rule.get("min_interval") or 0)
+            except (TypeError, ValueError):
+                LOGGER.warning("Ignoring event forwarding rule {}: invalid min_interval".format(rule["match"]))
+                continue
+            parsed.append(
+                {
+                    "match": str(rule["match"]),
+                    "forward": bool(rule.get("forward", True)),
+                    "fields": _as_fields(rule.get("fields")),
+                    "exclude": _as_fields(rule.get("exclude")),
+                    "retain": bool(rule.get("retain", True)),
+                    "min_interval": min_interval,
+                }
+            )
+        with self._lock:
+            self._rules = parsed
+            self._matches.clear()
+            self._published_at.clear()
+        if parsed:
+            LOGGER.info("Event forwarding rules for: {}".format(", ".join(rule["match"] for rule in parsed)))
+
+    def apply(self, key: str, topic: str, message: dict) -> Optional[tuple[dict, bool]]:
+        """Return how to republish an event.
+
+        Args:
+            key (str): Event key.
+            topic (str): Topic the event is republished on.
+            message (dict): Event.
+
+        Returns:
+            tuple | None: Payload and retain flag, None when the event is not republished.
+        """
+        if not self._rules:
+            return message, True
+        with self._lock:
+            rule = self._matches.get(key, False)
+            if rule is False:
+                rule = self._matches[key] = next(
+                    (rule for rule in self._rules if fnmatch.fnmatchcase(key, rule["match"])), None
+                )
+            if rule is None:
+                return message, True
+            if not rule["forward"]:
+                METRICS.incr("websocket_events_forward_denied")
+                return None
+            if rule["min_interval"]:
+                now = self._clock()
+                published_at = self._published_at.get(topic)
+                if published_at is not None and now - published_at < rule["min_interval"]:
+                    METRICS.incr("websocket_events_forward_rate_limited")
+                    return None
+                self._published_at[topic] = now
+        if rule["fields"] is not None:
+            message = _project(message, rule["fields"])
+        if rule["exclude"] is not None:
+            message = _exclude(message, rule["exclude"])
+        return message, rule["retain"]
+
+
+EVENT_FORWARDER = EventForwarder()
@@ -5,10 +5,15 @@
 import logging
 
 from business.mqtt import mqtt_publish, update_site
+from constants import PUBLISH_PRIORITY_ALARM
 from homeassistant.ha_discovery import ALARM_STATUS
+from jsoncodec import encode_constant
 from somfy_protect.websocket.handlers.device import pulse_motion_sensor
 
 LOGGER = logging.getLogger(__name__)
+SITE_TRIGGERED = encode_constant({"security_level": "triggered"})
+SMOKE_DETECTED = encode_constant({"smoke": "True"})
+SMOKE_CLEARED = encode_constant({"smoke": "False"})
 
 
 def security_level_change(websocket_client, message: dict) -> None:
@@ -21,7 +26,14 @@ def security_level_change(websocket_client, message: dict) -> None:
     security_level = message.get("security_level")
     payload = {"security_level": ALARM_STATUS.get(str(security_level), "disarmed")}
     topic = f"{websocket_client.mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/state"
-    mqtt_publish(mqtt_client=websocket_client.mqtt_client, topic=topic, payload=payload, retain=True)
+    mqtt_publish(
+        mqtt_client=websocket_client.mqtt_client,
+        topic=topic,
+        payload=payload,
+        retain=True,
+        priority=PUBLISH_PRIORITY_ALARM,
+        event_time=message.get("occurred_at"),
+    )
 
 
 def alarm_trespass(websocket_client, message: dict) -> None:
@@ -40,12 +52,14 @@ def alarm_trespass(websocket_client, message: dict) -> None:
     mqtt_publish(
         mqtt_client=websocket_client.mqtt_client,
         topic=f"{topic_prefix}/{site_id}/state",
-        payload={"security_level": "triggered"},
+        payload=SITE_TRIGGERED,
         retain=True,
+        priority=PUBLISH_PRIORITY_ALARM,
+        event_time=message.get("occurred_at"),
     )
 
     if device_type == "pir" and device_id:
-        pulse_motion_sensor(websocket_client, site_id, device_id)
+        pulse_motion_sensor(websocket_client, site_id, device_id, event_time=message.get("occurred_at"))
 
 
 def alarm_panic(websocket_client, message: dict) -> None:
@@ -59,8 +73,10 @@ def alarm_panic(websocket_client, message: dict) -> None:
     mqtt_publish(
         mqtt_client=websocket_client.mqtt_client,
         topic=topic,
-        payload={"security_level": "triggered"},
+        payload=SITE_TRIGGERED,
         retain=True,
+        priority=PUBLISH_PRIORITY_ALARM,
+        event_time=message.get("occurred_at"),
     )
 
 
@@ -74,8 +90,10 @@ def alarm_domestic_fire(websocket_client, message: dict) -> None:
         mqtt_publish(
             mqtt_client=websocket_client.mqtt_client,
             topic=topic,
-            payload={"smoke": "True"},
+            payload=SMOKE_DETECTED,
             retain=True,
+            priority=PUBLISH_PRIORITY_ALARM,
+            event_time=message.get("occurred_at"),
         )
 
 
@@ -89,8 +107,10 @@ def alarm_domestic_fire_end(websocket_client, message: dict) -> None:
         mqtt_publish(
             mqtt_client=websocket_client.mqtt_client,
             topic=topic,
-            payload={"smoke": "False"},
+            payload=SMOKE_CLEARED,
             retain=True,
+            priority=PUBLISH_PRIORITY_ALARM,
+            event_time=message.get("occurred_at"),
         )
 
 
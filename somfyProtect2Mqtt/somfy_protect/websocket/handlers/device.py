@@ -1,25 +1,33 @@
 """Device websocket handlers."""
 
-# pylint: disable=protected-access
+# pylint: disable=protected-access,duplicate-code
 
 import logging
 
 from business import build_media_dedupe_key, update_visiophone_snapshot, write_to_media_folder
+from business.executor import LANE_CLIP, LANE_SNAPSHOT
 from business.mqtt import mqtt_publish
+from constants import PUBLISH_PRIORITY_ALARM, PULSE_EXPIRY
+from jsoncodec import encode_constant
 
 LOGGER = logging.getLogger(__name__)
+MOTION_DETECTED = encode_constant({"motion_sensor": "True"})
+RINGING = encode_constant({"ringing": "True"})
 
 
-def pulse_motion_sensor(websocket_client, site_id: str, device_id: str) -> None:
+def pulse_motion_sensor(websocket_client, site_id: str, device_id: str, event_time=None) -> None:
     """Publish a motion pulse for PIR topics."""
     topic = f"{websocket_client.mqtt_config.get('topic_prefix', 'somfyProtect2mqtt')}/{site_id}/{device_id}/pir"
     mqtt_publish(
         mqtt_client=websocket_client.mqtt_client,
         topic=topic,
-        payload={"motion_sensor": "True"},
+        payload=MOTION_DETECTED,
         retain=True,
+        priority=PUBLISH_PRIORITY_ALARM,
+        expiry=PULSE_EXPIRY,
+        event_time=event_time,
     )
-    websocket_client._run_io_task(websocket_client._publish_false_after_delay, topic, "motion_sensor")
+    websocket_client._pulse_reset(topic, "motion_sensor")
 
 
 def device_ring_door_bell(websocket_client, message: dict) -> None:
@@ -36,10 +44,13 @@ def device_ring_door_bell(websocket_client, message: dict) -> None:
     mqtt_publish(
         mqtt_client=websocket_client.mqtt_client,
         topic=topic,
-        payload={"ringing": "True"},
+        payload=RINGING,
         retain=True,
+        priority=PUBLISH_PRIORITY_ALARM,
+        expiry=PULSE_EXPIRY,
+        event_time=message.get("occurred_at"),
     )
-    websocket_client._run_io_task(websocket_client._publish_false_after_delay, topic, "ringing")
+    websocket_client._pulse_reset(topic, "ringing")
 
     snapshot_url = message.get("snapshot_url")
     if snapshot_url:
@@ -52,6 +63,7 @@ def device_ring_door_bell(websocket_client, message: dict) -> None:
             occurred_at=message.get("occurred_at"),
         )
         websocket_client._run_io_task(
+            LANE_SNAPSHOT,
             update_visiophone_snapshot,
             url=snapshot_url,
             site_id=site_id,
@@ -86,6 +98,7 @@ def device_missed_call(websocket_client, message: dict) -> None:
             occurred_at=occurred_at,
         )
         websocket_client._run_io_task(
+            LANE_SNAPSHOT,
             update_visiophone_snapshot,
             url=snapshot_url,
             site_id=site_id,
@@ -105,6 +118,7 @@ def device_missed_call(websocket_client, message: dict) -> None:
             occurred_at=occurred_at,
         )
         websocket_client._run_io_task(
+            LANE_CLIP,
             write_to_media_folder,
             url=clip_url,
             site_id=site_id,
@@ -135,6 +149,7 @@ def device_doorlock_triggered(websocket_client, message: dict) -> None:
             topic=topic,
             payload={"door_lock_state": door_lock_status},
             retain=True,
+            event_time=message.get("occurred_at"),
         )
 
 
@@ -157,6 +172,7 @@ def update_keyfob_presence(websocket_client, message: dict) -> None:
         topic=topic,
         payload=payload,
         retain=True,
+        event_time=message.get("occurred_at"),
     )
 
 
@@ -5,11 +5,16 @@
 import logging
 import os
 
+from business.media import open_video_camera
 from business.mqtt import mqtt_publish
-from business.streaming.camera import VideoCamera
 
 LOGGER = logging.getLogger(__name__)
 
+# Status published on <topic_prefix>/<site_id>/<device_id>/stream/state
+STREAM_STREAMING = "streaming"
+STREAM_IDLE = "idle"
+STREAM_REFUSED = "refused"
+
 
 def video_stream_ready(websocket_client, message: dict) -> None:
     """Handle video stream ready events."""
@@ -36,18 +41,40 @@ def video_stream_ready(websocket_client, message: dict) -> None:
             LOGGER.warning(f"Unable to create directory {directory}: {e}")
 
     if websocket_client.streaming_config == "mqtt":
-        websocket_client._run_io_task(stream_video_to_mqtt, websocket_client, site_id, device_id, stream_url)
+        if websocket_client._io.streams.is_running(device_id):
+            LOGGER.info(f"Already streaming {device_id} to MQTT")
+            return
+        if not websocket_client._run_stream_task(
+            device_id, stream_video_to_mqtt, websocket_client, site_id, device_id, stream_url
+        ):
+            # Let Home Assistant know why no frame comes
+            publish_stream_status(websocket_client, site_id, device_id, STREAM_REFUSED)
+
+
+def publish_stream_status(websocket_client, site_id: str, device_id: str, status: str) -> None:
+    """Publish whether the camera frames are streamed to MQTT."""
+    prefix = websocket_client.mqtt_config.get("topic_prefix", "somfyProtect2mqtt")
+    mqtt_publish(
+        mqtt_client=websocket_client.mqtt_client,
+        topic=f"{prefix}/{site_id}/{device_id}/stream/state",
+        payload={"status": status},
+        retain=True,
+    )
 
 
 def stream_video_to_mqtt(websocket_client, site_id: str, device_id: str, stream_url: str) -> None:
     """Stream camera frames and publish snapshots to MQTT."""
-    camera = VideoCamera(url=stream_url)
-    frame = None
+    publish_stream_status(websocket_client, site_id, device_id, STREAM_STREAMING)
     try:
-        while camera.is_opened():
-            frame = camera.get_frame()
-            if frame is None:
-                break
-            websocket_client._publish_snapshot_bytes(site_id, device_id, bytearray(frame))
+        camera = open_video_camera(stream_url)
+        frame = None
+        try:
+            while camera.is_opened():
+                frame = camera.get_frame()
+                if frame is None:
+                    break
+                websocket_client._publish_snapshot_bytes(site_id, device_id, bytearray(frame), live=True)
+        finally:
+            camera.release()
     finally:
-        camera.release()
+        publish_stream_status(websocket_client, site_id, device_id, STREAM_IDLE)
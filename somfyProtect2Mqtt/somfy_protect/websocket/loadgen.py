@@ -0,0 +1,298 @@
+"""Websocket event load generator
+
+Feed SomfyProtectWebsocket.on_message, offline, with a recording made with
+``websocket_record`` or a synthetic storm, and report how the bridge keeps up:
+handler throughput, IO lane drops and MQTT publish backlog. IO tasks (snapshot
+and clip downloads, streams) only sleep for --io-latency, and the MQTT broker
+acknowledges messages after --broker-latency, behind the real bounded
+publisher and IO lanes::
+
+    python -m somfy_protect.websocket.loadgen replay websocket_record.jsonl.gz --speed 10
+    python -m somfy_protect.websocket.loadgen storm --rate 200 --devices 50 --duration 30
+"""
+
+import argparse
+import asyncio
+import collections
+import logging
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Iterable, Iterator, Optional
+from unittest.mock import MagicMock
+
+import paho.mqtt.client as mqtt
+from jsoncodec import JSON_CODEC
+from metrics import METRICS
+from mqtt.publisher import MqttPublisher
+from somfy_protect.websocket import SomfyProtectWebsocket
+from somfy_protect.websocket.recording import read_recording
+
+LOGGER = logging.getLogger(__name__)
+
+STORM_KEYS = ("device.status", "alarm.trespass", "device.ring_door_bell", "presence_in")
+
+
+def storm_events(
+    rate: float, devices: int, duration: float, key: str = "device.status", sites: int = 1
+) -> Iterator[tuple[float, str]]:
+    """Generate a synthetic storm of one kind of event, spread evenly over the devices.
+
+    Args:
+        rate (float): Events per second.
+        devices (int): Devices sending them, per site.
+        duration (float): Seconds of storm.
+        key (str): One of STORM_KEYS.
+        sites (int): Sites the devices belong to.
+
+    Yields:
+        tuple: Offset in seconds and message text.
+    """
+    if key not in STORM_KEYS:
+        raise ValueError("Unknown storm key {}, expected one of {}".format(key, ", ".join(STORM_KEYS)))
+    run = uuid.uuid4().hex[:8]
+    for index in range(int(rate * duration)):
+        device = index % (devices * sites)
+        message = {
+            "profiles": ["owner", "admin"],
+            "site_id": f"site-{device // devices}",
+            "key": key,
+            "device_id": f"device-{device % devices}",
+            "message_id": f"{run}-{index}",
+        }
+        if key == "device.status":
+            message.update({"type": "testing", "device_lost": False, "rlink_quality": -70, "battery_level": 90})
+        elif key == "alarm.trespass":
+            message.update({"type": "alarm", "device_type": "pir"})
+        elif key == "device.ring_door_bell":
+            message.update({"type": "event", "snapshot_url": f"https://loadgen.invalid/{run}/{index}.jpg"})
+        else:
+            message.update({"type": "event", "user_id": f"user-{device % devices}", "device_type": "fob"})
+        yield index / rate, JSON_CODEC.dumps_str(message)
+
+
+def recorded_events(path: str, loops: int = 1) -> Iterator[tuple[float, str]]:
+    """Read a recording, played loops times in a row.
+
+    Message_ids get a prefix per loop, so that each loop is handled instead of deduplicated.
+
+    Args:
+        path (str): Recording file.
+        loops (int): Times the recording is played.
+
+    Yields:
+        tuple: Offset in seconds and message text.
+    """
+    run = uuid.uuid4().hex[:8]
+    start = 0.0
+    for loop in range(max(1, loops)):
+        offset = 0.0
+        for offset, message in read_recording(path):
+            yield start + offset, message.replace('"message_id":"', f'"message_id":"{run}-{loop}-')
+        start += offset
+
+
+class SimulatedBroker:
+    """paho client acknowledging each publish after a latency, on its own thread.
+
+    Args:
+        latency (float): Seconds before a message is acknowledged.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.publisher: Optional[MqttPublisher] = None
+        self.published = 0
+        self._mid = 0
+        self._pending: collections.deque = collections.deque()
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="loadgen-broker", daemon=True)
+        self._thread.start()
+
+    def publish(self, _topic, _payload, qos=0, retain=False, properties=None):  # pylint: disable=unused-argument
+        """Accept a message, acknowledged later."""
+        with self._cond:
+            self._mid += 1
+            self.published += 1
+            self._pending.append((time.monotonic() + self.latency, self._mid))
+            self._cond.notify()
+            return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=self._mid)
+
+    def stop(self) -> None:
+        """Stop acknowledging."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=2)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                due, mid = self._pending[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                self._pending.popleft()
+            self.publisher.on_publish(mid)
+
+
+class PublisherClient:
+    """MQTTClient stand-in publishing through the real bounded publisher."""
+
+    def __init__(self, publisher: MqttPublisher):
+        self.publisher = publisher
+
+    def publish(self, topic, payload, **kwargs) -> bool:
+        """Queue a message on the publisher."""
+        return self.publisher.publish(topic, payload, **kwargs)
+
+
+class LoadHarness:
+    """SomfyProtectWebsocket fed offline, with simulated IO and broker.
+
+    Args:
+        io_latency (float): Seconds each IO task takes.
+        broker_latency (float): Seconds before the broker acknowledges a message.
+    """
+
+    def __init__(self, io_latency: float = 0.05, broker_latency: float = 0.005):
+        self.io_latency = io_latency
+        self.broker = SimulatedBroker(broker_latency)
+        self.publisher = MqttPublisher(self.broker)
+        self.broker.publisher = self.publisher
+        sso = MagicMock()
+        sso.get_token.return_value = {"access_token": "loadgen"}
+        config = {"mqtt": {"topic_prefix": "loadgen"}, "websocket_dedupe": {"persist": False}}
+        self.websocket = SomfyProtectWebsocket(
+            sso=sso, config=config, mqtt_client=PublisherClient(self.publisher), api=MagicMock()
+        )
+        # Acks go nowhere, IO tasks only take their time
+        self.websocket.send_websocket_message = lambda message, websocket=None: None
+        self.websocket._run_io_task = self._simulated_io  # pylint: disable=protected-access
+        self.websocket._run_stream_task = self._simulated_stream  # pylint: disable=protected-access
+
+    def _simulated_io(self, lane: str, _func, *_args, **_kwargs) -> None:
+        self.websocket._io.submit(lane, time.sleep, self.io_latency)  # pylint: disable=protected-access
+
+    def _simulated_stream(self, device_id: str, _func, *_args, **_kwargs) -> bool:
+        streams = self.websocket._io.streams  # pylint: disable=protected-access
+        return streams.start(device_id, time.sleep, self.io_latency)
+
+    def run(self, events: Iterable[tuple[float, str]], speed: float = 1.0) -> dict:
+        """Feed the events, then wait for the MQTT backlog to drain.
+
+        Args:
+            events (Iterable): Offsets in seconds and message texts.
+            speed (float): Replay speed, 0 for as fast as possible.
+
+        Returns:
+            dict: Report of the run.
+        """
+        METRICS.reset()
+        self.publisher.start()
+        self.publisher.set_connected(True)
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._feed(events, speed), self.websocket.loop)
+            count, elapsed, lag, backlog_max = future.result()
+            drain_started = time.monotonic()
+            while self.publisher.backlog and time.monotonic() - drain_started < 60:
+                time.sleep(0.01)
+            drain = time.monotonic() - drain_started
+        finally:
+            self.publisher.stop()
+            self.broker.stop()
+            self.websocket.close()
+        snapshot = METRICS.snapshot()
+        counters = snapshot["counters"]
+        return {
+            "events": count,
+            "elapsed_s": round(elapsed, 3),
+            "events_per_s": round(count / elapsed, 1) if elapsed else None,
+            "max_lag_ms": round(lag * 1000, 1),
+            "io_dropped": {
+                name[len("io_") : -len("_dropped")]: value
+                for name, value in counters.items()
+                if name.startswith("io_") and name.endswith("_dropped")
+            },
+            "mqtt_published": self.broker.published,
+            "mqtt_coalesced": counters.get("mqtt_publish_coalesced", 0),
+            "mqtt_dropped": {
+                name[len("mqtt_publish_dropped_") :]: value
+                for name, value in counters.items()
+                if name.startswith("mqtt_publish_dropped_")
+            },
+            "mqtt_backlog_max": backlog_max,
+            "mqtt_drain_s": round(drain, 3),
+            "event_publish_ms": snapshot["histograms_ms"].get("event_publish", {}),
+        }
+
+    async def _feed(self, events: Iterable[tuple[float, str]], speed: float) -> tuple[int, float, float, int]:
+        count = 0
+        lag = 0.0
+        backlog_max = 0
+        start = time.monotonic()
+        for offset, message in events:
+            if speed:
+                late = time.monotonic() - start - offset / speed
+                if late < 0:
+                    await asyncio.sleep(-late)
+                else:
+                    lag = max(lag, late)
+            await self.websocket.on_message(None, message)
+            count += 1
+            if not count % 100:
+                backlog_max = max(backlog_max, self.publisher.depth)
+                # Let the pulse resets and coroutine handlers run during as fast as possible runs
+                await asyncio.sleep(0)
+        # Handlers still running publish before the drain starts
+        tasks = self.websocket._message_tasks  # pylint: disable=protected-access
+        while tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return count, time.monotonic() - start, lag, max(backlog_max, self.publisher.depth)
+
+
+def main(argv: Optional[list] = None) -> dict:
+    """Run the load generator from the command line.
+
+    Args:
+        argv (list | None): Arguments, sys.argv when None.
+
+    Returns:
+        dict: Report of the run, also printed.
+    """
+    parser = argparse.ArgumentParser(description="Replay websocket events against the bridge, offline")
+    parser.add_argument("--io-latency", type=float, default=0.05, help="seconds taken by each IO task")
+    parser.add_argument("--broker-latency", type=float, default=0.005, help="seconds before the broker acks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay = commands.add_parser("replay", help="replay a websocket_record recording")
+    replay.add_argument("path", help="recording file")
+    replay.add_argument("--speed", type=float, default=1.0, help="1, 10, 100... 0 for as fast as possible")
+    replay.add_argument("--loops", type=int, default=1, help="times the recording is played")
+    storm = commands.add_parser("storm", help="generate a synthetic event storm")
+    storm.add_argument("--rate", type=float, default=200, help="events per second")
+    storm.add_argument("--devices", type=int, default=50, help="devices per site")
+    storm.add_argument("--sites", type=int, default=1, help="sites")
+    storm.add_argument("--duration", type=float, default=10, help="seconds of storm")
+    storm.add_argument("--key", choices=STORM_KEYS, default="device.status", help="event key")
+    storm.add_argument("--speed", type=float, default=1.0, help="1, 10, 100... 0 for as fast as possible")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.command == "replay":
+        events = recorded_events(args.path, loops=args.loops)
+    else:
+        events = storm_events(args.rate, args.devices, args.duration, key=args.key, sites=args.sites)
+    report = LoadHarness(io_latency=args.io_latency, broker_latency=args.broker_latency).run(events, speed=args.speed)
+    print(JSON_CODEC.dumps_str(report))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Redacted recording of the websocket traffic
+
+With ``websocket_record`` configured, every message received on the websocket
+is written to a gzipped JSON lines file, with its offset in seconds from the
+start of the recording, to be replayed by ``somfy_protect.websocket.loadgen``.
+Each run appends its own header line and messages to the file, so a restart
+does not overwrite the messages recorded before it.
+
+Messages are redacted before being written: identifiers are replaced by salted
+hashes, consistent within a recording so that events of one device still go
+together, and URLs, names, tokens and WebRTC negotiation details are dropped.
+Redaction and writes happen on a writer thread, the websocket loop only queues
+the messages.
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from jsoncodec import JSON_CODEC
+
+LOGGER = logging.getLogger(__name__)
+
+RECORDING_VERSION = 1
+RECORDING_MAX_EVENTS = 100000
+# Hashed, relations between events are kept
+ID_FIELDS = frozenset(
+    ("site_id", "device_id", "user_id", "box_id", "session_id", "event_id", "message_id", "gateway_id")
+)
+# Replaced, they may carry personal data or credentials
+REDACTED_FIELDS = frozenset(
+    (
+        "snapshot_url",
+        "snapshot_cloudfront_url",
+        "clip_cloudfront_url",
+        "stream_url",
+        "label",
+        "site_label",
+        "user_display_name",
+        "userDsp",
+        "siteLabel",
+        "sdp",
+        "candidate",
+        "urls",
+        "username",
+        "credential",
+        "password",
+        "token",
+        "access_token",
+        "name",
+        "title",
+        "email",
+        "phone",
+    )
+)
+REDACTED = "redacted"
+
+
+def redact(value, salt: bytes):
+    """Return a redacted copy of a decoded websocket message.
+
+    Args:
+        value: Decoded message, or part of it.
+        salt (bytes): Salt of the identifier hashes.
+
+    Returns:
+        Same structure, identifiers hashed and sensitive fields replaced.
+    """
+    if isinstance(value, dict):
+        redacted = {}
+        for name, item in value.items():
+            if name in ID_FIELDS and isinstance(item, str):
+                redacted[name] = hashlib.sha256(salt + item.encode()).hexdigest()[:16]
+            elif name in REDACTED_FIELDS and item:
+                redacted[name] = REDACTED
+            else:
+                redacted[name] = redact(item, salt)
+        return redacted
+    if isinstance(value, list):
+        return [redact(item, salt) for item in value]
+    return value
+
+
+class WebsocketRecorder:
+    """Append redacted websocket messages to a recording file.
+
+    Args:
+        path (str): Recording file, gzipped JSON lines.
+        max_events (int): Messages recorded by this run before the recording stops.
+        clock (callable): Monotonic clock, for the offsets.
+    """
+
+    def __init__(self, path: str, max_events: int = RECORDING_MAX_EVENTS, clock=time.monotonic):
+        self.path = path
+        self.max_events = max(1, int(max_events))
+        # Messages accepted for the recording, written or still queued
+        self.events = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._salt = os.urandom(16)
+        self._started_at = clock()
+        self._file = None
+        self._written = 0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._closed = False
+
+    def record(self, message: str) -> None:
+        """Queue a raw websocket message for the recording, without blocking.
+
+        Args:
+            message (str): Message as received.
+        """
+        offset = round(self._clock() - self._started_at, 3)
+        with self._lock:
+            if self._closed or self.events >= self.max_events:
+                return
+            self.events += 1
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_queued, name="websocket-recorder", daemon=True)
+                self._writer.start()
+        self._queue.put((offset, message))
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Write the queued messages, then close the recording file.
+
+        Args:
+            timeout (float): Seconds given to the writer to finish.
+        """
+        with self._lock:
+            self._closed = True
+            writer = self._writer
+        if writer is None:
+            return
+        self._queue.put(None)
+        writer.join(timeout=timeout)
+
+    def _write_queued(self) -> None:
+        while True:
+            queued = self._queue.get()
+            if queued is None:
+                break
+            if self._written < self.max_events:
+                self._write(*queued)
+        self._close()
+
+    def _write(self, offset: float, message: str) -> None:
+        try:
+            decoded = JSON_CODEC.loads(message)
+        except ValueError:
+            decoded = None
+        # Control messages may be raw text, they carry nothing sensitive
+        text = JSON_CODEC.dumps_str(redact(decoded, self._salt)) if isinstance(decoded, dict) else message
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write(JSON_CODEC.dumps_str([offset, text]) + "\n")
+        except OSError as e:
+            LOGGER.warning("Websocket recording stopped, unable to write {}: {}".format(self.path, e))
+            with self._lock:
+                self.events = self.max_events
+            self._written = self.max_events
+            self._close()
+            return
+        self._written += 1
+        if self._written == self.max_events:
+            LOGGER.info("Websocket recording complete, {} messages in {}".format(self._written, self.path))
+            self._close()
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path) and not _is_complete(self.path):
+            # Appending after a truncated run would make the whole file unreadable
+            damaged = "{}.{}".format(self.path, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S"))
+            os.replace(self.path, damaged)
+            LOGGER.warning("Websocket recording {} is truncated, moved to {}".format(self.path, damaged))
+        # A new gzip member, read back as the continuation of the previous runs
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+        header = {"version": RECORDING_VERSION, "recorded_at": datetime.now(timezone.utc).isoformat()}
+        self._file.write(JSON_CODEC.dumps_str(header) + "\n")
+        LOGGER.info("Recording websocket messages to {}".format(self.path))
+
+    def _close(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError as e:
+                LOGGER.warning("Unable to close websocket recording {}: {}".format(self.path, e))
+            self._file = None
+
+
+def _is_complete(path: str) -> bool:
+    """Tell whether every gzip member of path was closed cleanly."""
+    try:
+        with gzip.open(path, "rb") as recording:
+            while recording.read(1 << 20):
+                pass
+    except (EOFError, OSError, zlib.error):
+        return False
+    return True
+
+
+def read_recording(path: str) -> Iterator[tuple[float, str]]:
+    """Read a recording.
+
+    The runs appended after the first one follow it: their offsets are shifted
+    by the last offset of the run before.
+
+    Args:
+        path (str): Recording file written by WebsocketRecorder.
+
+    Yields:
+        tuple: Offset in seconds and message text, in order.
+
+    Raises:
+        ValueError: Not a recording, or of an unknown version.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as recording:
+        header: Optional[dict] = JSON_CODEC.loads(recording.readline() or "null")
+        if not isinstance(header, dict) or header.get("version") != RECORDING_VERSION:
+            raise ValueError("{} is not a websocket recording".format(path))
+        run_start = last = 0.0
+        try:
+            for line in recording:
+                if not line.strip():
+                    continue
+                decoded = JSON_CODEC.loads(line)
+                if isinstance(decoded, dict):
+                    # Header of a run appended after a restart
+                    if decoded.get("version") != RECORDING_VERSION:
+                        raise ValueError("{} has a run of an unknown version".format(path))
+                    run_start = last
+                    continue
+                offset, message = decoded
+                last = run_start + float(offset)
+                yield last, message
+        except EOFError:
+            # Not closed cleanly, the messages flushed before are still there
+            LOGGER.warning("Websocket recording {} is truncated".format(path))
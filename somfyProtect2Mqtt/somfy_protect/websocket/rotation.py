@@ -0,0 +1,86 @@
+"""Make-before-break rotation of the websocket connection
+
+A connection to replace (token refreshed, no message for a while) keeps
+delivering events while its replacement opens, and is only closed once the
+new one is open.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+from typing import Callable, Optional
+
+from somfy_protect.websocket.transport import AsyncWebsocketTransport
+
+LOGGER = logging.getLogger(__name__)
+
+
+class WebsocketConnections:
+    """Active websocket connection, and the standby one opening to replace it.
+
+    Args:
+        new_transport (Callable): Return a new, not yet running, transport.
+    """
+
+    def __init__(self, new_transport: Callable[[], AsyncWebsocketTransport]):
+        self._new_transport = new_transport
+        self.active = new_transport()
+        self.standby: Optional[AsyncWebsocketTransport] = None
+        self._active_run: Optional[asyncio.Future] = None
+        self._standby_run: Optional[asyncio.Task] = None
+        self._run_future: Optional[concurrent.futures.Future] = None
+
+    def run_forever(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Run the connections on loop until they are closed, from another thread."""
+        self._run_future = asyncio.run_coroutine_threadsafe(self._run(), loop)
+        try:
+            self._run_future.result()
+        except concurrent.futures.CancelledError:
+            LOGGER.info("Websocket loop cancelled")
+
+    async def _run(self) -> None:
+        """Run the active transport until it is closed, following the switch-overs"""
+        self._active_run = asyncio.ensure_future(self.active.run_forever())
+        while True:
+            run = self._active_run
+            await run
+            if run is self._active_run:
+                break
+        # A connection still opening when closed
+        if self._standby_run is not None:
+            await self._standby_run
+
+    def rotate(self) -> bool:
+        """Open the standby connection, on the event loop.
+
+        Returns:
+            bool: False when one is already opening.
+        """
+        if self.standby is not None:
+            return False
+        self.standby = self._new_transport()
+        self._standby_run = asyncio.get_running_loop().create_task(self.standby.run_forever())
+        return True
+
+    def switch_over(self) -> AsyncWebsocketTransport:
+        """Make the standby connection the active one, on the event loop.
+
+        Returns:
+            AsyncWebsocketTransport: Previous connection, still to be closed.
+        """
+        previous = self.active
+        self.active, self._active_run = self.standby, self._standby_run
+        self.standby = self._standby_run = None
+        return previous
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Close both connections, giving run_forever timeout seconds to return."""
+        if self.standby:
+            self.standby.close()
+        if self.active:
+            self.active.close()
+        if self._run_future is not None:
+            try:
+                self._run_future.result(timeout=timeout)
+            except (concurrent.futures.CancelledError, TimeoutError):
+                self._run_future.cancel()
@@ -0,0 +1,351 @@
+"""Asyncio websocket transport
+
+Native asyncio client for the Somfy events websocket (RFC 6455), running on
+the same event loop as the WebRTC handler: frames are read, decoded and
+dispatched without leaving the loop. Frames are encoded with websocket-client's
+ABNF, the rest is plain asyncio streams. Liveness is checked with ping/pong and
+dropped connections are reopened, with a fresh URL (and token) each time.
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import ssl
+import struct
+import time
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlsplit
+
+from websocket import ABNF
+
+LOGGER = logging.getLogger(__name__)
+
+HANDSHAKE_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+CLOSE_NORMAL = 1000
+
+OPCODE_CONT = ABNF.OPCODE_CONT
+OPCODE_TEXT = ABNF.OPCODE_TEXT
+OPCODE_BINARY = ABNF.OPCODE_BINARY
+OPCODE_CLOSE = ABNF.OPCODE_CLOSE
+OPCODE_PING = ABNF.OPCODE_PING
+OPCODE_PONG = ABNF.OPCODE_PONG
+
+
+class WebsocketProtocolError(Exception):
+    """The server broke the websocket protocol"""
+
+
+def accept_key(key: str) -> str:
+    """Return the Sec-WebSocket-Accept value expected for a Sec-WebSocket-Key."""
+    return base64.b64encode(hashlib.sha1((key + HANDSHAKE_GUID).encode()).digest()).decode()
+
+
+def encode_frame(data: bytes | str, opcode: int = OPCODE_TEXT, mask: bool = True) -> bytes:
+    """Encode one websocket frame, masked as required from a client.
+
+    Args:
+        data (bytes | str): Payload, str is sent as UTF-8.
+        opcode (int): OPCODE_* of the frame.
+        mask (bool): Mask the payload (client to server frames).
+
+    Returns:
+        bytes: Frame ready to be written.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf8")
+    return ABNF(1, 0, 0, 0, opcode, 1 if mask else 0, data).format()
+
+
+async def read_frame(reader: asyncio.StreamReader, max_size: int = MAX_MESSAGE_SIZE) -> tuple[bool, int, bytes]:
+    """Read one websocket frame.
+
+    Args:
+        reader (asyncio.StreamReader): Connection.
+        max_size (int): Largest payload accepted.
+
+    Returns:
+        tuple: FIN flag, opcode and unmasked payload.
+
+    Raises:
+        asyncio.IncompleteReadError: The connection was closed.
+        WebsocketProtocolError: The frame is too large.
+    """
+    head = await reader.readexactly(2)
+    fin = bool(head[0] & 0x80)
+    opcode = head[0] & 0x0F
+    length = head[1] & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", await reader.readexactly(8))
+    if length > max_size:
+        raise WebsocketProtocolError(f"Frame of {length} bytes exceeds {max_size}")
+    mask_key = await reader.readexactly(4) if head[1] & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask_key:
+        payload = ABNF.mask(mask_key, payload)
+    return fin, opcode, payload
+
+
+class AsyncWebsocketTransport:
+    """Websocket client connection, reopened until closed.
+
+    Callbacks take the transport first, like websocket-client's WebSocketApp:
+    ``on_message(ws, text)`` is a coroutine awaited in the order messages
+    arrive, the others are plain functions.
+
+    Args:
+        url (Callable[[], str]): Return the URL to connect to, called on every connection, in a
+            thread of the loop's default executor since it may block (e.g. to refresh a token).
+        on_message (Callable): Coroutine handling a text message.
+        on_open (Callable | None): Connection established.
+        on_close (Callable | None): Connection closed, with the close code and reason.
+        on_error (Callable | None): Connection failed or dropped.
+        on_ping (Callable | None): Ping received from the server.
+        on_pong (Callable | None): Pong received from the server.
+        ping_interval (float): Seconds between pings, 0 to disable them.
+        ping_timeout (float): Seconds to wait for the pong before dropping the connection.
+        reconnect (float): Seconds before reconnecting, 0 to stop on the first disconnection.
+        open_timeout (float): Seconds allowed to connect and complete the handshake.
+        ssl_context (ssl.SSLContext | None): TLS context for wss URLs.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    def __init__(
+        self,
+        url: Callable[[], str],
+        on_message: Callable[["AsyncWebsocketTransport", str], Awaitable[None]],
+        on_open: Optional[Callable] = None,
+        on_close: Optional[Callable] = None,
+        on_error: Optional[Callable] = None,
+        on_ping: Optional[Callable] = None,
+        on_pong: Optional[Callable] = None,
+        *,
+        ping_interval: float = 15,
+        ping_timeout: float = 10,
+        reconnect: float = 5,
+        open_timeout: float = 5,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ):
+        self.url = url
+        self.on_message = on_message
+        self.on_open = on_open
+        self.on_close = on_close
+        self.on_error = on_error
+        self.on_ping = on_ping
+        self.on_pong = on_pong
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.reconnect = reconnect
+        self.open_timeout = open_timeout
+        self.ssl_context = ssl_context
+        self.last_pong_at = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pong = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._close_sent = False
+
+    @property
+    def connected(self) -> bool:
+        """True while the connection is open."""
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def run_forever(self) -> None:
+        """Connect, dispatch messages and reconnect until close is called."""
+        self._loop = asyncio.get_running_loop()
+        while not self._closing:
+            self._close_sent = False
+            failed = False
+            try:
+                await self._run_connection()
+            except (OSError, EOFError, asyncio.TimeoutError, WebsocketProtocolError) as e:
+                failed = True
+                # The server may drop the connection instead of answering our close frame
+                if not self._close_sent:
+                    self._callback(self.on_error, e)
+            finally:
+                self._drop(abort=failed)
+            if self._closing or not self.reconnect:
+                break
+            LOGGER.info("Websocket reconnecting in {}s".format(self.reconnect))
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.reconnect)
+            except asyncio.TimeoutError:
+                pass
+
+    def send(self, message: str) -> bool:
+        """Send a text message, from any thread.
+
+        Returns:
+            bool: False when the connection is not open.
+        """
+        if not self.connected:
+            return False
+        return self._call_soon(self._write, encode_frame(message))
+
+    def disconnect(self) -> None:
+        """Drop the current connection, a new one is opened after the reconnect delay."""
+        self._call_soon(self._send_close)
+
+    def close(self) -> None:
+        """Close the connection for good, from any thread."""
+        self._closing = True
+        self._call_soon(self._shutdown)
+
+    async def _run_connection(self) -> None:
+        url = await asyncio.get_running_loop().run_in_executor(None, self.url)
+        reader, writer = await asyncio.wait_for(self._open(url), timeout=self.open_timeout)
+        self._writer = writer
+        self._callback(self.on_open)
+        pinger = asyncio.create_task(self._keepalive()) if self.ping_interval else None
+        try:
+            code, reason = await self._receive(reader)
+        finally:
+            if pinger:
+                pinger.cancel()
+        self._callback(self.on_close, code, reason)
+
+    async def _open(self, url: str) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        parts = urlsplit(url)
+        secure = parts.scheme == "wss"
+        port = parts.port or (443 if secure else 80)
+        resource = parts.path or "/"
+        if parts.query:
+            resource = f"{resource}?{parts.query}"
+        reader, writer = await asyncio.open_connection(
+            parts.hostname,
+            port,
+            ssl=(self.ssl_context or ssl.create_default_context()) if secure else None,
+            limit=MAX_MESSAGE_SIZE,
+        )
+        key = base64.b64encode(os.urandom(16)).decode()
+        host = parts.hostname if parts.port is None else f"{parts.hostname}:{parts.port}"
+        writer.write(
+            (
+                f"GET {resource} HTTP/1.1\r\n"
+                f"Host: {host}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n\r\n"
+            ).encode()
+        )
+        try:
+            response = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        except asyncio.LimitOverrunError as e:
+            writer.close()
+            raise WebsocketProtocolError("Handshake response too large") from e
+        status, *lines = response.split("\r\n")
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if status.split(" ")[1:2] != ["101"] or headers.get("sec-websocket-accept") != accept_key(key):
+            writer.close()
+            raise WebsocketProtocolError(f"Handshake failed: {status}")
+        return reader, writer
+
+    async def _receive(self, reader: asyncio.StreamReader) -> tuple[Optional[int], Optional[str]]:
+        fragments: list[bytes] = []
+        message_opcode = None
+        while True:
+            fin, opcode, payload = await read_frame(reader)
+            if opcode == OPCODE_PING:
+                self._write(encode_frame(payload, OPCODE_PONG))
+                self._callback(self.on_ping, payload)
+                continue
+            if opcode == OPCODE_PONG:
+                self.last_pong_at = time.time()
+                self._pong.set()
+                self._callback(self.on_pong, payload)
+                continue
+            if opcode == OPCODE_CLOSE:
+                code = struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else None
+                reason = payload[2:].decode("utf8", "replace") if len(payload) > 2 else None
+                self._send_close()
+                return code, reason
+            if opcode in (OPCODE_TEXT, OPCODE_BINARY):
+                message_opcode = opcode
+                fragments = [payload]
+            elif opcode == OPCODE_CONT and message_opcode is not None:
+                fragments.append(payload)
+            else:
+                raise WebsocketProtocolError(f"Unexpected opcode {opcode}")
+            if not fin:
+                continue
+            data = b"".join(fragments) if len(fragments) > 1 else fragments[0]
+            fragments = []
+            if message_opcode == OPCODE_TEXT:
+                try:
+                    await self.on_message(self, data.decode("utf8"))
+                except Exception:  # pylint: disable=broad-exception-caught
+                    # A failing handler must not drop the connection
+                    LOGGER.exception("Error while processing websocket message")
+            message_opcode = None
+
+    async def _keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            self._pong.clear()
+            self._write(encode_frame(b"", OPCODE_PING))
+            try:
+                await asyncio.wait_for(self._pong.wait(), timeout=self.ping_timeout)
+            except asyncio.TimeoutError:
+                LOGGER.warning("No websocket pong within {}s, reconnecting".format(self.ping_timeout))
+                self._drop(abort=True)
+                return
+
+    def _write(self, frame: bytes) -> None:
+        if self.connected:
+            self._writer.write(frame)
+
+    def _send_close(self) -> None:
+        if self.connected:
+            self._close_sent = True
+            self._writer.write(encode_frame(struct.pack("!H", CLOSE_NORMAL), OPCODE_CLOSE))
+            self._writer.close()
+
+    def _shutdown(self) -> None:
+        self._send_close()
+        self._wake.set()
+
+    def _drop(self, abort: bool = False) -> None:
+        """Forget the connection, aborting it when it may be half-open.
+
+        Args:
+            abort (bool): Do not wait for a graceful close, the peer may never answer it.
+        """
+        if self._writer is not None:
+            if abort:
+                self._writer.transport.abort()
+            else:
+                self._writer.close()
+            self._writer = None
+
+    def _call_soon(self, func: Callable, *args) -> bool:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return False
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            func(*args)
+            return True
+        try:
+            loop.call_soon_threadsafe(func, *args)
+        except RuntimeError:
+            return False
+        return True
+
+    def _callback(self, callback: Optional[Callable], *args) -> None:
+        if callback is not None:
+            callback(self, *args)
@@ -2,22 +2,39 @@
 
 import logging
 from time import sleep
+from typing import Optional
 
 import schedule
 from business import (
     ha_devices_config,
     ha_sites_config,
+    remove_discovery_configs,
     update_camera_snapshot,
     update_devices_status,
     update_sites_status,
+    warm_start,
 )
+from business.discovery_store import DISCOVERY_STORE, DISCOVERY_STORE_FILENAME
+from business.mqtt import publish_bridge_availability, publish_bridge_metrics
+from business.snapshot import SNAPSHOT_FILENAME, STATE_SNAPSHOT
 from exceptions import SomfyProtectInitError
 from mqtt import MQTTClient
 from somfy_protect.api import SomfyProtectApi
+from somfy_protect.websocket.dedupe import MESSAGE_DEDUPE
+from utils import resolve_data_path
 
 LOGGER = logging.getLogger(__name__)
 
 
+def save_persisted_state() -> None:
+    """Save the state snapshot and the websocket message_ids, when they changed.
+
+    Run periodically, so that a crash or a killed container loses one period at most.
+    """
+    STATE_SNAPSHOT.save()
+    MESSAGE_DEDUPE.save()
+
+
 class SomfyProtect2Mqtt:
     """SomfyProtect2Mqtt Class
 
@@ -25,13 +42,16 @@ class SomfyProtect2Mqtt:
         SomfyProtectInitError: Unable to init
     """
 
-    def __init__(self, api: SomfyProtectApi, mqtt_client: MQTTClient, config: dict) -> None:
+    def __init__(
+        self, api: SomfyProtectApi, mqtt_client: MQTTClient, config: dict, my_sites_id: Optional[list] = None
+    ) -> None:
         """Init SomfyProtect2Mqtt
 
         Args:
             api (SomfyProtectApi): SomfyProtectApi
             mqtt_client (MQTTClient): MQTTClient
             config (dict): Global Configuration
+            my_sites_id (list | None): List to keep the resolved site IDs in, shared with the websocket
 
         Raises:
             SomfyProtectInitError: Unable to init
@@ -42,7 +62,9 @@ class SomfyProtect2Mqtt:
         self.my_sites = somfy_config.get("sites")
         if not self.my_sites:
             raise SomfyProtectInitError("Missing somfy_protect.sites in config")
-        self.my_sites_id = []
+        # Updated in place, the scheduled jobs and the websocket catch-up hold a reference to it
+        self.my_sites_id = my_sites_id if my_sites_id is not None else []
+        self.my_sites_id.clear()
 
         self.delay_site = config.get("delay_site", 60)
         self.delay_site = max(self.delay_site, 60)
@@ -61,22 +83,40 @@ class SomfyProtect2Mqtt:
         if self.mqtt_config is None:
             raise SomfyProtectInitError("MQTT config is missing")
 
+        DISCOVERY_STORE.configure(resolve_data_path(config, DISCOVERY_STORE_FILENAME))
+        self.warm_started = False
+        if config.get("warm_start", True):
+            STATE_SNAPSHOT.configure(resolve_data_path(config, SNAPSHOT_FILENAME))
+            self.my_sites_id.extend(warm_start(self.mqtt_client, self.mqtt_config, self.my_sites))
+            self.warm_started = bool(self.my_sites_id)
+        if not self.warm_started:
+            self._resolve_sites()
+
+    def _resolve_sites(self) -> None:
+        """Resolve configured site labels to site IDs through the API."""
         sites = self.api.get_sites()
         LOGGER.info(f"Found {len(sites)} Site(s)")
+        my_sites_id = []
         for site in sites:
             LOGGER.info(f"Found Site : {site.label}")
             if site.label in self.my_sites:
                 LOGGER.info(f"Storing Site ID for {site.label}")
-                self.my_sites_id.append(site.id)
+                my_sites_id.append(site.id)
+                STATE_SNAPSHOT.record_site(site.id, site.label)
             else:
                 LOGGER.info(f"Site '{site.label}' is not set in configuration, Update it if you want to add this Site")
+        # Scheduled jobs hold a reference to this list, update it in place
+        self.my_sites_id[:] = my_sites_id
 
     def close(self) -> None:
         """Close"""
+        save_persisted_state()
+        DISCOVERY_STORE.save()
 
-    def loop(self, shutdown_event=None) -> None:
-        """Main Loop"""
-        # Config
+    def _publish_discovery(self) -> None:
+        """Publish new or changed discovery configs, and remove the ones of vanished entities."""
+        DISCOVERY_STORE.refresh_requested.clear()
+        DISCOVERY_STORE.begin_refresh()
         ha_sites_config(
             api=self.api,
             mqtt_client=self.mqtt_client,
@@ -90,6 +130,19 @@ class SomfyProtect2Mqtt:
             mqtt_config=self.mqtt_config,
             my_sites_id=self.my_sites_id,
         )
+        remove_discovery_configs(self.mqtt_client, DISCOVERY_STORE.commit_refresh())
+        DISCOVERY_STORE.save()
+
+    def loop(self, shutdown_event=None) -> None:
+        """Main Loop"""
+        # Reconcile a warm start with the live API
+        if self.warm_started:
+            self._resolve_sites()
+        STATE_SNAPSHOT.begin_refresh()
+        publish_bridge_availability(self.mqtt_client, self.mqtt_config)
+
+        # Config
+        self._publish_discovery()
 
         # Device Update (First Run Only)
         update_sites_status(
@@ -112,6 +165,9 @@ class SomfyProtect2Mqtt:
             my_sites_id=self.my_sites_id,
         )
 
+        STATE_SNAPSHOT.commit_refresh(self.my_sites_id)
+        STATE_SNAPSHOT.save()
+
         # Schedule Refreshs
         schedule.clear()
         schedule.every(self.delay_site).seconds.do(
@@ -137,9 +193,20 @@ class SomfyProtect2Mqtt:
                 my_sites_id=self.my_sites_id,
             )
 
+        schedule.every(self.delay_device).seconds.do(save_persisted_state)
+        schedule.every(self.delay_device).seconds.do(
+            publish_bridge_metrics,
+            mqtt_client=self.mqtt_client,
+            mqtt_config=self.mqtt_config,
+        )
+
         while True:
             if shutdown_event and shutdown_event.is_set():
                 LOGGER.info("Shutdown event set, exiting main loop")
+                self.close()
                 break
+            if DISCOVERY_STORE.refresh_requested.is_set():
+                LOGGER.info("Republishing discovery configs")
+                self._publish_discovery()
             schedule.run_pending()
             sleep(1)
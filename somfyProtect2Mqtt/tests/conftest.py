@@ -0,0 +1,29 @@
+"""Shared test configuration.
+
+Benchmarks are marked ``benchmark`` and deselected by default, their results
+are listed at the end of the run::
+
+    python -m pytest -m benchmark
+"""
+
+import pytest
+
+BENCHMARK_RESULTS: list[str] = []
+
+
+@pytest.fixture
+def benchmark_report(request):
+    """Return a function recording a line of benchmark results for the summary."""
+
+    def report(line: str) -> None:
+        BENCHMARK_RESULTS.append(f"{request.node.name}: {line}")
+
+    return report
+
+
+def pytest_terminal_summary(terminalreporter):
+    """List the benchmark results."""
+    if BENCHMARK_RESULTS:
+        terminalreporter.section("benchmarks")
+        for line in BENCHMARK_RESULTS:
+            terminalreporter.write_line(line)
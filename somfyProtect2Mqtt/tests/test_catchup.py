@@ -0,0 +1,62 @@
+"""Tests for the catch-up after a websocket reconnection."""
+
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+from business.snapshot import STATE_SNAPSHOT
+from metrics import METRICS
+from somfy_protect.api.model import Site
+from somfy_protect.websocket.catchup import WebsocketCatchUp
+
+
+class Publisher:
+    """Stand-in for the MQTT client, keeping what is published."""
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic: str, payload, **_kwargs) -> None:
+        """Keep topic and payload, as if the message was published."""
+        self.published.append((topic, payload))
+
+
+def _occurred_at(seconds_ago: float) -> str:
+    date = datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)
+    return date.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def test_first_connection_does_not_catch_up():
+    """Only reconnections catch up, from the last event handled."""
+    catch_up = WebsocketCatchUp(clock=lambda: 100.0)
+    assert catch_up.connected() is None
+    assert catch_up.connected() == 100.0
+    catch_up.record_event(150.0)
+    assert catch_up.connected() == 150.0
+
+
+def test_missed_alarm_and_history_are_published(monkeypatch):
+    """An alarm triggered while disconnected is published, with the history since."""
+    METRICS.reset()
+    monkeypatch.setattr(STATE_SNAPSHOT, "states", {})
+    api = MagicMock()
+    api.get_site.return_value = Site("site", "Home", "armed", "ok", [{"alarm_type": "trespass"}], {})
+    api.get_history.return_value = [
+        {"occurred_at": _occurred_at(60), "message_key": "alarm.trespass", "message_vars": {"siteLabel": "Home"}},
+        {"occurred_at": _occurred_at(600), "message_key": "security.level.armed", "message_vars": {}},
+    ]
+    api.get_devices.return_value = []
+    mqtt_client = Publisher()
+
+    since = time.time() - 300
+    missed = WebsocketCatchUp().run(api, mqtt_client, {"topic_prefix": "prefix"}, ["site"], since, time.monotonic())
+
+    assert missed == 1
+    api.get_site.assert_called_once_with(site_id="site")
+    topics = [topic for topic, _payload in mqtt_client.published]
+    assert topics[0] == "prefix/site/state"
+    assert b"triggered" in mqtt_client.published[0][1]
+    assert STATE_SNAPSHOT.states["prefix/site/state"] == {"security_level": "triggered"}
+    assert "prefix/site/history" in topics
+    assert METRICS.counter("websocket_catchup_events") == 1
+    assert METRICS.snapshot()["latency_ms"]["websocket_catchup"]["count"] == 1
@@ -0,0 +1,62 @@
+"""Tests for the inbound MQTT command workers."""
+
+import threading
+import time
+import zlib
+
+from metrics import METRICS
+from mqtt.commands import CommandPool, command_key
+
+
+def test_command_key_is_site_and_device():
+    """Commands are ordered per site/device, site commands per site."""
+    assert command_key("somfyProtect2mqtt/site/device/sensitivity/command") == "site/device"
+    assert command_key("somfyProtect2mqtt/site/command") == "site/command"
+
+
+def test_command_key_strips_a_multi_level_prefix():
+    """A prefix with a "/" does not put every device of a site behind one key."""
+    assert command_key("home/somfy/site/device/sensitivity/command", "home/somfy") == "site/device"
+    assert command_key("home/somfy/site/other/command", "home/somfy") == "site/other"
+
+
+def test_commands_are_ordered_per_device_and_parallel_across_devices():
+    """A slow device does not hold back another one, and keeps its own commands in order."""
+    METRICS.reset()
+    # Two devices served by different workers
+    shards = {}
+    for index in range(100):
+        shards.setdefault(zlib.crc32(f"site/device-{index}".encode()) % 2, f"site/device-{index}")
+    keys = list(shards.values())
+    done = {key: [] for key in keys}
+    lock = threading.Lock()
+
+    def command(key, index):
+        time.sleep(0.05)
+        with lock:
+            done[key].append(index)
+
+    pool = CommandPool(workers=2)
+    pool.start()
+    start = time.monotonic()
+    for index in range(4):
+        for key in keys:
+            assert pool.submit(key, command, key, index)
+    pool.stop()
+    elapsed = time.monotonic() - start
+
+    assert done == {key: [0, 1, 2, 3] for key in keys}
+    assert elapsed < 0.05 * 8
+    snapshot = METRICS.snapshot()
+    assert snapshot["counters"]["mqtt_commands"] == 8
+    assert snapshot["latency_ms"]["mqtt_command_exec"]["count"] == 8
+    assert snapshot["latency_ms"]["mqtt_command_queue_wait"]["max"] > 0
+
+
+def test_full_worker_queue_drops_instead_of_blocking():
+    """The network thread never waits on an overloaded worker."""
+    pool = CommandPool(workers=1, maxsize=1)
+    assert pool.submit("site/device", time.sleep, 0)
+    assert not pool.submit("site/device", time.sleep, 0)
+    pool.start()
+    pool.stop()
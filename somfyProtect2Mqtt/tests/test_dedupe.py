@@ -0,0 +1,72 @@
+"""Tests for the websocket message_id dedupe."""
+
+from metrics import METRICS
+from somfy_protect.websocket.dedupe import MessageDedupe
+from somfy_protect_2_mqtt import save_persisted_state
+
+
+class Clock:
+    """Settable wall clock."""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_duplicates_are_counted_within_the_window():
+    """A message_id is a duplicate until the window is over."""
+    METRICS.reset()
+    clock = Clock()
+    dedupe = MessageDedupe(window=60, clock=clock)
+    assert not dedupe.seen("a")
+    assert dedupe.seen("a")
+    clock.now += 61
+    assert not dedupe.seen("a")
+    assert METRICS.counter("websocket_messages_duplicate") == 1
+
+
+def test_oldest_message_ids_are_forgotten_first():
+    """The set stays bounded."""
+    dedupe = MessageDedupe(max_size=3, clock=Clock())
+    for message_id in "abcd":
+        assert not dedupe.seen(message_id)
+    assert len(dedupe) == 3
+    assert not dedupe.seen("a")
+    assert dedupe.seen("d")
+
+
+def test_message_ids_survive_a_restart(tmp_path):
+    """A persisted message_id is still a duplicate after a restart, until it expires."""
+    clock = Clock()
+    path = str(tmp_path / "websocket_message_ids.json")
+    dedupe = MessageDedupe(window=60, clock=clock)
+    dedupe.configure(path)
+    dedupe.seen("old")
+    clock.now += 30
+    dedupe.seen("recent")
+    dedupe.save()
+
+    clock.now += 40
+    restarted = MessageDedupe(window=60, clock=clock)
+    restarted.configure(path)
+    assert len(restarted) == 1
+    assert restarted.seen("recent")
+    assert not restarted.seen("old")
+
+
+def test_periodic_save_keeps_message_ids_without_a_clean_close(tmp_path, monkeypatch):
+    """The scheduled save writes the message_ids, a killed process still finds them."""
+    clock = Clock()
+    path = str(tmp_path / "websocket_message_ids.json")
+    dedupe = MessageDedupe(window=60, clock=clock)
+    dedupe.configure(path)
+    monkeypatch.setattr("somfy_protect_2_mqtt.MESSAGE_DEDUPE", dedupe)
+    dedupe.seen("before-crash")
+
+    save_persisted_state()
+
+    restarted = MessageDedupe(window=60, clock=clock)
+    restarted.configure(path)
+    assert restarted.seen("before-crash")
@@ -0,0 +1,90 @@
+"""Tests and microbenchmark for the compiled Home Assistant discovery templates."""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+from homeassistant.discovery_compiler import DiscoveryCompiler
+
+MQTT_CONFIG = {"topic_prefix": "somfyProtect2mqtt", "ha_discover_prefix": "homeassistant"}
+
+DEFINITIONS = [
+    {"type": "box", "device_definition_id": "link", "label": "Link"},
+    {"type": "camera", "device_definition_id": "somfy_indoor_camera", "label": "Indoor Camera"},
+    {"type": "remote", "device_definition_id": "remote", "label": "Key Fob"},
+    {"type": "siren", "device_definition_id": "mss_siren", "label": "Siren"},
+    {"type": "pir", "device_definition_id": "pir", "label": "Myfox Security Infrared Sensor"},
+    {"type": "tag", "device_definition_id": "tag", "label": "IntelliTag"},
+    {"type": "smoke", "device_definition_id": "smoke", "label": "Smoke Detector"},
+    {"type": "videophone", "device_definition_id": "videophone", "label": "Video Doorbell"},
+]
+
+
+def make_device(index: int, device_definition: dict) -> SimpleNamespace:
+    """Return a device with the attributes used by discovery."""
+    return SimpleNamespace(
+        id=f"device-{index}",
+        label=f"Device {index}",
+        version="1.0",
+        update_available=False,
+        device_definition=device_definition,
+        status={"battery_level": 90, "rlink_quality": -60, "temperature": 20, "unknown": 1},
+        settings={"global": {"sensitivity": 5, "night_mode": "automatic"}},
+    )
+
+
+def test_templates_are_filled_in_per_device():
+    """Two devices of one definition share a plan but get their own IDs and topics."""
+    compiler = DiscoveryCompiler()
+    first = compiler.compile_device("site-id", make_device(1, DEFINITIONS[5]), MQTT_CONFIG)
+    second = compiler.compile_device("site-id", make_device(2, DEFINITIONS[5]), MQTT_CONFIG)
+
+    configs = {config["config"]["unique_id"]: config for config, _ in first.configs}
+    assert configs["device-1_sensitivity"]["config"]["max"] == 9
+    assert configs["device-1_sensitivity"]["config"]["command_topic"] == (
+        "somfyProtect2mqtt/site-id/device-1/sensitivity/command"
+    )
+    assert configs["device-1_motion_sensor"]["config"]["device_class"] == "safety"
+    assert configs["device-1_motion_sensor"]["config"]["state_topic"] == "somfyProtect2mqtt/site-id/device-1/pir"
+    assert first.states == [("somfyProtect2mqtt/site-id/device-1/pir", {"motion_sensor": "False"})]
+    assert second.states == [("somfyProtect2mqtt/site-id/device-2/pir", {"motion_sensor": "False"})]
+    assert len(compiler._plans) == 1  # pylint: disable=protected-access
+
+
+def test_camera_plan_adds_command_topics():
+    """Camera plans carry the snapshot entity, the stream subscription and the video backend topic."""
+    discovery = DiscoveryCompiler().compile_device("site-id", make_device(1, DEFINITIONS[1]), MQTT_CONFIG)
+
+    topics = [config["topic"] for config, _ in discovery.configs]
+    assert "homeassistant/camera/site-id_device-1/snapshot/config" in topics
+    assert "homeassistant/switch/site-id_device-1/snapshot/config" in topics
+    assert discovery.topics == ["somfyProtect2mqtt/site-id/device-1/stream"]
+    assert discovery.registrations == ["somfyProtect2mqtt/site-id/device-1/video_backend"]
+
+
+def test_one_plan_per_device_definition():
+    """Devices sharing a definition share its compiled plan."""
+    compiler = DiscoveryCompiler()
+    for index in range(50):
+        compiler.compile_device("site-id", make_device(index, DEFINITIONS[index % len(DEFINITIONS)]), MQTT_CONFIG)
+    assert len(compiler._plans) == len(DEFINITIONS)  # pylint: disable=protected-access
+
+
+@pytest.mark.benchmark
+def test_discovery_of_a_500_device_site(benchmark_report):
+    """Compare filling in compiled templates with compiling them for every device."""
+    devices = [make_device(index, DEFINITIONS[index % len(DEFINITIONS)]) for index in range(500)]
+
+    def run(compiler: DiscoveryCompiler, recompile: bool) -> float:
+        start = time.perf_counter()
+        for device in devices:
+            if recompile:
+                compiler.clear()
+            compiler.compile_device("site-id", device, MQTT_CONFIG)
+        return time.perf_counter() - start
+
+    compiler = DiscoveryCompiler()
+    run(compiler, recompile=False)
+    compiled = min(run(compiler, recompile=False) for _ in range(3))
+    uncached = min(run(DiscoveryCompiler(), recompile=True) for _ in range(3))
+    benchmark_report(f"500 devices: compiled {compiled * 1000:.1f} ms, compiling per device {uncached * 1000:.1f} ms")
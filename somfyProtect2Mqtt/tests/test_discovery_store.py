@@ -0,0 +1,143 @@
+"""Tests for hash-gated Home Assistant discovery publishing."""
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from business import _publish_config, ha_devices_config, remove_discovery_configs
+from business.discovery_store import DiscoveryStore
+from constants import PUBLISH_PRIORITY_STATE
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Return a discovery store persisted in a temporary directory."""
+    discovery_store = DiscoveryStore()
+    discovery_store.configure(str(tmp_path / "discovery_hashes.json"))
+    return discovery_store
+
+
+def test_unchanged_config_is_published_once(store):
+    """A config identical to the published one is skipped."""
+    assert store.should_publish("a/config", {"name": "a", "unique_id": "1"})
+    assert not store.should_publish("a/config", {"unique_id": "1", "name": "a"})
+    assert store.should_publish("a/config", {"name": "renamed", "unique_id": "1"})
+
+
+def test_hashes_survive_a_restart(store, tmp_path):
+    """Persisted hashes keep a restarted bridge from republishing."""
+    store.should_publish("a/config", {"name": "a"})
+    store.save()
+
+    restarted = DiscoveryStore()
+    restarted.configure(str(tmp_path / "discovery_hashes.json"))
+    assert not restarted.should_publish("a/config", {"name": "a"})
+
+
+def test_refresh_returns_vanished_configs(store):
+    """Configs not generated again by a discovery run are returned for removal."""
+    store.should_publish("kept/config", {"name": "kept"})
+    store.should_publish("gone/config", {"name": "gone"})
+
+    store.begin_refresh()
+    store.should_publish("kept/config", {"name": "kept"})
+    assert store.commit_refresh() == ["gone/config"]
+    assert "gone/config" not in store.hashes
+
+
+def test_invalidate_republishes_everything_once(store):
+    """After Home Assistant restarts, the next run publishes every config again."""
+    store.should_publish("a/config", {"name": "a"})
+    store.invalidate()
+    assert store.refresh_requested.is_set()
+
+    store.begin_refresh()
+    assert store.should_publish("a/config", {"name": "a"})
+    store.commit_refresh()
+    assert not store.should_publish("a/config", {"name": "a"})
+
+
+def test_publish_config_is_gated(store, monkeypatch):
+    """Only new or changed discovery configs reach the broker."""
+    monkeypatch.setattr("business.DISCOVERY_STORE", store)
+    mqtt_client = MagicMock()
+    config = {"topic": "homeassistant/sensor/x/config", "config": {"name": "x"}}
+
+    _publish_config(mqtt_client, config)
+    _publish_config(mqtt_client, config)
+    assert mqtt_client.publish.call_count == 1
+
+
+def test_removed_entities_get_an_empty_retained_payload():
+    """Removal clears the retained discovery config."""
+    mqtt_client = MagicMock()
+    remove_discovery_configs(mqtt_client, ["gone/config"])
+    mqtt_client.publish.assert_called_once_with(
+        "gone/config", "", qos=0, retain=True, priority=PUBLISH_PRIORITY_STATE, expiry=None, event_time=None
+    )
+
+
+def _device_api():
+    device = SimpleNamespace(
+        id="device-id",
+        label="Link",
+        version="1.0",
+        update_available=False,
+        device_definition={"label": "Link", "type": "box"},
+        status={},
+        settings={},
+    )
+    api = MagicMock()
+    api.get_devices.return_value = [device]
+    return api
+
+
+def test_device_mode_migrates_entity_configs(store, monkeypatch):
+    """Switching to device discovery hands the entities over, then clears the old topics."""
+    monkeypatch.setattr("business.DISCOVERY_STORE", store)
+    monkeypatch.setattr("business.SUBSCRIBE_TOPICS", set())
+    api = _device_api()
+    mqtt_client = MagicMock()
+    entity_topics = [f"homeassistant/button/site-id_device-id/{action}/config" for action in ["reboot", "halt"]]
+
+    store.begin_refresh()
+    ha_devices_config(api, mqtt_client, {"ha_discover_prefix": "homeassistant"}, ["site-id"])
+    store.commit_refresh()
+    assert [call.args[0] for call in mqtt_client.publish.call_args_list] == entity_topics
+
+    mqtt_client.reset_mock()
+    store.begin_refresh()
+    ha_devices_config(
+        api, mqtt_client, {"ha_discover_prefix": "homeassistant", "discovery_mode": "device"}, ["site-id"]
+    )
+    assert store.commit_refresh() == sorted(entity_topics)
+    published = [(call.args[0], call.args[1]) for call in mqtt_client.publish.call_args_list]
+    assert published[:2] == [(topic, b'{"migrate_discovery":true}') for topic in entity_topics]
+    assert published[2][0] == "homeassistant/device/site-id_device-id/config"
+    assert len(published) == 3
+
+
+def test_first_run_in_device_mode_migrates_and_clears_every_entity_config(store, monkeypatch):
+    """After an upgrade, the store is empty but the broker may retain configs of the previous version."""
+    monkeypatch.setattr("business.DISCOVERY_STORE", store)
+    monkeypatch.setattr("business.SUBSCRIBE_TOPICS", set())
+    mqtt_client = MagicMock()
+    entity_topics = [f"homeassistant/button/site-id_device-id/{action}/config" for action in ["reboot", "halt"]]
+
+    store.begin_refresh()
+    ha_devices_config(
+        _device_api(), mqtt_client, {"ha_discover_prefix": "homeassistant", "discovery_mode": "device"}, ["site-id"]
+    )
+    assert store.commit_refresh() == []
+    published = [(call.args[0], call.args[1]) for call in mqtt_client.publish.call_args_list]
+    assert published[:2] == [(topic, b'{"migrate_discovery":true}') for topic in entity_topics]
+    assert published[2][0] == "homeassistant/device/site-id_device-id/config"
+    assert published[3:] == [(topic, "") for topic in entity_topics]
+
+    mqtt_client.reset_mock()
+    store.begin_refresh()
+    ha_devices_config(
+        _device_api(), mqtt_client, {"ha_discover_prefix": "homeassistant", "discovery_mode": "device"}, ["site-id"]
+    )
+    store.commit_refresh()
+    mqtt_client.publish.assert_not_called()
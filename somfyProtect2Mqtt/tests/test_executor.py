@@ -0,0 +1,112 @@
+"""Tests for the websocket IO lanes."""
+
+import threading
+import time
+
+from business.executor import LANE_ALARM, LANE_CLIP, LANE_SNAPSHOT, IoExecutor, Lane, StreamThreads
+from metrics import METRICS
+from tracing import EVENT_TRACE, EventTrace
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_busy_lane_does_not_hold_back_the_others():
+    """Clip downloads filling their lane do not delay an alarm side-effect."""
+    METRICS.reset()
+    release = threading.Event()
+    calls = []
+    executor = IoExecutor([Lane(LANE_ALARM), Lane(LANE_CLIP, maxsize=2)])
+
+    assert executor.submit(LANE_CLIP, release.wait)
+    assert _wait_for(lambda: executor.depth(LANE_CLIP) == 0)
+    assert executor.submit(LANE_CLIP, calls.append, "clip 1")
+    assert executor.submit(LANE_CLIP, calls.append, "clip 2")
+    assert not executor.submit(LANE_CLIP, calls.append, "clip 3")
+    assert executor.submit(LANE_ALARM, calls.append, "alarm")
+
+    assert _wait_for(lambda: calls == ["alarm"])
+    release.set()
+    assert _wait_for(lambda: calls == ["alarm", "clip 1", "clip 2"])
+    executor.stop()
+    assert METRICS.counter("io_clip_dropped") == 1
+    assert METRICS.counter("io_clip_tasks") == 3
+    assert METRICS.snapshot()["latency_ms"]["io_clip_queue_wait"]["count"] == 3
+
+
+def test_full_media_lane_drops_its_oldest_task():
+    """A newer snapshot replaces the oldest one waiting."""
+    METRICS.reset()
+    release = threading.Event()
+    calls = []
+    executor = IoExecutor([Lane(LANE_SNAPSHOT, maxsize=2, drop_oldest=True)])
+
+    executor.submit(LANE_SNAPSHOT, release.wait)
+    assert _wait_for(lambda: executor.depth(LANE_SNAPSHOT) == 0)
+    for index in range(4):
+        assert executor.submit(LANE_SNAPSHOT, calls.append, index)
+    assert METRICS.gauge("io_snapshot_queue_depth") == 2
+
+    release.set()
+    assert _wait_for(lambda: calls == [2, 3])
+    executor.stop()
+    assert METRICS.counter("io_snapshot_dropped") == 2
+
+
+def test_stop_drops_waiting_tasks():
+    """Tasks still waiting when the executor stops never run."""
+    release = threading.Event()
+    calls = []
+    executor = IoExecutor([Lane(LANE_ALARM)])
+    executor.submit(LANE_ALARM, release.wait)
+    assert _wait_for(lambda: executor.depth(LANE_ALARM) == 0)
+    executor.submit(LANE_ALARM, calls.append, "late")
+
+    executor.stop()
+    release.set()
+    time.sleep(0.05)
+    assert not calls
+    assert not executor.submit(LANE_ALARM, calls.append, "after stop")
+
+
+def test_tasks_run_in_the_context_they_were_submitted_from():
+    """The websocket event behind a task is still traced in its lane."""
+    traces = []
+    executor = IoExecutor([Lane(LANE_ALARM)])
+    trace = EventTrace("device.ring_door_bell", time.monotonic())
+    token = EVENT_TRACE.set(trace)
+    try:
+        executor.submit(LANE_ALARM, lambda: traces.append(EVENT_TRACE.get()))
+    finally:
+        EVENT_TRACE.reset(token)
+    executor.submit(LANE_ALARM, lambda: traces.append(EVENT_TRACE.get()))
+    assert _wait_for(lambda: len(traces) == 2)
+    executor.stop()
+    assert traces == [trace, None]
+
+
+def test_streams_over_the_limit_are_refused():
+    """Each stream runs on its own thread, one more than the limit is refused until one ends."""
+    METRICS.reset()
+    release = {"camera 1": threading.Event(), "camera 2": threading.Event()}
+    streams = StreamThreads(limit=2)
+
+    assert streams.start("camera 1", release["camera 1"].wait)
+    assert streams.start("camera 2", release["camera 2"].wait)
+    assert not streams.start("camera 1", release["camera 1"].wait)
+    assert not streams.start("camera 3", time.sleep, 0)
+    assert streams.active == 2
+    assert METRICS.counter("io_stream_refused") == 1
+
+    release["camera 1"].set()
+    assert _wait_for(lambda: streams.active == 1)
+    assert streams.start("camera 3", time.sleep, 0)
+    release["camera 2"].set()
+    assert _wait_for(lambda: streams.active == 0)
+    streams.stop()
+    assert not streams.start("camera 4", time.sleep, 0)
+    assert METRICS.counter("io_stream_tasks") == 3
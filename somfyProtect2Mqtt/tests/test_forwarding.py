@@ -0,0 +1,64 @@
+"""Tests for the raw websocket event forwarding rules."""
+
+from metrics import METRICS
+from somfy_protect.websocket.forwarding import EventForwarder
+
+STATUS = {
+    "profiles": ["owner", "admin"],
+    "site_id": "site",
+    "key": "device.status",
+    "device_id": "pir",
+    "message_id": "m1",
+    "battery_level": 90,
+    "diagnosis": {"is_everything_ok": True, "problems": []},
+}
+
+
+def test_events_without_rules_are_forwarded_unchanged():
+    """Without rules, or when none matches, events are republished as before."""
+    assert EventForwarder().apply("device.status", "topic", STATUS) == (STATUS, True)
+    forwarder = EventForwarder([{"match": "alarm.*", "retain": False}])
+    assert forwarder.apply("device.status", "topic", STATUS) == (STATUS, True)
+
+
+def test_first_matching_rule_denies_projects_or_slims():
+    """Rules are matched in order on the event key."""
+    METRICS.reset()
+    forwarder = EventForwarder(
+        [
+            {"match": "video.*", "forward": False},
+            {"match": "device.status", "fields": ["device_id", "battery_level", "diagnosis.is_everything_ok"]},
+            {"match": "*", "exclude": ["profiles", "message_id", "diagnosis.problems"], "retain": False},
+            {"match": "presence_in", "forward": False},
+        ]
+    )
+    assert forwarder.apply("video.stream.ready", "topic", {"key": "video.stream.ready"}) is None
+    assert forwarder.apply("device.status", "topic", STATUS) == (
+        {"device_id": "pir", "battery_level": 90, "diagnosis": {"is_everything_ok": True}},
+        True,
+    )
+    payload, retain = forwarder.apply("presence_in", "topic", STATUS)
+    assert not retain
+    assert "profiles" not in payload and "message_id" not in payload
+    assert payload["diagnosis"] == {"is_everything_ok": True}
+    # The event itself, also used by its handler, is left untouched
+    assert "problems" in STATUS["diagnosis"] and "profiles" in STATUS
+    assert METRICS.counter("websocket_events_forward_denied") == 1
+
+
+def test_min_interval_limits_each_topic():
+    """An event is republished again on the same topic only after min_interval."""
+    now = [0.0]
+    forwarder = EventForwarder([{"match": "device.status", "min_interval": 60}], clock=lambda: now[0])
+    assert forwarder.apply("device.status", "site/pir/device.status", STATUS)
+    assert forwarder.apply("device.status", "site/door/device.status", STATUS)
+    now[0] = 30.0
+    assert forwarder.apply("device.status", "site/pir/device.status", STATUS) is None
+    now[0] = 61.0
+    assert forwarder.apply("device.status", "site/pir/device.status", STATUS)
+
+
+def test_invalid_rules_are_ignored():
+    """A rule without a pattern or with an invalid interval does not apply."""
+    forwarder = EventForwarder([{"forward": False}, "device.status", {"match": "*", "min_interval": "often"}])
+    assert forwarder.apply("device.status", "topic", STATUS) == (STATUS, True)
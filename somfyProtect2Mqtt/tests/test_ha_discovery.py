@@ -3,7 +3,7 @@
 from types import SimpleNamespace
 
 import pytest
-from homeassistant.ha_discovery import ha_discovery_alarm
+from homeassistant.ha_discovery import ha_discovery_alarm, ha_discovery_device_bundle, ha_discovery_devices
 
 
 @pytest.fixture
@@ -43,3 +43,28 @@ def test_alarm_discovery_preserves_supported_codes(site, code, expected):
 def test_alarm_discovery_ignores_disabled_or_invalid_codes(site, code):
     """Do not publish disabled or invalid code values."""
     assert "code" not in alarm_config(site, code)
+
+
+def test_device_bundle_collects_entities_as_components():
+    """A device config carries every entity once, with the device info hoisted out."""
+    device = SimpleNamespace(
+        id="device-id",
+        label="Hall",
+        version="1.0",
+        update_available=False,
+        device_definition={"label": "IntelliTag", "type": "tag"},
+    )
+    mqtt_config = {"topic_prefix": "somfyProtect2mqtt", "ha_discover_prefix": "homeassistant"}
+    entity_configs = [
+        ha_discovery_devices("site-id", device, mqtt_config, sensor_name) for sensor_name in ["battery_level", "reboot"]
+    ]
+
+    bundle = ha_discovery_device_bundle("site-id", device, mqtt_config, entity_configs)
+
+    assert bundle["topic"] == "homeassistant/device/site-id_device-id/config"
+    assert bundle["config"]["device"]["identifiers"] == ["device-id"]
+    components = bundle["config"]["components"]
+    assert components["device-id_battery_level"]["platform"] == "sensor"
+    assert components["device-id_reboot"]["platform"] == "button"
+    assert components["device-id_reboot"]["command_topic"] == "somfyProtect2mqtt/site-id/device-id/reboot/command"
+    assert all("device" not in component for component in components.values())
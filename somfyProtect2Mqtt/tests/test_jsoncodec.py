@@ -0,0 +1,99 @@
+"""Tests for the JSON backends."""
+
+import json
+import time
+
+import pytest
+from jsoncodec import BACKENDS, EncodedJSON, JsonCodec, encode_constant
+
+# Shaped like the payloads recorded on a live site
+DEVICE_STATE = {
+    "battery_level": 90,
+    "rlink_quality": -60,
+    "rlink_quality_percent": 66,
+    "temperature": 21.5,
+    "lastStatusAt": "2024-05-01T10:00:00.000000Z",
+    "device_lost": False,
+    "label": "Détecteur salon",
+}
+WEBSOCKET_EVENT = (
+    '{"profiles":["owner","admin"],"site_id":"XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX","type":"alarm",'
+    '"key":"alarm.trespass","device_id":"YYYYYYYYYYYYYYYYYYYYYYYYYYYYYYYY","device_type":"pir",'
+    '"start_at":"2024-05-01T10:00:00.000000Z","start_siren_at":"2024-05-01T10:00:30.000000Z",'
+    '"end_at":"2024-05-01T10:03:00.000000Z","end_siren_at":"2024-05-01T10:03:00.000000Z",'
+    '"manual_alarm":false,"message_id":"ZZZZZZZZ-ZZZZ-ZZZZ-ZZZZ-ZZZZZZZZZZZZ"}'
+)
+DEVICE_LIST = json.dumps(
+    {
+        "items": [
+            {
+                "device_id": f"device-{index}",
+                "label": f"Device {index}",
+                "device_definition": {"device_definition_id": "pir", "label": "Motion Sensor", "type": "pir"},
+                "status": DEVICE_STATE,
+                "settings": {"global": {"sensitivity": 5, "night_mode": "automatic", "user_id": None}},
+                "diagnosis": {"is_everything_ok": True, "problems": []},
+            }
+            for index in range(50)
+        ]
+    }
+).encode("utf8")
+
+
+def installed_backends() -> list[str]:
+    """Return the backends usable here, the standard library included."""
+    return [name for name in BACKENDS if JsonCodec(name).backend == name]
+
+
+@pytest.mark.parametrize("backend", installed_backends())
+def test_backends_write_the_same_json(backend):
+    """Payloads do not change with the backend installed."""
+    codec = JsonCodec(backend)
+    assert codec.dumps(DEVICE_STATE) == json.dumps(DEVICE_STATE, ensure_ascii=False, separators=(",", ":")).encode()
+    assert codec.dumps({1: "a"}) == b'{"1":"a"}'
+    assert codec.dumps({"big": 2**70}) == b'{"big":1180591620717411303424}'
+    assert codec.loads(WEBSOCKET_EVENT) == json.loads(WEBSOCKET_EVENT)
+    assert codec.loads(DEVICE_LIST) == json.loads(DEVICE_LIST)
+    with pytest.raises(ValueError):
+        codec.loads("{not json")
+
+
+def test_missing_backend_falls_back_to_the_standard_library():
+    """An unknown or missing backend does not prevent the bridge from starting."""
+    assert JsonCodec("simdjson").backend == "json"
+    assert JsonCodec("json").backend == "json"
+    assert JsonCodec().backend == installed_backends()[0]
+
+
+def test_constants_are_encoded_once():
+    """A pre-encoded payload is published as is by every backend."""
+    constant = encode_constant({"motion_sensor": "True"})
+    assert isinstance(constant, EncodedJSON)
+    assert constant == b'{"motion_sensor":"True"}'
+    for backend in installed_backends():
+        assert JsonCodec(backend).dumps(constant) is constant
+
+
+@pytest.mark.benchmark
+def test_serialization_benchmark(benchmark_report):
+    """Compare the installed backends on recorded payloads."""
+    for backend in installed_backends():
+        codec = JsonCodec(backend)
+        start = time.perf_counter()
+        for _ in range(2000):
+            codec.loads(WEBSOCKET_EVENT)
+            codec.dumps(DEVICE_STATE)
+        events = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(50):
+            codec.loads(DEVICE_LIST)
+        devices = time.perf_counter() - start
+        benchmark_report(
+            f"{backend}: 2000 events+states {events * 1000:.1f} ms, 50 device lists {devices * 1000:.1f} ms"
+        )
+    constant = encode_constant({"motion_sensor": "True"})
+    codec = JsonCodec()
+    start = time.perf_counter()
+    for _ in range(2000):
+        codec.dumps(constant)
+    benchmark_report(f"2000 pre-encoded payloads {(time.perf_counter() - start) * 1000:.2f} ms")
@@ -0,0 +1,122 @@
+"""Tests for the websocket recording and load generator."""
+
+import json
+import threading
+
+from somfy_protect.websocket import recording
+from somfy_protect.websocket.loadgen import LoadHarness, recorded_events, storm_events
+from somfy_protect.websocket.recording import REDACTED, WebsocketRecorder, read_recording
+
+EVENTS = [
+    '{"site_id":"site","key":"device.ring_door_bell","device_id":"door","message_id":"m1",'
+    '"snapshot_url":"https://example.com/snapshot.jpg?token=secret","label":"Front door"}',
+    "websocket.connection.ready",
+    '{"site_id":"site","key":"device.status","device_id":"pir","message_id":"m2",'
+    '"diagnosis":{"problems":[{"device_id":"door"}]}}',
+]
+
+
+def _record(path, max_events=100):
+    now = [10.0]
+    recorder = WebsocketRecorder(str(path), max_events=max_events, clock=lambda: now[0])
+    for message in EVENTS:
+        now[0] += 0.5
+        recorder.record(message)
+    recorder.close()
+
+
+def test_recording_is_redacted(tmp_path):
+    """Identifiers are hashed consistently, URLs and names dropped, control messages kept."""
+    path = tmp_path / "record.jsonl.gz"
+    _record(path)
+    recorded = list(read_recording(str(path)))
+
+    assert [offset for offset, _ in recorded] == [0.5, 1.0, 1.5]
+    ring = json.loads(recorded[0][1])
+    status = json.loads(recorded[2][1])
+    assert recorded[1][1] == "websocket.connection.ready"
+    assert ring["snapshot_url"] == REDACTED and ring["label"] == REDACTED
+    assert ring["site_id"] == status["site_id"] != "site"
+    assert status["diagnosis"]["problems"][0]["device_id"] == ring["device_id"] != "door"
+    assert ring["message_id"] != status["message_id"]
+    assert "secret" not in path.read_bytes().decode("latin-1")
+
+
+def test_recording_stops_at_max_events(tmp_path):
+    """A recording does not grow past its limit."""
+    path = tmp_path / "record.jsonl.gz"
+    _record(path, max_events=2)
+    assert len(list(read_recording(str(path)))) == 2
+
+
+def test_recording_keeps_the_runs_before_a_restart(tmp_path):
+    """A second recorder on the same file appends its run after the first one."""
+    path = tmp_path / "record.jsonl.gz"
+    _record(path)
+    _record(path)
+    recorded = list(read_recording(str(path)))
+
+    assert [offset for offset, _ in recorded] == [0.5, 1.0, 1.5, 2.0, 2.5, 3.0]
+    assert [message for _, message in recorded].count("websocket.connection.ready") == 2
+
+
+def test_truncated_recording_is_set_aside_before_appending(tmp_path):
+    """A run that was not closed cleanly does not make the next ones unreadable."""
+    path = tmp_path / "record.jsonl.gz"
+    _record(path)
+    path.write_bytes(path.read_bytes()[:-12])
+    _record(path)
+
+    assert len(list(read_recording(str(path)))) == 3
+    assert len(list(tmp_path.glob("record.jsonl.gz.*"))) == 1
+
+
+def test_personal_fields_are_redacted():
+    """Names, titles and contact details of users are not recorded."""
+    user = {"name": "Jane", "title": "Ms", "email": "jane@example.com", "phone": "+33600000000"}
+    assert recording.redact({"user": user}, b"salt") == {"user": dict.fromkeys(user, REDACTED)}
+
+
+def test_recording_is_written_off_the_caller_thread(tmp_path, monkeypatch):
+    """Messages over the limit are not decoded, the others are redacted on the writer thread."""
+    threads = []
+    original = recording.redact
+
+    def redact(value, salt):
+        threads.append(threading.current_thread().name)
+        return original(value, salt)
+
+    monkeypatch.setattr("somfy_protect.websocket.recording.redact", redact)
+    path = tmp_path / "record.jsonl.gz"
+    recorder = WebsocketRecorder(str(path), max_events=1)
+    recorder.record(EVENTS[0])
+    recorder.record(EVENTS[2])
+    assert recorder.events == 1
+    recorder.close()
+    assert threads and set(threads) == {"websocket-recorder"}
+    assert len(list(read_recording(str(path)))) == 1
+
+
+def test_storm_is_spread_over_the_devices():
+    """A storm sends rate events per second, round-robin over the devices."""
+    events = list(storm_events(rate=200, devices=50, duration=2))
+    assert len(events) == 400
+    assert events[1][0] == 0.005
+    devices = {json.loads(message)["device_id"] for _, message in events}
+    assert len(devices) == 50
+
+
+def test_replay_reports_throughput_drops_and_backlog(tmp_path):
+    """Each loop of a recording is handled, and the run is reported."""
+    path = tmp_path / "record.jsonl.gz"
+    _record(path)
+    events = list(recorded_events(str(path), loops=3))
+    assert len({json.loads(message)["message_id"] for _, message in events if message.startswith("{")}) == 6
+
+    report = LoadHarness(io_latency=0, broker_latency=0).run(events, speed=0)
+    assert report["events"] == 9
+    assert report["io_dropped"] == {}
+    # Retained states of one topic may be coalesced while queued: each message is published or superseded
+    assert report["mqtt_published"] + report["mqtt_coalesced"] == 12
+    assert report["mqtt_published"] >= 4
+    assert report["event_publish_ms"]["device.status"]["count"] >= 1
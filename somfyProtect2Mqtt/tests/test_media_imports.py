@@ -0,0 +1,79 @@
+"""Tests for the lazily loaded media stacks.
+
+Each measurement runs in a fresh interpreter so that modules imported by other
+tests do not leak into it.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = """
+import json, resource, sys
+import main
+{extra}
+from business.media import loaded_media_modules
+print(json.dumps({{
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "media": loaded_media_modules(),
+}}))
+"""
+
+
+def _import_times(code: str) -> dict:
+    """Return the cumulative import time, in microseconds, of each top-level import of code."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=120,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _self, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented, their time is part of their parent's
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def _measure(extra: str = "") -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(extra=extra)],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=120,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_bridge_imports_without_media_stacks():
+    """Importing the whole bridge loads none of the media libraries."""
+    lean = _measure()
+    assert lean["media"] == []
+
+
+def test_media_stacks_load_on_first_use():
+    """The WebRTC stack is only paid for once it is actually needed, and costs more than the lean baseline."""
+    lean = _measure()
+    media = _measure("import somfy_protect.webrtc_handler")
+    assert {"av", "aiortc", "PIL"} <= set(media["media"])
+    assert lean["max_rss_kb"] < media["max_rss_kb"]
+
+
+def test_lazy_media_imports_cut_the_startup_import_time(benchmark_report):
+    """The bridge imports faster than it did with the media stacks imported eagerly."""
+    lean = _import_times("import main")
+    eager = _import_times("import main; import somfy_protect.webrtc_handler")
+    eager_us = eager["main"] + eager["somfy_protect.webrtc_handler"]
+    benchmark_report(f"import main {lean['main'] / 1000:.0f} ms, with the media stacks {eager_us / 1000:.0f} ms")
+    assert lean["main"] < eager_us
@@ -0,0 +1,128 @@
+"""Tests for the MQTT client connection handling."""
+
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import paho.mqtt.client as mqtt
+import pytest
+from metrics import METRICS
+from mqtt import MQTTClient
+
+MQTT_CONFIG = {"host": "broker", "topic_prefix": "somfyProtect2mqtt", "reconnect_max_delay": 30}
+
+
+@pytest.fixture
+def mqtt_client(monkeypatch):
+    """Return an MQTT client on a mocked paho client."""
+    METRICS.reset()
+    monkeypatch.setattr("mqtt.mqtt.Client", MagicMock())
+    client = MQTTClient(config=MQTT_CONFIG, api=MagicMock())
+    yield client
+    client.shutdown()
+
+
+def test_last_will_and_reconnect_backoff_are_set_before_connecting(mqtt_client):
+    """paho reconnects by itself, and the broker announces the bridge offline if it dies."""
+    paho = mqtt_client.client
+    paho.reconnect_delay_set.assert_called_once_with(min_delay=1, max_delay=30)
+    paho.will_set.assert_called_once_with("somfyProtect2mqtt/bridge/availability", "offline", qos=1, retain=True)
+    calls = [call[0] for call in paho.method_calls]
+    assert calls.index("will_set") < calls.index("connect")
+
+
+def test_disconnection_never_blocks_the_network_thread(mqtt_client):
+    """on_disconnect returns at once, leaving the reconnection to paho."""
+    start = time.monotonic()
+    mqtt_client.on_disconnect(mqtt_client.client, None, 7)
+    assert time.monotonic() - start < 0.1
+    mqtt_client.client.reconnect.assert_not_called()
+    assert METRICS.gauge("mqtt_connected") == 0
+    assert METRICS.counter("mqtt_disconnects") == 1
+
+    mqtt_client.on_connect(mqtt_client.client, None, {}, 0)
+    mqtt_client.client.publish.assert_any_call("somfyProtect2mqtt/bridge/availability", "online", qos=1, retain=True)
+    assert METRICS.gauge("mqtt_connected") == 1
+    assert METRICS.snapshot()["latency_ms"]["mqtt_reconnect_duration"]["count"] == 1
+
+
+def test_commands_run_off_the_network_thread(mqtt_client, monkeypatch):
+    """on_message hands commands to the workers instead of calling the Somfy API itself."""
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_consume(**_kwargs):
+        started.set()
+        release.wait(2)
+
+    monkeypatch.setattr("mqtt.consume_mqtt_message", slow_consume)
+    message = SimpleNamespace(topic="somfyProtect2mqtt/site/device/reboot/command", payload=b"reboot")
+    start = time.monotonic()
+    mqtt_client.on_message(mqtt_client.client, None, message)
+    assert time.monotonic() - start < 0.1
+    assert started.wait(2)
+    release.set()
+
+
+def test_mqtt_v5_falls_back_to_mqtt_3_1_1(monkeypatch):
+    """A broker refusing MQTT v5 gets a new MQTT 3.1.1 client."""
+    refused, fallback = MagicMock(), MagicMock()
+    paho_client = MagicMock(side_effect=[refused, fallback])
+    monkeypatch.setattr("mqtt.mqtt.Client", paho_client)
+    client = MQTTClient(config={**MQTT_CONFIG, "protocol": 5}, api=MagicMock())
+    assert paho_client.call_args.kwargs["protocol"] == mqtt.MQTTv5
+    assert "clean_start" not in refused.connect.call_args.kwargs
+    assert client.publisher.properties is not None
+
+    client.on_connect(refused, None, {}, SimpleNamespace(value=132), None)
+    refused.loop_stop.assert_called_once()
+    assert paho_client.call_args.kwargs["protocol"] == mqtt.MQTTv311
+    assert client.client is client.publisher.client is fallback
+    fallback.will_set.assert_called_once()
+    fallback.connect_async.assert_called_once_with("broker", 1883, 60)
+    fallback.loop_start.assert_called_once()
+    assert client.publisher.properties is None
+    client.shutdown()
+
+
+def test_clean_mqtt_v5_disconnection_is_not_unexpected(monkeypatch):
+    """With MQTT v5, paho passes the properties after the reason code."""
+    METRICS.reset()
+    monkeypatch.setattr("mqtt.mqtt.Client", MagicMock())
+    client = MQTTClient(config={**MQTT_CONFIG, "protocol": 5}, api=MagicMock())
+    client.on_disconnect(client.client, None, SimpleNamespace(value=0), None)
+    assert METRICS.counter("mqtt_disconnects") == 0
+    client.on_disconnect(client.client, None, SimpleNamespace(value=142), None)
+    assert METRICS.counter("mqtt_disconnects") == 1
+    client.shutdown()
+
+
+def test_clean_session_by_default(monkeypatch):
+    """Without persistent_session, no command is queued by the broker while the bridge is offline."""
+    store = MagicMock()
+    paho_client = MagicMock()
+    monkeypatch.setattr("mqtt.DISCOVERY_STORE", store)
+    monkeypatch.setattr("mqtt.mqtt.Client", paho_client)
+    client = MQTTClient(config=MQTT_CONFIG, api=MagicMock())
+    assert paho_client.call_args.kwargs["clean_session"] is True
+
+    client.on_connect(client.client, None, {"session present": 0}, 0)
+    store.invalidate.assert_not_called()
+    client.shutdown()
+
+
+def test_new_mqtt_session_republishes_discovery(monkeypatch):
+    """A broker that lost the persistent session of the bridge may have lost its retained discovery configs too."""
+    store = MagicMock()
+    paho_client = MagicMock()
+    monkeypatch.setattr("mqtt.DISCOVERY_STORE", store)
+    monkeypatch.setattr("mqtt.mqtt.Client", paho_client)
+    client = MQTTClient(config={**MQTT_CONFIG, "persistent_session": True}, api=MagicMock())
+    assert paho_client.call_args.kwargs["clean_session"] is False
+
+    client.on_connect(client.client, None, {"session present": 1}, 0)
+    store.invalidate.assert_not_called()
+    client.on_connect(client.client, None, {"session present": 0}, 0)
+    store.invalidate.assert_called_once()
+    client.shutdown()
@@ -0,0 +1,60 @@
+"""Tests for the MQTT v5 publish properties."""
+
+# pylint: disable=no-member
+
+from constants import PUBLISH_PRIORITY_ALARM, PUBLISH_PRIORITY_FRAME, PUBLISH_PRIORITY_STATE
+from mqtt.properties import PublishProperties, mqtt_protocol_version
+
+
+def test_protocol_defaults_to_mqtt_3_1_1():
+    """MQTT v5 is opt-in."""
+    assert mqtt_protocol_version({}) == 4
+    assert mqtt_protocol_version({"protocol": "3.1.1"}) == 4
+    assert mqtt_protocol_version({"protocol": 5}) == 5
+
+
+def test_frames_use_topic_aliases_within_the_broker_limit():
+    """The alias alone replaces a frame topic once the broker knows it, until the next connection."""
+    properties = PublishProperties()
+    properties.reset(alias_maximum=2)
+
+    topic, first = properties.build("prefix/site/camera-1/snapshot", 0, PUBLISH_PRIORITY_FRAME)
+    assert (topic, first.TopicAlias) == ("prefix/site/camera-1/snapshot", 1)
+    topic, again = properties.build("prefix/site/camera-1/snapshot", 0, PUBLISH_PRIORITY_FRAME)
+    assert (topic, again.TopicAlias) == ("", 1)
+    # QoS 1/2 messages may be re-sent on another connection, they keep their topic
+    topic, snapshot = properties.build("prefix/site/camera-1/snapshot", 2, PUBLISH_PRIORITY_FRAME)
+    assert (topic, snapshot.TopicAlias) == ("prefix/site/camera-1/snapshot", 1)
+    assert properties.build("prefix/site/camera-2/snapshot", 0, PUBLISH_PRIORITY_FRAME)[1].TopicAlias == 2
+    assert properties.build("prefix/site/camera-3/snapshot", 0, PUBLISH_PRIORITY_FRAME) == (
+        "prefix/site/camera-3/snapshot",
+        None,
+    )
+    assert properties.build("prefix/site/state", 0, PUBLISH_PRIORITY_STATE) == ("prefix/site/state", None)
+
+    properties.reset(alias_maximum=2)
+    assert properties.build("prefix/site/camera-1/snapshot", 0, PUBLISH_PRIORITY_FRAME)[0] != ""
+
+
+def test_expiry_and_event_time():
+    """Stale pulses expire on the broker, and event messages carry their timestamps."""
+    properties = PublishProperties(topic_aliases=False)
+    properties.reset(alias_maximum=10)
+    topic, pulse = properties.build(
+        "prefix/site/device/pir", 1, PUBLISH_PRIORITY_ALARM, expiry=29.2, event_time="2024-05-01T10:00:00Z"
+    )
+    assert topic == "prefix/site/device/pir"
+    assert pulse.MessageExpiryInterval == 30
+    assert not hasattr(pulse, "TopicAlias")
+    user_properties = dict(pulse.UserProperty)
+    assert user_properties["event_time"] == "2024-05-01T10:00:00Z"
+    assert user_properties["sent_at"].endswith("+00:00")
+
+
+def test_event_properties_can_be_disabled():
+    """Without event properties, only the expiry goes along with the message."""
+    properties = PublishProperties(event_properties=False)
+    properties.reset(alias_maximum=0)
+    _topic, pulse = properties.build("prefix/site/device/pir", 1, PUBLISH_PRIORITY_ALARM, expiry=3, event_time="t0")
+    assert pulse.MessageExpiryInterval == 3
+    assert not hasattr(pulse, "UserProperty")
@@ -0,0 +1,205 @@
+"""Tests for the bounded MQTT publisher."""
+
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import paho.mqtt.client as mqtt
+import pytest
+from constants import PUBLISH_PRIORITY_ALARM, PUBLISH_PRIORITY_FRAME, PUBLISH_PRIORITY_STATE
+from metrics import METRICS
+from mqtt.properties import PublishProperties
+from mqtt.publisher import MqttPublisher
+from tracing import EVENT_TRACE, EventTrace
+
+
+class FakeClient:
+    """paho client recording publishes, acknowledged by the test."""
+
+    def __init__(self):
+        self.published = []
+        self.mid = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Record a publish and return its message info."""
+        self.mid += 1
+        self.published.append((topic, payload, qos, retain))
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=self.mid)
+
+
+def wait_for(predicate, timeout: float = 2.0) -> None:
+    """Wait for the drain thread to reach a state."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    """Start every test with empty metrics."""
+    METRICS.reset()
+
+
+@pytest.fixture
+def client():
+    """Return a fake paho client."""
+    return FakeClient()
+
+
+def test_queued_retained_messages_are_coalesced(client):
+    """Only the latest retained payload of a topic goes out after an outage."""
+    publisher = MqttPublisher(client)
+    for level in ["armed", "partial", "disarmed"]:
+        publisher.publish("site/state", level, retain=True)
+    publisher.publish("site/event", "a")
+    publisher.publish("site/event", "b")
+    assert publisher.depth == 3
+
+    publisher.start()
+    publisher.set_connected(True)
+    wait_for(lambda: len(client.published) == 3)
+    publisher.stop()
+
+    assert [payload for _, payload, _, _ in client.published] == ["disarmed", "a", "b"]
+    assert METRICS.counter("mqtt_publish_coalesced") == 2
+
+
+def test_coalesced_message_does_not_overtake_later_ones(client):
+    """A coalesced retained message is queued again after the messages queued since."""
+    publisher = MqttPublisher(client)
+    publisher.publish("device/state", "old", retain=True, priority=PUBLISH_PRIORITY_FRAME)
+    publisher.publish("device/other", "other", retain=True, priority=PUBLISH_PRIORITY_STATE)
+    publisher.publish("device/state", "new", retain=True, priority=PUBLISH_PRIORITY_STATE)
+    assert publisher.depth == 2
+
+    publisher.start()
+    publisher.set_connected(True)
+    wait_for(lambda: len(client.published) == 2)
+    publisher.stop()
+
+    assert [payload for _, payload, _, _ in client.published] == ["other", "new"]
+
+
+def test_retained_alarm_transitions_are_all_delivered(client):
+    """A triggered state queued during an outage still goes out when followed by a disarm."""
+    publisher = MqttPublisher(client)
+    publisher.publish("site/state", "triggered", retain=True, priority=PUBLISH_PRIORITY_ALARM)
+    publisher.publish("site/state", "disarmed", retain=True, priority=PUBLISH_PRIORITY_ALARM)
+    assert publisher.depth == 2
+
+    publisher.start()
+    publisher.set_connected(True)
+    wait_for(lambda: len(client.published) == 2)
+    publisher.stop()
+
+    assert [payload for _, payload, _, _ in client.published] == ["triggered", "disarmed"]
+    assert METRICS.counter("mqtt_publish_coalesced") == 0
+
+
+def test_full_queue_drops_frames_before_states_before_alarms(client):
+    """Overload sheds the least important messages first."""
+    publisher = MqttPublisher(client, max_size=2)
+    assert publisher.publish("frame", b"jpeg", priority=PUBLISH_PRIORITY_FRAME)
+    assert publisher.publish("state", "s", priority=PUBLISH_PRIORITY_STATE)
+    assert publisher.publish("alarm/1", "triggered", priority=PUBLISH_PRIORITY_ALARM)
+    assert publisher.publish("alarm/2", "triggered", priority=PUBLISH_PRIORITY_ALARM)
+    assert not publisher.publish("frame", b"jpeg", priority=PUBLISH_PRIORITY_FRAME)
+
+    publisher.start()
+    publisher.set_connected(True)
+    wait_for(lambda: len(client.published) == 2)
+    publisher.stop()
+
+    assert [topic for topic, _, _, _ in client.published] == ["alarm/1", "alarm/2"]
+    assert METRICS.counter("mqtt_publish_dropped_frame") == 2
+    assert METRICS.counter("mqtt_publish_dropped_state") == 1
+
+
+def test_inflight_limit_applies_backpressure(client):
+    """No more than max_inflight messages per QoS wait for their acknowledgement."""
+    publisher = MqttPublisher(client, max_inflight={1: 2})
+    publisher.start()
+    publisher.set_connected(True)
+    for index in range(5):
+        publisher.publish(f"topic/{index}", "x", qos=1)
+
+    wait_for(lambda: len(client.published) == 2)
+    time.sleep(0.05)
+    assert len(client.published) == 2
+    assert METRICS.gauge("mqtt_publish_inflight_qos1") == 2
+
+    publisher.on_publish(1)
+    wait_for(lambda: len(client.published) == 3)
+    for mid in range(2, 6):
+        publisher.on_publish(mid)
+    wait_for(lambda: len(client.published) == 5)
+    wait_for(lambda: METRICS.gauge("mqtt_publish_inflight_qos1") == 0)
+    publisher.stop()
+
+    assert METRICS.gauge("mqtt_publish_queue_depth") == 0
+    assert METRICS.snapshot()["latency_ms"]["mqtt_publish_latency"]["count"] == 5
+
+
+def test_stale_messages_are_dropped():
+    """A message past its expiry is not sent once the broker is back."""
+    now = [0.0]
+    client = FakeClient()
+    publisher = MqttPublisher(client, clock=lambda: now[0])
+    publisher.publish("camera/snapshot", b"old", priority=PUBLISH_PRIORITY_FRAME, expiry=5)
+    publisher.publish("site/state", "armed", retain=True)
+    now[0] = 10.0
+    publisher.start()
+    publisher.set_connected(True)
+    wait_for(lambda: len(client.published) == 1)
+    publisher.stop()
+
+    assert [topic for topic, _, _, _ in client.published] == ["site/state"]
+    assert METRICS.counter("mqtt_publish_expired") == 1
+
+
+def test_mqtt_v5_properties_are_sent():
+    """With MQTT v5 the remaining expiry and the event time go along with the message."""
+    now = [0.0]
+    client = MagicMock()
+    client.publish.return_value = SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=1)
+    properties = PublishProperties()
+    properties.reset(alias_maximum=0)
+    publisher = MqttPublisher(client, properties=properties, clock=lambda: now[0])
+    publisher.publish("site/device/pir", b"{}", priority=PUBLISH_PRIORITY_ALARM, expiry=30, event_time="t0")
+    now[0] = 12.0
+    publisher.start()
+    publisher.set_connected(True)
+    wait_for(lambda: client.publish.called)
+    publisher.stop()
+
+    sent = client.publish.call_args.kwargs["properties"]
+    assert sent.MessageExpiryInterval == 18
+    assert ("event_time", "t0") in sent.UserProperty
+
+
+def test_event_publishes_are_traced_to_the_ack():
+    """A message published while handling an event records its latency once acknowledged."""
+    client = MagicMock()
+    client.publish.return_value = SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=1)
+    properties = PublishProperties()
+    properties.reset(alias_maximum=0)
+    publisher = MqttPublisher(client, properties=properties)
+    token = EVENT_TRACE.set(EventTrace("alarm.trespass", time.monotonic() - 0.02, "2024-05-01T10:00:00Z"))
+    try:
+        publisher.publish("site/state", b"{}", qos=1, retain=True, priority=PUBLISH_PRIORITY_ALARM)
+    finally:
+        EVENT_TRACE.reset(token)
+    publisher.start()
+    publisher.set_connected(True)
+    wait_for(lambda: client.publish.called)
+    assert "event_publish" not in METRICS.snapshot()["histograms_ms"]
+    publisher.on_publish(1)
+    publisher.stop()
+
+    assert ("event_time", "2024-05-01T10:00:00Z") in client.publish.call_args.kwargs["properties"].UserProperty
+    histogram = METRICS.snapshot()["histograms_ms"]["event_publish"]["alarm.trespass"]
+    assert histogram["count"] == 1
+    assert histogram["avg"] >= 20
+    assert histogram["buckets"]["10"] == 0
+    assert histogram["buckets"]["+Inf"] == 1
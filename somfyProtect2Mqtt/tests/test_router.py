@@ -0,0 +1,110 @@
+"""Tests for the command topic router."""
+
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import business.mqtt as business_mqtt
+import pytest
+from business.router import TopicRouter
+
+
+def test_most_specific_pattern_wins():
+    """Exact levels beat + and + beats #, with a fallback when the specific branch fails."""
+    router = TopicRouter()
+    router.add("prefix/+/+/+/command", "entity")
+    router.add("prefix/+/+/snapshot/command", "snapshot")
+    router.add("prefix/+/command", "site")
+    router.add("prefix/#", "any")
+
+    assert router.match("prefix/site/device/snapshot/command") == "snapshot"
+    assert router.match("prefix/site/device/sensitivity/command") == "entity"
+    assert router.match("prefix/site/command") == "site"
+    assert router.match("prefix/site/device/snapshot/state") == "any"
+    assert router.match("prefix") == "any"
+    assert router.match("other/site/command") is None
+    assert router.patterns == [
+        "prefix/+/+/+/command",
+        "prefix/+/+/snapshot/command",
+        "prefix/+/command",
+        "prefix/#",
+    ]
+    with pytest.raises(ValueError):
+        router.add("prefix/#/command", "invalid")
+
+
+def test_command_topics_are_covered_by_the_wildcards():
+    """Site, siren and entity command topics are routed, the bridge states are not."""
+    business_mqtt.configure_command_routes("somfyProtect2mqtt")
+    assert business_mqtt.command_subscriptions() == [
+        "somfyProtect2mqtt/+/command",
+        "somfyProtect2mqtt/+/+/command",
+        "somfyProtect2mqtt/+/+/+/command",
+    ]
+    assert business_mqtt.is_command_topic("somfyProtect2mqtt/site/command")
+    assert business_mqtt.is_command_topic("somfyProtect2mqtt/site/siren/command")
+    assert business_mqtt.is_command_topic("somfyProtect2mqtt/site/device/sensitivity/command")
+    assert not business_mqtt.is_command_topic("somfyProtect2mqtt/site/device/state")
+    assert not business_mqtt.is_command_topic("other/site/command")
+
+
+def _consume(api, topic, payload):
+    msg = SimpleNamespace(topic=topic, payload=payload.encode())
+    business_mqtt.consume_mqtt_message(msg, {}, api, MagicMock())
+
+
+def test_each_topic_shape_has_its_handler(monkeypatch):
+    """Site, siren, device, snapshot and entity topics are each handled by their own route."""
+    business_mqtt.configure_command_routes("somfyProtect2mqtt")
+    router, routes = business_mqtt.COMMAND_ROUTER, business_mqtt.COMMAND_ROUTES
+    assert router.match("somfyProtect2mqtt/site/command") is routes["+/command"]
+    assert router.match("somfyProtect2mqtt/site/siren/command") is routes["+/siren/command"]
+    assert router.match("somfyProtect2mqtt/site/device/command") is routes["+/+/command"]
+    assert router.match("somfyProtect2mqtt/site/device/snapshot/command") is routes["+/+/snapshot/command"]
+    assert router.match("somfyProtect2mqtt/site/device/sensitivity/command") is routes["+/+/+/command"]
+
+    settings_writer = MagicMock()
+    monkeypatch.setattr(business_mqtt, "SETTINGS_WRITER", settings_writer)
+    monkeypatch.setattr(business_mqtt, "_refresh_site_later", MagicMock())
+    api = MagicMock()
+    _consume(api, "somfyProtect2mqtt/site/command", "armed")
+    api.update_security_level.assert_called_once()
+    _consume(api, "somfyProtect2mqtt/site/siren/command", "PANIC")
+    api.trigger_alarm.assert_called_once_with(site_id="site", mode="alarm")
+    _consume(api, "somfyProtect2mqtt/site/device/video_backend/command", "webrtc")
+    api.action_device.assert_called_once_with(
+        site_id="site", device_id="device", action="change_video_backend", video_backend="webrtc"
+    )
+    _consume(api, "somfyProtect2mqtt/site/device/sensitivity/command", "50")
+    assert settings_writer.set.call_args.args[1:5] == ("site", "device", "sensitivity", "50")
+
+
+def test_payloads_do_not_cross_topic_shapes(monkeypatch):
+    """A site payload on an entity topic is a setting, a setting on a site topic is ignored."""
+    settings_writer = MagicMock()
+    monkeypatch.setattr(business_mqtt, "SETTINGS_WRITER", settings_writer)
+    api = MagicMock()
+
+    _consume(api, "somfyProtect2mqtt/site/device/siren_mode/command", "stop")
+    _consume(api, "somfyProtect2mqtt/site/command", "not_a_command")
+    _consume(api, "somfyProtect2mqtt/site/device/state", "armed")
+
+    api.stop_alarm.assert_not_called()
+    api.update_security_level.assert_not_called()
+    settings_writer.set.assert_called_once()
+
+
+@pytest.mark.benchmark
+def test_command_routing_benchmark(benchmark_report):
+    """Measure routing the command topics of a 500 device site through the real route table."""
+    business_mqtt.configure_command_routes("somfyProtect2mqtt")
+    topics = ["somfyProtect2mqtt/site/command", "somfyProtect2mqtt/site/siren/command"]
+    for index in range(500):
+        device = f"somfyProtect2mqtt/site/device-{index}"
+        topics += [f"{device}/command", f"{device}/snapshot/command", f"{device}/sensitivity/command"]
+
+    start = time.perf_counter()
+    for topic in topics:
+        assert business_mqtt.COMMAND_ROUTER.match(topic) is not None
+    elapsed = time.perf_counter() - start
+    benchmark_report(f"{len(topics)} command topics routed in {elapsed * 1000:.2f} ms")
@@ -0,0 +1,90 @@
+"""Tests for the delayed refresh scheduler."""
+
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import business.mqtt as business_mqtt
+from business.scheduler import DelayedTaskScheduler
+from metrics import METRICS
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_pending_task_with_same_key_is_coalesced():
+    """A task scheduled while another with the same key is pending runs once, with the latest arguments."""
+    METRICS.reset()
+    calls = []
+    scheduler = DelayedTaskScheduler()
+    assert scheduler.schedule("device", 0.05, calls.append, "first")
+    assert not scheduler.schedule("device", 0.05, calls.append, "second")
+    assert scheduler.schedule("other", 0.0, calls.append, "other")
+
+    assert _wait_for(lambda: len(calls) == 2)
+    time.sleep(0.1)
+    scheduler.stop()
+
+    assert calls == ["other", "second"]
+    assert METRICS.counter("scheduler_tasks_coalesced") == 1
+    assert METRICS.counter("scheduler_tasks_run") == 2
+
+
+def test_rescheduled_task_is_pushed_back_by_each_merge():
+    """With reschedule, a merged task runs its delay after the last merge, once."""
+    calls = []
+    scheduler = DelayedTaskScheduler()
+    started = time.monotonic()
+    assert scheduler.schedule("device", 0.2, calls.append, "first", reschedule=True)
+    time.sleep(0.15)
+    assert not scheduler.schedule("device", 0.2, calls.append, "second", reschedule=True)
+    time.sleep(0.15)
+    assert calls == []
+
+    assert _wait_for(lambda: calls)
+    elapsed = time.monotonic() - started
+    time.sleep(0.1)
+    scheduler.stop()
+
+    assert calls == ["second"]
+    assert elapsed >= 0.35
+
+
+def test_failing_task_does_not_stop_the_scheduler():
+    """An exception in one task is logged, later tasks still run."""
+    calls = []
+    scheduler = DelayedTaskScheduler()
+    scheduler.schedule("failing", 0.0, lambda: 1 / 0)
+    scheduler.schedule("next", 0.01, calls.append, "next")
+
+    assert _wait_for(lambda: calls == ["next"])
+    scheduler.stop()
+
+
+def test_command_burst_uses_one_thread_and_one_refresh(monkeypatch):
+    """A burst of commands refreshes the device once, without a thread per command."""
+    scheduler = DelayedTaskScheduler()
+    monkeypatch.setattr(business_mqtt, "REFRESH_SCHEDULER", scheduler)
+    monkeypatch.setattr(business_mqtt, "REFRESH_DELAY", 0.1)
+    monkeypatch.setattr(business_mqtt, "publish_device_state", MagicMock())
+    api = MagicMock()
+    threads_before = threading.active_count()
+
+    for index in range(20):
+        action = "shutter_open" if index % 2 else "shutter_close"
+        msg = SimpleNamespace(topic="somfyProtect2mqtt/site/device/command", payload=action.encode())
+        business_mqtt.consume_mqtt_message(msg, {}, api, MagicMock())
+    threads_during_burst = threading.active_count()
+
+    assert _wait_for(lambda: api.get_device.call_count == 1)
+    time.sleep(0.2)
+    scheduler.stop()
+
+    assert api.action_device.call_count == 20
+    assert api.get_device.call_count == 1
+    assert threads_during_burst <= threads_before + 1
@@ -0,0 +1,92 @@
+"""Tests for the debounced device settings writes."""
+
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import business.mqtt as business_mqtt
+from business.scheduler import DelayedTaskScheduler
+from business.settings_writer import SettingsWriteBuffer
+from metrics import METRICS
+
+
+def _device(settings):
+    return SimpleNamespace(id="device", label="Camera", settings=settings)
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_slider_burst_is_written_once_from_known_settings(monkeypatch):
+    """Changes within the debounce window end in one PUT, without reading the device again."""
+    METRICS.reset()
+    scheduler = DelayedTaskScheduler()
+    writer = SettingsWriteBuffer(scheduler, debounce=0.1)
+    monkeypatch.setattr(business_mqtt, "SETTINGS_WRITER", writer)
+    monkeypatch.setattr(business_mqtt, "REFRESH_SCHEDULER", scheduler)
+    monkeypatch.setattr(business_mqtt, "REFRESH_DELAY", 10)
+    writer.remember("site", _device({"global": {"sensitivity": 10, "lighting_duration": 30}, "object": None}))
+    api = MagicMock()
+
+    for value in range(0, 100, 5):
+        msg = SimpleNamespace(topic="somfyProtect2mqtt/site/device/sensitivity/command", payload=str(value).encode())
+        business_mqtt.consume_mqtt_message(msg, {}, api, MagicMock())
+    msg = SimpleNamespace(topic="somfyProtect2mqtt/site/device/lighting_duration/command", payload=b"60")
+    business_mqtt.consume_mqtt_message(msg, {}, api, MagicMock())
+
+    assert _wait_for(lambda: api.update_device.called)
+    time.sleep(0.2)
+    scheduler.stop()
+
+    api.get_device.assert_not_called()
+    api.update_device.assert_called_once_with(
+        site_id="site",
+        device_id="device",
+        device_label="Camera",
+        settings={"global": {"sensitivity": "95", "lighting_duration": "60"}},
+    )
+    assert METRICS.counter("settings_writes") == 1
+    assert METRICS.counter("settings_writes_coalesced") == 20
+
+
+def test_write_waits_for_the_slider_to_stop_moving():
+    """Changes closer than the debounce window keep pushing the write back, until they stop."""
+    scheduler = DelayedTaskScheduler()
+    writer = SettingsWriteBuffer(scheduler, debounce=0.4)
+    writer.remember("site", _device({"global": {"sensitivity": 10}}))
+    api = MagicMock()
+
+    for value in range(20, 70, 10):
+        writer.set(api, "site", "device", "sensitivity", value)
+        time.sleep(0.25)
+        api.update_device.assert_not_called()
+
+    assert _wait_for(lambda: api.update_device.called)
+    time.sleep(0.5)
+    scheduler.stop()
+
+    api.update_device.assert_called_once_with(
+        site_id="site", device_id="device", device_label="Camera", settings={"global": {"sensitivity": 60}}
+    )
+
+
+def test_unknown_device_is_read_once_then_remembered():
+    """Without known settings the device is read, and the written settings are kept for the next change."""
+    api = MagicMock()
+    api.get_device.return_value = _device({"global": {"sensitivity": 10}})
+    writer = SettingsWriteBuffer(MagicMock())
+
+    writer.set(api, "site", "device", "sensitivity", 50)
+    writer.flush(api, "site", "device")
+    writer.set(api, "site", "device", "night_vision", "automatic")
+    writer.flush(api, "site", "device")
+
+    api.get_device.assert_called_once()
+    assert [call.kwargs["settings"] for call in api.update_device.call_args_list] == [
+        {"global": {"sensitivity": 50}},
+        {"global": {"night_vision": "automatic"}},
+    ]
@@ -0,0 +1,94 @@
+"""Tests for the persisted state snapshot used to warm-start the bridge."""
+
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from business import warm_start
+from business.discovery_store import DiscoveryStore
+from business.snapshot import StateSnapshot
+
+MQTT_CONFIG = {"topic_prefix": "somfyProtect2mqtt", "ha_discover_prefix": "homeassistant"}
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    """Return a snapshot file path inside a temporary data directory."""
+    return str(tmp_path / "state_snapshot.json")
+
+
+def test_snapshot_round_trip(snapshot_path):
+    """Recorded sites, discovery configs and states survive a save and load."""
+    snapshot = StateSnapshot(snapshot_path)
+    snapshot.record_site("site-id", "Maison")
+    snapshot.record_discovery("homeassistant/sensor/x/config", {"name": "x"})
+    snapshot.record_state("somfyProtect2mqtt/site-id/state", {"security_level": "disarmed"})
+    snapshot.save()
+    with open(snapshot_path, encoding="utf8") as snapshot_file:
+        assert json.load(snapshot_file)["saved_at"].endswith("+00:00")
+
+    loaded = StateSnapshot(snapshot_path)
+    assert loaded.load()
+    assert loaded.sites == {"site-id": "Maison"}
+    assert loaded.discovery == {"homeassistant/sensor/x/config": {"name": "x"}}
+    assert loaded.states == {"somfyProtect2mqtt/site-id/state": {"security_level": "disarmed"}}
+
+
+def test_commit_refresh_drops_topics_not_seen_again(snapshot_path):
+    """A live refresh removes entities and sites that no longer exist."""
+    snapshot = StateSnapshot(snapshot_path)
+    snapshot.record_site("old-site", "Old")
+    snapshot.record_discovery("gone/config", {"name": "gone"})
+    snapshot.record_state("kept/state", {"a": "1"})
+
+    snapshot.begin_refresh()
+    snapshot.touch("kept/state")
+    snapshot.record_discovery("new/config", {"name": "new"})
+    snapshot.commit_refresh(["site-id"])
+
+    assert snapshot.discovery == {"new/config": {"name": "new"}}
+    assert snapshot.states == {"kept/state": {"a": "1"}}
+    assert not snapshot.sites
+
+
+def test_empty_discovery_payload_removes_entry(snapshot_path):
+    """Publishing an empty retained config forgets the entity."""
+    snapshot = StateSnapshot(snapshot_path)
+    snapshot.record_discovery("topic/config", {"name": "x"})
+    snapshot.record_discovery("topic/config", {})
+    assert not snapshot.discovery
+
+
+def test_unreadable_snapshot_is_ignored(snapshot_path):
+    """A corrupt or foreign file does not prevent a cold start."""
+    with open(snapshot_path, "w", encoding="utf8") as snapshot_file:
+        snapshot_file.write("{not json")
+    assert not StateSnapshot(snapshot_path).load()
+
+
+def test_warm_start_replays_snapshot_once(snapshot_path, monkeypatch):
+    """Warm start republishes discovery and states and subscribes command topics."""
+    with open(snapshot_path, "w", encoding="utf8") as snapshot_file:
+        json.dump(
+            {
+                "version": 1,
+                "sites": {"site-id": "Maison", "other-id": "Other"},
+                "discovery": {"discovery/config": {"name": "alarm", "command_topic": "site-id/command"}},
+                "states": {"site-id/state": {"security_level": "armed_away"}},
+            },
+            snapshot_file,
+        )
+    snapshot = StateSnapshot()
+    monkeypatch.setattr("business.STATE_SNAPSHOT", snapshot)
+    monkeypatch.setattr("business.DISCOVERY_STORE", DiscoveryStore())
+    snapshot.configure(snapshot_path)
+    mqtt_client = MagicMock()
+
+    assert warm_start(mqtt_client, MQTT_CONFIG, ["Maison"]) == ["site-id"]
+    published = [call.args[0] for call in mqtt_client.publish.call_args_list]
+    assert published == ["somfyProtect2mqtt/bridge/availability", "discovery/config", "site-id/state"]
+    mqtt_client.client.subscribe.assert_called_once_with("site-id/command")
+
+    mqtt_client.reset_mock()
+    assert warm_start(mqtt_client, MQTT_CONFIG, ["Maison"]) == ["site-id"]
+    mqtt_client.publish.assert_not_called()
@@ -0,0 +1,126 @@
+"""Tests for the disk spool of outbound MQTT messages."""
+
+import os
+import time
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+import pytest
+from constants import PUBLISH_PRIORITY_ALARM, PUBLISH_PRIORITY_FRAME, PUBLISH_PRIORITY_STATE
+from mqtt.publisher import MqttPublisher
+from mqtt.spool import MqttSpool
+
+
+def drain(spool: MqttSpool) -> list:
+    """Return every message the spool hands back."""
+    messages = []
+    while spool.pending:
+        message, _ = spool.next_message()
+        if message is not None:
+            messages.append((message.topic, message.payload))
+    return messages
+
+
+@pytest.fixture
+def spool(tmp_path):
+    """Return an opened spool with no drain rate limit."""
+    mqtt_spool = MqttSpool(str(tmp_path / "mqtt_spool"), drain_rate=1_000_000)
+    mqtt_spool.open()
+    yield mqtt_spool
+    mqtt_spool.close()
+
+
+def test_retained_states_are_deduplicated_and_alarms_kept(spool):
+    """Only the last state of a topic is replayed, every alarm transition is."""
+    spool.append("device/state", b'{"battery": "90"}', 0, True, PUBLISH_PRIORITY_STATE)
+    spool.append("site/state", b'{"security_level": "triggered"}', 0, True, PUBLISH_PRIORITY_ALARM)
+    spool.append("device/state", b'{"battery": "89"}', 0, True, PUBLISH_PRIORITY_STATE)
+    spool.append("site/state", b'{"security_level": "disarmed"}', 0, True, PUBLISH_PRIORITY_ALARM)
+
+    assert drain(spool) == [
+        ("site/state", b'{"security_level": "triggered"}'),
+        ("device/state", b'{"battery": "89"}'),
+        ("site/state", b'{"security_level": "disarmed"}'),
+    ]
+    assert not os.listdir(spool.directory)
+
+
+def test_spool_survives_a_restart(spool):
+    """Messages spooled before a restart are replayed by the next run."""
+    spool.max_segment_bytes = 64
+    for index in range(5):
+        spool.append(f"topic/{index}", "payload", 1, True, PUBLISH_PRIORITY_STATE)
+    spool.close()
+    assert len(os.listdir(spool.directory)) > 1
+
+    restarted = MqttSpool(spool.directory, drain_rate=1_000_000)
+    restarted.open()
+    assert restarted.pending == 5
+    assert [topic for topic, _ in drain(restarted)] == [f"topic/{index}" for index in range(5)]
+    restarted.append("topic/new", "payload", 1, True, PUBLISH_PRIORITY_STATE)
+    assert drain(restarted) == [("topic/new", "payload")]
+
+
+def test_restart_mid_segment_resumes_after_the_last_message_handed_back(spool):
+    """A partly drained segment is not published again from its start after a restart."""
+    for index in range(4):
+        spool.append(f"alarm/{index}", "event", 1, False, PUBLISH_PRIORITY_ALARM)
+    assert spool.next_message()[0].topic == "alarm/0"
+    assert spool.next_message()[0].topic == "alarm/1"
+    spool.close()
+
+    restarted = MqttSpool(spool.directory, drain_rate=1_000_000)
+    restarted.open()
+    assert restarted.pending == 2
+    assert [topic for topic, _ in drain(restarted)] == ["alarm/2", "alarm/3"]
+    assert not os.listdir(spool.directory)
+    restarted.append("alarm/new", "event", 1, False, PUBLISH_PRIORITY_ALARM)
+    assert drain(restarted) == [("alarm/new", "event")]
+    restarted.close()
+
+
+def test_drain_rate_is_limited(tmp_path):
+    """The spool hands messages back no faster than drain_rate."""
+    now = [100.0]
+    spool = MqttSpool(str(tmp_path), drain_rate=10, clock=lambda: now[0])
+    spool.open()
+    for index in range(3):
+        spool.append(f"topic/{index}", "payload", 0, True, PUBLISH_PRIORITY_STATE)
+
+    assert spool.next_message()[0].topic == "topic/0"
+    message, retry_after = spool.next_message()
+    assert message is None
+    assert retry_after == pytest.approx(0.1)
+    now[0] += 0.1
+    assert spool.next_message()[0].topic == "topic/1"
+    spool.close()
+
+
+def test_publisher_spools_during_outage(spool):
+    """While disconnected, only ephemeral messages stay in memory, the rest is replayed in order."""
+    published = []
+
+    def publish(topic, payload, **_options):
+        published.append((topic, payload))
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=len(published))
+
+    publisher = MqttPublisher(SimpleNamespace(publish=publish), spool=spool)
+    publisher.publish("site/state", "triggered", retain=True, priority=PUBLISH_PRIORITY_ALARM)
+    publisher.publish("site/state", "disarmed", retain=True, priority=PUBLISH_PRIORITY_ALARM)
+    for level in range(100):
+        publisher.publish("device/state", str(level), retain=True)
+    publisher.publish("camera/snapshot", b"jpeg", retain=True, priority=PUBLISH_PRIORITY_FRAME)
+    assert publisher.depth == 1
+    assert spool.pending == 102
+
+    publisher.start()
+    publisher.set_connected(True)
+    deadline = time.monotonic() + 2
+    while len(published) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    publisher.stop()
+
+    assert sorted(published) == sorted(
+        [("site/state", "triggered"), ("site/state", "disarmed"), ("device/state", "99"), ("camera/snapshot", b"jpeg")]
+    )
+    assert published.index(("site/state", "triggered")) < published.index(("site/state", "disarmed"))
@@ -0,0 +1,83 @@
+"""Tests for the device state deadband and minimum-interval filters."""
+
+import pytest
+from business.state_filter import DeviceStateFilter
+
+
+class FakeClock:
+    """Monotonic clock driven by the test."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """Return a controllable clock."""
+    return FakeClock()
+
+
+def test_without_rules_payloads_pass_through():
+    """No configured rule keeps the historical publish-everything behaviour."""
+    state_filter = DeviceStateFilter()
+    payload = {"rlink_quality": "-70"}
+    assert state_filter.apply("topic", payload) is payload
+    assert state_filter.apply("topic", payload) is payload
+
+
+def test_absolute_deadband_holds_small_changes(clock):
+    """Changes within the deadband keep the last published value."""
+    state_filter = DeviceStateFilter({"rlink_quality": {"deadband": 2}}, clock=clock)
+    assert state_filter.apply("topic", {"rlink_quality": "-70", "battery_level": "100"}) is not None
+    assert state_filter.apply("topic", {"rlink_quality": "-72", "battery_level": "100"}) is None
+    assert state_filter.apply("topic", {"rlink_quality": "-75", "battery_level": "100"}) == {
+        "rlink_quality": "-75",
+        "battery_level": "100",
+    }
+
+
+def test_held_value_is_kept_when_other_fields_change(clock):
+    """Unfiltered fields still publish, carrying the held back value along."""
+    state_filter = DeviceStateFilter({"rlink_quality": {"deadband": 2}}, clock=clock)
+    state_filter.apply("topic", {"rlink_quality": "-70", "battery_level": "100"})
+    assert state_filter.apply("topic", {"rlink_quality": "-71", "battery_level": "90"}) == {
+        "rlink_quality": "-70",
+        "battery_level": "90",
+    }
+
+
+def test_percent_deadband(clock):
+    """A relative deadband scales with the last published value."""
+    state_filter = DeviceStateFilter({"temperature": {"deadband_percent": 10}}, clock=clock)
+    state_filter.apply("topic", {"temperature": "20"})
+    assert state_filter.apply("topic", {"temperature": "21.5"}) is None
+    assert state_filter.apply("topic", {"temperature": "22.5"}) == {"temperature": "22.5"}
+
+
+def test_min_interval_delays_new_values(clock):
+    """A new value waits for the minimum interval before being published."""
+    state_filter = DeviceStateFilter({"wifi_level_percent": {"min_interval": 300}}, clock=clock)
+    state_filter.apply("topic", {"wifi_level_percent": "80"})
+    clock.now = 100
+    assert state_filter.apply("topic", {"wifi_level_percent": "60"}) is None
+    clock.now = 301
+    assert state_filter.apply("topic", {"wifi_level_percent": "60"}) == {"wifi_level_percent": "60"}
+
+
+def test_non_numeric_values_ignore_deadband(clock):
+    """Deadbands only apply to values that parse as numbers."""
+    state_filter = DeviceStateFilter({"power_mode": {"deadband": 5}}, clock=clock)
+    state_filter.apply("topic", {"power_mode": "battery"})
+    assert state_filter.apply("topic", {"power_mode": "mains"}) == {"power_mode": "mains"}
+
+
+def test_reset_lets_the_next_payload_through(clock):
+    """After a reset the same payload is published again."""
+    state_filter = DeviceStateFilter({"rlink_quality": {"deadband": 2}}, clock=clock)
+    state_filter.apply("topic", {"rlink_quality": "-70"})
+    assert state_filter.apply("topic", {"rlink_quality": "-70"}) is None
+    state_filter.reset()
+    assert state_filter.apply("topic", {"rlink_quality": "-70"}) == {"rlink_quality": "-70"}
@@ -0,0 +1,246 @@
+"""Tests for the websocket message dispatch."""
+
+# pylint: disable=protected-access
+
+import asyncio
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+import somfy_protect.websocket as websocket_module
+from business.executor import LANE_ALARM
+from metrics import METRICS
+from somfy_protect.websocket import MESSAGE_HANDLERS, SomfyProtectWebsocket
+from somfy_protect.websocket.catchup import WebsocketCatchUp
+from somfy_protect.websocket.dedupe import MessageDedupe
+from somfy_protect.websocket.forwarding import EVENT_FORWARDER
+from test_websocket_transport import FakeServer
+
+# Shaped like the events recorded on a live site, device.status being the most frequent
+RECORDED_EVENTS = [
+    '{"profiles":["admin","owner"],"site_id":"site","type":"testing","key":"device.status","device_id":"pir",'
+    '"device_lost":false,"rlink_quality":-73,"rlink_quality_percent":75,"battery_level":100,'
+    '"recalibration_required":false,"cover_present":true,"last_status_at":"2022-03-16T16:06:56.000000Z",'
+    '"diagnosis":{"is_everything_ok":true,"problems":[]},"message_id":"m1"}',
+    '{"profiles":["owner","admin"],"site_id":"site","type":"event","key":"presence_in","user_id":"user",'
+    '"device_id":"fob","device_type":"fob","message_id":"m2"}',
+    '{"profiles":["owner","admin"],"site_id":"site","type":"testing","key":"device.status","device_id":"cam",'
+    '"device_lost":false,"rlink_quality":-60,"rlink_quality_percent":88,"battery_level":90,'
+    '"last_status_at":"2022-03-16T16:07:12.000000Z","message_id":"m3"}',
+    '{"profiles":["owner","admin","guest","kid"],"site_id":"site","type":"config","key":"security.level.change",'
+    '"security_level":"armed","message_id":"m4"}',
+    '{"profiles":["owner","admin"],"site_id":"site","type":"testing","key":"site.device.testing.status",'
+    '"diagnosis":{"main_status":"ok","items":[]},"message_id":"m5"}',
+]
+
+
+class Sink:
+    """Stand-in for the transport, keeping what is sent."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message: str) -> bool:
+        """Keep message, as if it was sent."""
+        self.sent.append(message)
+        return True
+
+    def close(self):
+        """Nothing to close."""
+
+
+class Publisher:
+    """Stand-in for the MQTT client, keeping the published topics."""
+
+    def __init__(self):
+        self.topics = []
+
+    def publish(self, topic: str, _payload, **_kwargs) -> None:
+        """Keep topic, as if the message was published."""
+        self.topics.append(topic)
+
+
+@pytest.fixture
+def websocket_client(monkeypatch):
+    """SomfyProtectWebsocket without a connection."""
+    monkeypatch.setattr(websocket_module, "MESSAGE_DEDUPE", MessageDedupe())
+    monkeypatch.setattr(websocket_module, "WEBSOCKET_CATCHUP", WebsocketCatchUp())
+    sso = MagicMock()
+    sso.get_token.return_value = {"access_token": "token"}
+    config = {"mqtt": {"topic_prefix": "prefix"}, "websocket_dedupe": {"persist": False}}
+    client = SomfyProtectWebsocket(sso=sso, config=config, mqtt_client=Publisher(), api=MagicMock())
+    client._connections.active = Sink()
+    # Motion pulses reset after seconds, not in these tests
+    client._run_io_task = lambda lane, func, *args, **kwargs: None
+    client._rotate = MagicMock()
+    yield client
+    client.close()
+
+
+def test_every_event_key_has_a_handler(websocket_client):
+    """The dispatch table is bound once, with the coroutines told apart."""
+    assert set(websocket_client._handlers) == set(MESSAGE_HANDLERS)
+    assert websocket_client._handlers["video.webrtc.offer"][1]
+    assert not websocket_client._handlers["device.status"][1]
+
+
+def test_events_are_acked_then_dispatched(websocket_client):
+    """An event is acked with the pre-encoded template, published, and its latencies recorded."""
+    METRICS.reset()
+    asyncio.run(websocket_client.on_message(None, RECORDED_EVENTS[3]))
+    assert websocket_client._connections.active.sent == ['{"ack":true,"message_id":"m4","client":"Android"}']
+    assert websocket_client.mqtt_client.topics == ["prefix/site/security.level.change", "prefix/site/state"]
+    histograms = METRICS.snapshot()["histograms_ms"]
+    assert histograms["event_dispatch"]["security.level.change"]["count"] == 1
+    assert histograms["event_handler"]["security.level.change"]["count"] == 1
+
+
+def test_raw_event_republishing_follows_the_forwarding_rules(websocket_client):
+    """A denied event is only published by its handler."""
+    EVENT_FORWARDER.configure([{"match": "security.*", "forward": False}])
+    try:
+        asyncio.run(websocket_client.on_message(None, RECORDED_EVENTS[3]))
+    finally:
+        EVENT_FORWARDER.configure(None)
+    assert websocket_client.mqtt_client.topics == ["prefix/site/state"]
+
+
+def test_redelivered_event_is_acked_but_handled_once(websocket_client):
+    """An event delivered again after a reconnection does not publish twice."""
+    METRICS.reset()
+    asyncio.run(websocket_client.on_message(None, RECORDED_EVENTS[3]))
+    asyncio.run(websocket_client.on_message(None, RECORDED_EVENTS[3]))
+    assert len(websocket_client._connections.active.sent) == 2
+    assert websocket_client.mqtt_client.topics == ["prefix/site/security.level.change", "prefix/site/state"]
+    assert METRICS.counter("websocket_messages_duplicate") == 1
+
+
+def _wait_for(condition, timeout=5.0):
+    for _ in range(int(timeout * 100)):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_control_messages_are_not_acked(websocket_client):
+    """Control messages are recognized as JSON events or as raw text."""
+    asyncio.run(websocket_client.on_message(None, "websocket.connection.ready"))
+    asyncio.run(websocket_client.on_message(None, '{"key":"websocket.error.token"}'))
+    asyncio.run(websocket_client.on_message(None, '{"error":"websocket.error.token"}'))
+    assert websocket_client._connections.active.sent == []
+    # Tokens are refreshed off the websocket loop, then rotations scheduled on it
+    assert _wait_for(lambda: websocket_client._rotate.call_count == 2)
+    assert websocket_client.sso.refresh_tokens.call_count == 2
+
+
+def test_rotation_opens_the_new_connection_before_closing_the_old_one(websocket_client):
+    """Events delivered on both connections during a switch-over are acked on each and handled once."""
+    METRICS.reset()
+    del websocket_client._rotate
+    server = FakeServer(messages=[RECORDED_EVENTS[3]])
+    url = asyncio.run_coroutine_threadsafe(server.start(), websocket_client.loop).result()
+    websocket_client._websocket_url = lambda: url
+    websocket_client._connections.active = websocket_client._new_transport()
+    runner = threading.Thread(target=websocket_client.run_forever, daemon=True)
+    runner.start()
+    assert _wait_for(lambda: len(server.received) == 1)
+
+    websocket_client._call_on_loop(websocket_client._rotate, "test")
+    assert _wait_for(lambda: len(server.received) == 2 and websocket_client._connections.standby is None)
+    assert server.connections == 2
+    assert websocket_client.mqtt_client.topics == ["prefix/site/security.level.change", "prefix/site/state"]
+    assert METRICS.counter("websocket_rotations") == 1
+    assert runner.is_alive()
+
+    # Stop listening, the connection is closed by the client
+    websocket_client._call_on_loop(server.server.close)
+    websocket_client.close()
+    runner.join(timeout=5)
+    assert not runner.is_alive()
+
+
+def test_reconnection_catches_up_since_the_last_event(websocket_client):
+    """The first connection does not catch up, a reconnection does, from the last event."""
+    tasks = []
+    websocket_client._run_io_task = lambda lane, func, *args, **kwargs: tasks.append((lane, args))
+    websocket_client._on_open(None)
+    assert not tasks
+    asyncio.run(websocket_client.on_message(None, RECORDED_EVENTS[0]))
+    websocket_client._on_open(None)
+    assert len(tasks) == 1
+    lane, args = tasks[0]
+    assert lane == LANE_ALARM
+    assert args[4] == websocket_client.last_message_at
+
+
+def test_repeated_pulses_extend_the_pulse(websocket_client):
+    """Each trigger re-arms the reset of its topic, which is published once."""
+    METRICS.reset()
+    for _ in range(3):
+        websocket_client._pulse_reset("prefix/site/pir/motion_sensor", "motion_sensor", delay=0.3)
+        time.sleep(0.1)
+    websocket_client._pulse_reset("prefix/site/door/ringing", "ringing", delay=0.01)
+    # 0.4s after the first trigger, 0.2s after the last one
+    time.sleep(0.1)
+    assert websocket_client.mqtt_client.topics == ["prefix/site/door/ringing"]
+    time.sleep(0.25)
+    assert websocket_client.mqtt_client.topics == ["prefix/site/door/ringing", "prefix/site/pir/motion_sensor"]
+    assert METRICS.counter("pulse_resets_rearmed") == 2
+
+
+def test_pending_pulses_are_reset_on_close(websocket_client):
+    """Closing the websocket does not leave a motion sensor on."""
+    websocket_client._pulse_reset("prefix/site/pir/motion_sensor", "motion_sensor", delay=60)
+    websocket_client.close()
+    assert websocket_client.mqtt_client.topics == ["prefix/site/pir/motion_sensor"]
+
+
+def test_a_stream_over_the_cap_is_published_as_refused(monkeypatch):
+    """A camera stream refused for the configured cap is reported on its state topic."""
+    monkeypatch.setattr(websocket_module, "MESSAGE_DEDUPE", MessageDedupe())
+    monkeypatch.setattr(websocket_module, "WEBSOCKET_CATCHUP", WebsocketCatchUp())
+    release = threading.Event()
+    monkeypatch.setattr("somfy_protect.websocket.handlers.video.stream_video_to_mqtt", lambda *_args: release.wait(5))
+    sso = MagicMock()
+    sso.get_token.return_value = {"access_token": "token"}
+    config = {
+        "mqtt": {"topic_prefix": "prefix"},
+        "websocket_dedupe": {"persist": False},
+        "streaming": "mqtt",
+        "max_streams": 1,
+    }
+    client = SomfyProtectWebsocket(sso=sso, config=config, mqtt_client=Publisher(), api=MagicMock())
+    client._connections.active = Sink()
+    try:
+        for device_id in ("cam1", "cam1", "cam2"):
+            client._video_stream_ready({"site_id": "site", "device_id": device_id, "stream_url": "rtsp://cam"})
+        assert "prefix/site/cam2/stream/state" in client.mqtt_client.topics
+        assert "prefix/site/cam1/stream/state" not in client.mqtt_client.topics
+    finally:
+        release.set()
+        client.close()
+
+
+@pytest.mark.benchmark
+def test_dispatch_benchmark(websocket_client, benchmark_report):
+    """Measure messages per second on one core, from the raw event to the MQTT publish."""
+    rounds = 1000
+    stream = [
+        event.replace('"message_id":"', f'"message_id":"{index}-')
+        for index in range(rounds)
+        for event in RECORDED_EVENTS
+    ]
+
+    async def feed():
+        for message in stream:
+            await websocket_client.on_message(None, message)
+
+    start = time.perf_counter()
+    asyncio.run(feed())
+    elapsed = time.perf_counter() - start
+    benchmark_report(
+        f"{len(stream)} recorded events in {elapsed * 1000:.1f} ms ({len(stream) / elapsed:.0f} msgs/s per core)"
+    )
+    assert len(websocket_client._connections.active.sent) == len(stream)
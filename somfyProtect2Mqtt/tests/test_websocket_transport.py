@@ -0,0 +1,205 @@
+"""Tests for the asyncio websocket transport."""
+
+import asyncio
+import time
+
+import pytest
+from somfy_protect.websocket.transport import (
+    OPCODE_CLOSE,
+    OPCODE_PING,
+    OPCODE_PONG,
+    OPCODE_TEXT,
+    AsyncWebsocketTransport,
+    accept_key,
+    encode_frame,
+    read_frame,
+)
+
+
+class FakeServer:
+    """Websocket server sending scripted messages, answering pings when asked."""
+
+    def __init__(self, messages=(), answer_pings=True):
+        self.messages = list(messages)
+        self.answer_pings = answer_pings
+        self.connections = 0
+        self.received = []
+        self.server = None
+
+    async def start(self) -> str:
+        """Listen on a free port and return the websocket URL."""
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"ws://127.0.0.1:{port}/events/websocket?token=abc"
+
+    async def stop(self) -> None:
+        """Stop listening."""
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        request = (await reader.readuntil(b"\r\n\r\n")).decode()
+        headers = dict(line.split(": ", 1) for line in request.split("\r\n")[1:] if line)
+        key = headers["Sec-WebSocket-Key"]
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n".encode()
+        )
+        for message in self.messages:
+            writer.write(encode_frame(message, mask=False))
+        try:
+            while True:
+                _fin, opcode, payload = await read_frame(reader)
+                if opcode == OPCODE_TEXT:
+                    self.received.append(payload.decode())
+                elif opcode == OPCODE_PING and self.answer_pings:
+                    writer.write(encode_frame(payload, OPCODE_PONG, mask=False))
+                elif opcode == OPCODE_CLOSE:
+                    writer.write(encode_frame(payload, OPCODE_CLOSE, mask=False))
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+
+
+def test_messages_are_dispatched_in_order_and_sent_back():
+    """Text messages reach the handler in order, replies are masked frames the server decodes."""
+
+    async def scenario():
+        server = FakeServer(messages=[f'{{"message_id":"{index}"}}' for index in range(50)] + ["é" * 70000])
+        url = await server.start()
+        received = []
+
+        async def on_message(ws, message):
+            received.append(message)
+            if len(received) == 51:
+                assert ws.send("ack")
+                ws.close()
+
+        transport = AsyncWebsocketTransport(lambda: url, on_message, ping_interval=0)
+        await asyncio.wait_for(transport.run_forever(), timeout=5)
+        await server.stop()
+        return server, received
+
+    server, received = asyncio.run(scenario())
+    assert received[:50] == [f'{{"message_id":"{index}"}}' for index in range(50)]
+    assert received[50] == "é" * 70000
+    assert server.received == ["ack"]
+    assert server.connections == 1
+
+
+def test_missing_pong_reconnects_with_a_fresh_url():
+    """A server that stops answering pings is dropped and a new connection is opened."""
+
+    async def scenario():
+        server = FakeServer(answer_pings=False)
+        url = await server.start()
+        urls = []
+        opened = []
+        errors = []
+
+        def next_url():
+            urls.append(url)
+            return url
+
+        def on_open(ws):
+            opened.append(time.monotonic())
+            if len(opened) == 2:
+                ws.close()
+
+        async def on_message(_ws, _message):
+            return None
+
+        transport = AsyncWebsocketTransport(
+            next_url,
+            on_message,
+            on_open=on_open,
+            on_error=lambda _ws, error: errors.append(error),
+            ping_interval=0.05,
+            ping_timeout=0.05,
+            reconnect=0.05,
+        )
+        await asyncio.wait_for(transport.run_forever(), timeout=5)
+        await server.stop()
+        return server, urls, errors
+
+    server, urls, errors = asyncio.run(scenario())
+    assert server.connections == 2
+    assert len(urls) == 2
+    assert errors
+
+
+def test_missing_pong_aborts_the_connection():
+    """A half-open connection is aborted, not closed gracefully, so the reconnection is not delayed."""
+
+    async def scenario():
+        server = FakeServer(answer_pings=False)
+        url = await server.start()
+        aborted = []
+
+        def on_open(ws):
+            if aborted:
+                ws.close()
+                return
+            tcp = ws._writer.transport  # pylint: disable=protected-access
+            abort = tcp.abort
+
+            def spy():
+                aborted.append(True)
+                abort()
+
+            tcp.abort = spy
+
+        async def on_message(_ws, _message):
+            return None
+
+        transport = AsyncWebsocketTransport(
+            lambda: url, on_message, on_open=on_open, ping_interval=0.05, ping_timeout=0.05, reconnect=0.05
+        )
+        await asyncio.wait_for(transport.run_forever(), timeout=5)
+        await server.stop()
+        return aborted
+
+    assert asyncio.run(scenario()) == [True]
+
+
+def test_send_without_connection_is_refused():
+    """Messages are not queued while disconnected."""
+
+    async def on_message(_ws, _message):
+        return None
+
+    assert not AsyncWebsocketTransport(lambda: "ws://127.0.0.1:1/", on_message).send("hello")
+
+
+@pytest.mark.benchmark
+def test_dispatch_benchmark(benchmark_report):
+    """Measure messages per second from the socket to the handler."""
+    messages = 5000
+
+    async def scenario():
+        payload = '{"key":"device.status","site_id":"site","device_id":"device","message_id":"id","battery_level":90}'
+        server = FakeServer(messages=[payload] * messages)
+        url = await server.start()
+        count = 0
+        done = asyncio.Event()
+
+        async def on_message(_ws, _message):
+            nonlocal count
+            count += 1
+            if count == messages:
+                done.set()
+
+        transport = AsyncWebsocketTransport(lambda: url, on_message, ping_interval=0)
+        start = time.perf_counter()
+        runner = asyncio.create_task(transport.run_forever())
+        await asyncio.wait_for(done.wait(), timeout=10)
+        elapsed = time.perf_counter() - start
+        transport.close()
+        await runner
+        await server.stop()
+        return elapsed
+
+    elapsed = asyncio.run(scenario())
+    benchmark_report(f"{messages} websocket messages in {elapsed * 1000:.1f} ms ({messages / elapsed:.0f} msgs/s)")
@@ -0,0 +1,46 @@
+"""Websocket event tracing
+
+The websocket event being handled is kept in a context variable, so that the
+MQTT messages it publishes, directly or from an IO lane, carry it to the
+publisher. Per event key, latencies go to the METRICS histograms:
+
+- ``event_dispatch``: from the receipt in on_message to the handler call,
+- ``event_handler``: handler run time,
+- ``event_publish``: from the receipt to the broker acknowledging each message
+  published (written to the socket, for QoS 0).
+"""
+
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from metrics import METRICS
+
+
+class EventTrace:
+    """Websocket event being handled.
+
+    Args:
+        key (str): Event key.
+        received_at (float): time.monotonic() of the receipt.
+        event_time (str | None): occurred_at of the event, sent along with MQTT v5.
+    """
+
+    __slots__ = ("key", "received_at", "event_time")
+
+    def __init__(self, key: str, received_at: float, event_time: Optional[str] = None):
+        self.key = key
+        self.received_at = received_at
+        self.event_time = event_time
+
+    def observe(self, stage: str, now: Optional[float] = None) -> None:
+        """Record the time elapsed since the receipt in the histogram of a stage.
+
+        Args:
+            stage (str): "dispatch" or "publish".
+            now (float | None): time.monotonic() at the end of the stage, now when None.
+        """
+        METRICS.histogram(f"event_{stage}", self.key, (time.monotonic() if now is None else now) - self.received_at)
+
+
+EVENT_TRACE: ContextVar[Optional[EventTrace]] = ContextVar("event_trace", default=None)
@@ -1,9 +1,11 @@
 """Utils package"""
 
 import codecs
+import json
 import logging
 import logging.handlers
 import os
+import tempfile
 from typing import Any, Dict, Iterable
 
 import yaml
@@ -104,3 +106,55 @@ def build_retry_adapter(status_forcelist: Iterable[int]) -> HTTPAdapter:
         raise_on_status=False,
     )
     return HTTPAdapter(max_retries=retry)
+
+
+def resolve_data_path(config: Dict[str, Any], filename: str) -> str:
+    """Resolve where a persisted state file lives.
+
+    Args:
+        config (Dict[str, Any]): Global configuration.
+        filename (str): State file name.
+
+    Returns:
+        str: Path inside ``data_dir``, or relative to the working directory when unset.
+    """
+    data_dir = config.get("data_dir")
+    if data_dir:
+        return os.path.join(data_dir, filename)
+    return filename
+
+
+def read_json_file(path: str) -> Any:
+    """Read a JSON file, returning None when it is missing or unreadable.
+
+    Args:
+        path (str): File path.
+
+    Returns:
+        Any: Decoded content, or None.
+    """
+    try:
+        with open(path, "r", encoding="utf8") as json_file:
+            return json.load(json_file)
+    except (IOError, ValueError):
+        return None
+
+
+def write_json_file(path: str, content: Any) -> None:
+    """Atomically write a JSON file readable by its owner only.
+
+    Args:
+        path (str): File path.
+        content (Any): JSON serializable content.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".state-", dir=directory, text=True)
+    try:
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, mode="w", encoding="utf8") as json_file:
+            json.dump(content, json_file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,133 @@
+"""Base of the stores kept in a versioned JSON file"""
+
+import abc
+import logging
+import threading
+from typing import Optional
+
+from utils import read_json_file, write_json_file
+
+LOGGER = logging.getLogger(__name__)
+
+
+class PersistedJsonStore(abc.ABC):
+    """In-memory store, saved to a JSON file when it changed.
+
+    Subclasses set ``VERSION`` and ``DESCRIPTION``, and implement ``_dump``,
+    ``_restore`` and ``_summary``, all called with ``_lock`` held. Their
+    changes set ``_dirty`` so that the next ``save`` writes the file.
+
+    A refresh is bracketed by ``begin_refresh`` and the ``commit_refresh`` of
+    the subclass: keys marked with ``_touch`` meanwhile are still current, the
+    others are removed by ``_forget_untouched``.
+
+    Args:
+        path (str | None): Store file, None keeps the store in memory only.
+    """
+
+    VERSION = 1
+    DESCRIPTION = "store"
+
+    def __init__(self, path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self.path = path
+        self._dirty = False
+        self._touched: Optional[set[str]] = None
+
+    def configure(self, path: Optional[str]) -> None:
+        """Set the store file path and load it.
+
+        Args:
+            path (str | None): Store file, None keeps the store in memory only.
+        """
+        if path == self.path:
+            return
+        self.path = path
+        self.load()
+
+    def load(self) -> bool:
+        """Load the store file.
+
+        Returns:
+            bool: True when a file of this version was loaded.
+        """
+        if not self.path:
+            return False
+        content = read_json_file(self.path)
+        if not isinstance(content, dict) or content.get("version") != self.VERSION:
+            return False
+        try:
+            with self._lock:
+                self._restore(content)
+                self._dirty = False
+                summary = self._summary()
+        except (AttributeError, TypeError, ValueError):
+            LOGGER.warning("Ignoring invalid {} file {}".format(self.DESCRIPTION, self.path))
+            return False
+        LOGGER.info("Loaded {} from {}: {}".format(self.DESCRIPTION, self.path, summary))
+        return True
+
+    def save(self) -> None:
+        """Write the store to disk when it changed since the last save."""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            content = {"version": self.VERSION, **self._dump()}
+            self._dirty = False
+        try:
+            write_json_file(self.path, content)
+        except OSError as e:
+            LOGGER.warning("Unable to save {} {}: {}".format(self.DESCRIPTION, self.path, e))
+            with self._lock:
+                self._dirty = True
+
+    def begin_refresh(self) -> None:
+        """Start tracking which keys a refresh marks as current."""
+        with self._lock:
+            self._touched = set()
+
+    def touch(self, key: str) -> None:
+        """Mark a key as still current without changing what is stored."""
+        with self._lock:
+            self._touch(key)
+
+    def _touch(self, key: str) -> None:
+        if self._touched is not None:
+            self._touched.add(key)
+
+    def _end_refresh(self) -> set[str]:
+        """Stop tracking, with _lock held.
+
+        Returns:
+            set[str]: Keys marked as current during the refresh.
+        """
+        touched = self._touched or set()
+        self._touched = None
+        return touched
+
+    def _forget_untouched(self, store: dict, touched: set[str]) -> list[str]:
+        """Remove the keys of store not marked as current, with _lock held.
+
+        Returns:
+            list[str]: Removed keys, sorted.
+        """
+        removed = sorted(key for key in store if key not in touched)
+        for key in removed:
+            del store[key]
+        if removed:
+            self._dirty = True
+        return removed
+
+    @abc.abstractmethod
+    def _dump(self) -> dict:
+        """Return the content to save, besides its version."""
+
+    @abc.abstractmethod
+    def _restore(self, content: dict) -> None:
+        """Replace the store with the content of its file."""
+
+    @abc.abstractmethod
+    def _summary(self) -> str:
+        """Describe what the store holds, for the logs."""